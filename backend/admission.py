@@ -0,0 +1,232 @@
+import asyncio
+import math
+import time
+from collections import deque
+from fastapi import status
+from fastapi.responses import JSONResponse
+import metrics
+from config import (
+    QUERY_MAX_CONCURRENCY, QUERY_MAX_QUEUED, UPLOAD_MAX_CONCURRENCY, UPLOAD_MAX_QUEUED,
+    UPLOAD_MAX_BYTES_IN_FLIGHT, ADMISSION_QUEUE_TIMEOUT, INGEST_MAX_DEFER,
+)
+
+# Route class of each path; other routes are not limited
+ROUTE_CLASSES = {
+    "/query": "query",
+    "/query/batch": "query",
+    "/search": "query",
+    "/json-query": "query",
+    "/upload": "upload",
+    "/upload/bulk": "upload",
+}
+
+# Bounds of the Retry-After estimate, in seconds
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+# Weight of the newest request in the moving average of service times
+SERVICE_TIME_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    """A request was not admitted; carries the status code and Retry-After seconds to answer with."""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """
+    Concurrency (and optionally byte) budget of one route class.
+
+    Up to max_concurrent requests run at once; up to max_queued more wait
+    for a turn in arrival order, each for at most queue_timeout seconds.
+    Beyond that requests are rejected right away (429), and a request that
+    waited too long is rejected with 503. With max_bytes, the request bodies
+    in flight (by Content-Length) must also fit; a single request larger
+    than the whole budget is admitted only when nothing else runs.
+    """
+
+    def __init__(self, name, max_concurrent, max_queued, max_bytes=None, queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_bytes = max_bytes
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.bytes_in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.service_time = 0.1  # moving average, seconds
+        self._waiters = deque()  # (future, size) in arrival order
+        self._idle_waiters = set()
+
+    def _fits(self, size):
+        if self.in_flight >= self.max_concurrent:
+            return False
+        if self.max_bytes is None or self.in_flight == 0:
+            return True
+        return self.bytes_in_flight + size <= self.max_bytes
+
+    def retry_after(self):
+        """Seconds until a turn is likely free: the queue ahead, served max_concurrent at a time."""
+        estimate = self.service_time * (len(self._waiters) + 1) / self.max_concurrent
+        return max(MIN_RETRY_AFTER, min(MAX_RETRY_AFTER, math.ceil(estimate)))
+
+    async def acquire(self, size=0):
+        """Wait for a turn; raises Overloaded when the class is over budget."""
+        if not self._waiters and self._fits(size):
+            self._admit(size)
+            return
+        if len(self._waiters) >= self.max_queued:
+            self.rejected += 1
+            metrics.ADMISSION.inc(route_class=self.name, outcome="rejected")
+            raise Overloaded(f"Too many {self.name} requests, try again later", status.HTTP_429_TOO_MANY_REQUESTS, self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, size)
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            # Unless the turn came just as the wait timed out
+            if not future.done():
+                self._waiters.remove(waiter)
+                future.cancel()
+                self.timed_out += 1
+                metrics.ADMISSION.inc(route_class=self.name, outcome="timed_out")
+                raise Overloaded(
+                    f"Timed out waiting for a {self.name} slot, try again later",
+                    status.HTTP_503_SERVICE_UNAVAILABLE, self.retry_after(),
+                )
+        except asyncio.CancelledError:
+            # The client went away while waiting
+            if future.done():
+                self.release(size)
+            else:
+                self._waiters.remove(waiter)
+                future.cancel()
+            raise
+        finally:
+            metrics.observe_stage(self.name, "queue_wait", time.perf_counter() - started)
+
+    def _admit(self, size):
+        self.in_flight += 1
+        self.bytes_in_flight += size
+        self.admitted += 1
+        metrics.ADMISSION.inc(route_class=self.name, outcome="admitted")
+
+    def release(self, size=0, seconds=None):
+        self.in_flight -= 1
+        self.bytes_in_flight -= size
+        if seconds is not None:
+            self.service_time += SERVICE_TIME_ALPHA * (seconds - self.service_time)
+        # Hand freed capacity to waiters in arrival order
+        while self._waiters and self._fits(self._waiters[0][1]):
+            future, waiting_size = self._waiters.popleft()
+            self._admit(waiting_size)
+            future.set_result(None)
+        if not self.in_flight:
+            for future in self._idle_waiters:
+                if not future.done():
+                    future.set_result(None)
+            self._idle_waiters = set()
+
+    async def wait_idle(self, timeout):
+        """Wait until no request of this class runs, for at most timeout seconds."""
+        if not self.in_flight:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._idle_waiters.add(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # release() may have handed out the waiters just as the wait timed out
+            self._idle_waiters.discard(future)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "bytes_in_flight": self.bytes_in_flight if self.max_bytes is not None else None,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+gates = {
+    "query": AdmissionGate("query", QUERY_MAX_CONCURRENCY, QUERY_MAX_QUEUED),
+    "upload": AdmissionGate("upload", UPLOAD_MAX_CONCURRENCY, UPLOAD_MAX_QUEUED, max_bytes=UPLOAD_MAX_BYTES_IN_FLIGHT),
+}
+
+
+class DeferBudget:
+    """Seconds an ingestion job may still spend waiting for queries, shared by all of its steps."""
+
+    def __init__(self, seconds=INGEST_MAX_DEFER):
+        self.remaining = seconds
+
+
+async def yield_to_queries(budget=None):
+    """
+    Let running queries finish before the next step of an ingestion job.
+
+    Ingestion waits while any query runs, but with a budget never longer
+    than the job's remaining DeferBudget (without one, INGEST_MAX_DEFER per
+    step), so a steady query load delays a job by at most INGEST_MAX_DEFER
+    however many steps it has.
+    """
+    max_defer = INGEST_MAX_DEFER if budget is None else budget.remaining
+    if max_defer <= 0:
+        return
+    started = time.perf_counter()
+    await gates["query"].wait_idle(max_defer)
+    if budget is not None:
+        budget.remaining -= time.perf_counter() - started
+
+
+def overloaded_response(e):
+    return JSONResponse(
+        status_code=e.status_code,
+        content={"error": str(e)},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits each request to its route class's gate.
+
+    The turn is held until the response body has been sent, so streaming
+    responses (bulk uploads) count for as long as they run.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        gate = gates.get(ROUTE_CLASSES.get(scope.get("path"))) if scope["type"] == "http" else None
+        if gate is None or scope.get("method") == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        size = 0
+        if gate.max_bytes is not None:
+            for name, value in scope.get("headers", []):
+                if name == b"content-length" and value.isdigit():
+                    size = int(value)
+        try:
+            await gate.acquire(size)
+        except Overloaded as e:
+            await overloaded_response(e)(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release(size, time.perf_counter() - started)
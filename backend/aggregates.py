@@ -0,0 +1,322 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+import uuid
+from array import array
+from collections import OrderedDict
+import numpy as np
+from config import AGGREGATES_PATH, MAX_GROUP_CARDINALITY
+
+OPERATIONS = ["max", "min", "sum", "avg", "count", "median", "percentile"]
+LOADED_SIDECARS = 32
+
+
+class FieldNotFoundError(KeyError):
+    """The requested field does not occur in any record of the document."""
+
+
+class NonNumericFieldError(ValueError):
+    """The requested field holds values that cannot be aggregated numerically."""
+
+
+class ColumnBuilder:
+    """
+    Collects the fields of JSON records into columns, one record at a time.
+
+    Numeric fields become float64 columns (NaN where a record lacks the field);
+    string fields become dictionary-encoded columns usable for group-by, as
+    long as they have at most max_categories distinct values.
+    """
+
+    def __init__(self, max_categories=MAX_GROUP_CARDINALITY):
+        self.max_categories = max_categories
+        self.count = 0
+        self._numeric = {}
+        self._all_int = {}
+        self._non_numeric = {}
+        self._codes = {}
+        self._labels = {}
+        self._too_many_groups = set()
+
+    def add(self, record):
+        if isinstance(record, dict):
+            for field, value in record.items():
+                if isinstance(value, (int, float)) and not (isinstance(value, float) and math.isnan(value)):
+                    column = self._numeric.get(field)
+                    if column is None:
+                        column = self._numeric[field] = array("d", [math.nan]) * self.count
+                        self._all_int[field] = True
+                    column.append(value)
+                    if not isinstance(value, int):
+                        self._all_int[field] = False
+                    continue
+
+                self._non_numeric[field] = self._non_numeric.get(field, 0) + 1
+                if isinstance(value, str) and field not in self._too_many_groups:
+                    labels = self._labels.get(field)
+                    if labels is None:
+                        labels = self._labels[field] = {}
+                        self._codes[field] = array("i", [-1]) * self.count
+                    code = labels.get(value)
+                    if code is None:
+                        if len(labels) >= self.max_categories:
+                            self._too_many_groups.add(field)
+                            del self._labels[field], self._codes[field]
+                            continue
+                        code = labels[value] = len(labels)
+                    self._codes[field].append(code)
+
+        # Pad columns the record did not fill so every column stays aligned
+        self.count += 1
+        for column in self._numeric.values():
+            if len(column) < self.count:
+                column.append(math.nan)
+        for column in self._codes.values():
+            if len(column) < self.count:
+                column.append(-1)
+
+    def build(self):
+        """Freeze the collected columns into a ColumnarAggregates."""
+        manifest = {"records": self.count, "numeric": {}, "categorical": {}}
+        arrays = {}
+        for i, (field, column) in enumerate(self._numeric.items()):
+            values = np.frombuffer(column, dtype=np.float64)
+            present = np.sort(values[~np.isnan(values)])
+            manifest["numeric"][field] = {
+                "key": f"n{i}",
+                "count": int(len(present)),
+                "sum": float(present.sum()),
+                "min": float(present[0]),
+                "max": float(present[-1]),
+                "mean": float(present.mean()),
+                "integer": self._all_int[field],
+                "non_numeric": self._non_numeric.get(field, 0),
+            }
+            arrays[f"n{i}"] = values
+            arrays[f"s{i}"] = present
+        for i, (field, column) in enumerate(self._codes.items()):
+            labels = self._labels[field]
+            dtype = np.int16 if len(labels) < 2 ** 15 else np.int32
+            manifest["categorical"][field] = {"key": f"c{i}", "labels": list(labels)}
+            arrays[f"c{i}"] = np.frombuffer(column, dtype=np.int32).astype(dtype)
+        for field, count in self._non_numeric.items():
+            if field not in self._numeric:
+                manifest["numeric"][field] = {"key": None, "count": 0, "non_numeric": count}
+        return ColumnarAggregates(manifest, arrays)
+
+
+class ColumnarAggregates:
+    """
+    Column arrays and precomputed per-field statistics for one JSON document.
+
+    max/min/sum/avg/count are read from the precomputed summary, median and
+    percentiles index into a pre-sorted copy of the column, and group-by
+    operations are vectorised over the dictionary-encoded string column.
+    """
+
+    def __init__(self, manifest, arrays):
+        self.manifest = manifest
+        self.arrays = arrays
+
+    def save(self, path):
+        """Write the sidecar directory (manifest.json plus one .npy per array)."""
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for key, values in self.arrays.items():
+            np.save(os.path.join(tmp_path, f"{key}.npy"), values)
+        with open(os.path.join(tmp_path, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Open a sidecar directory; column arrays are memory-mapped, not read."""
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        arrays = {
+            name[:-4]: np.load(os.path.join(path, name), mmap_mode="r")
+            for name in os.listdir(path) if name.endswith(".npy")
+        }
+        return cls(manifest, arrays)
+
+    def _numeric_field(self, field):
+        stats = self.manifest["numeric"].get(field)
+        if stats is None:
+            if field in self.manifest["categorical"]:
+                raise NonNumericFieldError(field)
+            raise FieldNotFoundError(field)
+        if stats["non_numeric"] or stats["key"] is None:
+            raise NonNumericFieldError(field)
+        return stats
+
+    @staticmethod
+    def _percentile(sorted_values, q):
+        position = q / 100 * (len(sorted_values) - 1)
+        lower = int(position)
+        upper = min(lower + 1, len(sorted_values) - 1)
+        return float(sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower))
+
+    def aggregate(self, field, operation, percentile=None, group_by=None):
+        """
+        Aggregate a numeric field.
+
+        Args:
+            field: Numeric field to aggregate
+            operation: One of OPERATIONS
+            percentile: Percentile (0-100) for the "percentile" operation
+            group_by: Optional string field; returns one result per distinct value
+
+        Returns:
+            A number, or a dict mapping group label to number when group_by is set
+        """
+        stats = self._numeric_field(field)
+        if group_by is not None:
+            return self._aggregate_groups(stats, field, operation, percentile, group_by)
+
+        if operation == "count":
+            return stats["count"]
+        if operation == "avg":
+            return stats["mean"]
+        if operation in ("max", "min", "sum"):
+            result = stats[operation]
+        else:
+            q = 50 if operation == "median" else percentile
+            return self._percentile(self.arrays[f"s{stats['key'][1:]}"], q)
+        return int(result) if stats["integer"] else result
+
+    def _aggregate_groups(self, stats, field, operation, percentile, group_by):
+        group = self.manifest["categorical"].get(group_by)
+        if group is None:
+            raise FieldNotFoundError(group_by)
+        values = np.asarray(self.arrays[stats["key"]])
+        codes = np.asarray(self.arrays[group["key"]]).astype(np.int64)
+        mask = (codes >= 0) & ~np.isnan(values)
+        codes, values = codes[mask], values[mask]
+        labels = group["labels"]
+        integer = stats["integer"]
+
+        if operation in ("sum", "avg", "count"):
+            counts = np.bincount(codes, minlength=len(labels))
+            sums = np.bincount(codes, weights=values, minlength=len(labels))
+            present = np.flatnonzero(counts)
+            if operation == "count":
+                return {labels[i]: int(counts[i]) for i in present}
+            if operation == "sum":
+                return {labels[i]: int(sums[i]) if integer else float(sums[i]) for i in present}
+            return {labels[i]: float(sums[i] / counts[i]) for i in present}
+
+        # Sort by (group, value) so every group is a contiguous, sorted run
+        order = np.lexsort((values, codes))
+        codes, values = codes[order], values[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        ends = np.r_[starts[1:], len(codes)]
+        if operation == "min":
+            results = values[starts]
+        elif operation == "max":
+            results = values[ends - 1]
+        else:
+            q = 50 if operation == "median" else percentile
+            position = starts + q / 100 * (ends - starts - 1)
+            lower = position.astype(np.int64)
+            upper = np.minimum(lower + 1, ends - 1)
+            results = values[lower] + (values[upper] - values[lower]) * (position - lower)
+            integer = False
+        return {
+            labels[code]: int(result) if integer else float(result)
+            for code, result in zip(codes[starts].tolist(), results.tolist())
+        }
+
+
+_loaded = OrderedDict()
+_lock = threading.Lock()
+# Bumped whenever a sidecar is replaced or deleted, so columns loaded while it happened are not cached
+_generation = 0
+
+
+def sidecar_path(filename):
+    """Directory holding the sidecar of a document."""
+    return os.path.join(AGGREGATES_PATH, hashlib.sha1(filename.encode("utf-8")).hexdigest())
+
+
+def build_from_records(records):
+    builder = ColumnBuilder()
+    for record in records:
+        builder.add(record)
+    return builder.build()
+
+
+def _write_sidecar(filename, aggregates):
+    """Write a sidecar next to the document's, to be moved into place with install_sidecar."""
+    os.makedirs(AGGREGATES_PATH, exist_ok=True)
+    built_path = f"{sidecar_path(filename)}.{uuid.uuid4().hex}"
+    aggregates.save(built_path)
+    return built_path
+
+
+def _replace_sidecar(filename, built_path):
+    # Called with _lock held
+    global _generation
+    path = sidecar_path(filename)
+    shutil.rmtree(path, ignore_errors=True)
+    if built_path is not None:
+        os.replace(built_path, path)
+    _loaded.pop(filename, None)
+    _generation += 1
+
+
+def save_sidecar(filename, aggregates):
+    install_sidecar(filename, _write_sidecar(filename, aggregates))
+
+
+def install_sidecar(filename, built_path):
+    """Move a sidecar written elsewhere (e.g. by an ingestion worker) into place."""
+    with _lock:
+        _replace_sidecar(filename, built_path)
+
+
+def delete_sidecar(filename):
+    with _lock:
+        _replace_sidecar(filename, None)
+
+
+def get_aggregates(filename, store):
+    """
+    Return the columnar aggregates of a JSON document.
+
+    Documents ingested before sidecars existed are rebuilt once from their
+    stored chunks and the sidecar is written for subsequent requests. Columns
+    loaded while a sidecar was being replaced are returned but not cached, so
+    they cannot outlive the replacement.
+    """
+    with _lock:
+        if filename in _loaded:
+            _loaded.move_to_end(filename)
+            return _loaded[filename]
+        generation = _generation
+
+    path = sidecar_path(filename)
+    if os.path.exists(os.path.join(path, "manifest.json")):
+        aggregates = ColumnarAggregates.load(path)
+    else:
+        aggregates = build_from_records(json.loads(chunk["text_chunk"]) for chunk in store.fetch_chunks(filename))
+        built_path = _write_sidecar(filename, aggregates)
+        with _lock:
+            # Rebuilt from chunks that have since been replaced: keep the newer sidecar
+            current = _generation == generation
+            if current:
+                _replace_sidecar(filename, built_path)
+                generation = _generation
+        if not current:
+            shutil.rmtree(built_path, ignore_errors=True)
+
+    with _lock:
+        if _generation == generation:
+            _loaded[filename] = aggregates
+            while len(_loaded) > LOADED_SIDECARS:
+                _loaded.popitem(last=False)
+    return aggregates
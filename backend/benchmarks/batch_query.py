@@ -0,0 +1,100 @@
+"""
+Benchmark POST /query/batch against the same workload sent as sequential
+GET /query calls.
+
+Runs the API in-process on a throwaway local vector store filled with
+synthetic documents. Each query is unique per run, so neither side is
+served from the query caches. --embed-latency-ms adds a fixed delay to every
+embedding call to model the round-trip to a hosted provider such as Cohere
+(0 measures the offline embedder alone).
+
+Usage (from backend/):
+    python benchmarks/batch_query.py
+    python benchmarks/batch_query.py --queries 200 --batch-size 50 --embed-latency-ms 80
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = (
+    "the system shall restart the pump when pressure exceeds the configured limit "
+    "operator manual section valve controller sensor maintenance interval warning"
+).split()
+
+
+def sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def add_latency(store, seconds):
+    """Delay every embedding call on the store by a fixed provider round-trip."""
+    for name in ("embed_query", "embed_queries"):
+        embed = getattr(store, name)
+
+        def delayed(texts, embed=embed):
+            time.sleep(seconds)
+            return embed(texts)
+
+        setattr(store, name, delayed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20, help="Synthetic documents to index")
+    parser.add_argument("--chunks", type=int, default=2000, help="Chunks per document")
+    parser.add_argument("--queries", type=int, default=100, help="Queries per run")
+    parser.add_argument("--batch-size", type=int, default=25, help="Items per /query/batch request")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--embed-latency-ms", type=float, default=25.0,
+                        help="Simulated provider latency added to each embedding call")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(VECTOR_BACKEND="local", EMBEDDING_PROVIDER="local", DATA_DIR=tmp)
+        from fastapi.testclient import TestClient
+        import database
+        from catalog import catalog
+        from main import app
+
+        rng = random.Random(0)
+        store = database.get_client()
+        with TestClient(app) as client:
+            started = time.perf_counter()
+            names = [f"doc_{i}.txt" for i in range(args.documents)]
+            for name in names:
+                store.add_chunks(name, [sentence(rng, 40) for _ in range(args.chunks)])
+                catalog.add(name, "txt", args.chunks)
+            print(f"Indexed {args.documents} documents x {args.chunks} chunks in {time.perf_counter() - started:.1f}s")
+            add_latency(store, args.embed_latency_ms / 1000)
+
+            def workload(run):
+                return [
+                    {"document_name": rng.choice(names), "query": f"{sentence(rng, 6)} {run}-{i}", "top_k": args.top_k}
+                    for i in range(args.queries)
+                ]
+
+            items = workload("sequential")
+            started = time.perf_counter()
+            for item in items:
+                assert client.get("/query", params=item).status_code == 200
+            sequential = time.perf_counter() - started
+
+            items = workload("batch")
+            started = time.perf_counter()
+            for i in range(0, len(items), args.batch_size):
+                response = client.post("/query/batch", json={"items": items[i:i + args.batch_size]})
+                assert all(result["error"] is None for result in response.json()["results"])
+            batched = time.perf_counter() - started
+
+        print(f"{'GET /query':>18}: {sequential:7.2f}s  {args.queries / sequential:8.1f} queries/s")
+        print(f"{'POST /query/batch':>18}: {batched:7.2f}s  {args.queries / batched:8.1f} queries/s  "
+              f"(batch size {args.batch_size}, {sequential / batched:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
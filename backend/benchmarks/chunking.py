@@ -0,0 +1,114 @@
+"""
+Benchmark the streaming chunker against the previous decode/re-decode chunker.
+
+Generates a synthetic English-like corpus of the requested size, feeds it to
+text_processing.iter_chunks page by page, and reports throughput (tokens/s)
+and peak Python heap usage. The legacy chunker needs the whole document as
+one string, so it is only run when --legacy is given.
+
+Usage (from backend/):
+    python benchmarks/chunking.py --size-mb 100
+    python benchmarks/chunking.py --size-mb 10 --legacy
+"""
+import argparse
+import os
+import random
+import re
+import resource
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_processing import get_encoding, iter_chunks  # noqa: E402
+
+WORDS = (
+    "the planet orbit system solar jupiter storm spot great red giant moon ring "
+    "saturn atmosphere pressure surface temperature data report quarterly revenue "
+    "growth market region north south east west sales profit expense customer"
+).split()
+PAGE_CHARS = 4000
+
+
+def synthetic_pages(size_bytes, seed=0):
+    """Yield pages of pseudo-random sentences until size_bytes characters were produced."""
+    rng = random.Random(seed)
+    produced = 0
+    while produced < size_bytes:
+        sentences = []
+        length = 0
+        while length < PAGE_CHARS:
+            sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 20)))
+            sentence = sentence.capitalize() + ". "
+            sentences.append(sentence)
+            length += len(sentence)
+        page = "".join(sentences) + "\n"
+        produced += len(page)
+        yield page
+
+
+def legacy_chunk_text(text, chunk_size=300, overlap=50):
+    """The chunker used before streaming: decodes each window twice and reverses it."""
+    encoding = get_encoding()
+    tokens = encoding.encode(text)
+    chunks = []
+    start = 0
+    while start < len(tokens):
+        end = min(start + chunk_size, len(tokens))
+        chunk_text = encoding.decode(tokens[start:end])
+        if end < len(tokens):
+            match = re.search(r'(?<=\.)\s+[A-Z]', chunk_text[::-1])
+            if match:
+                end -= match.start()
+        chunks.append(encoding.decode(tokens[start:end]))
+        start += chunk_size - overlap
+    return chunks
+
+
+def run(name, fn, trace_memory):
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    chunks = fn()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+    return {"name": name, "chunks": chunks, "seconds": elapsed, "peak_bytes": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=100, help="Size of the synthetic input in MB")
+    parser.add_argument("--legacy", action="store_true", help="Also run the previous chunker (slow, holds the whole text)")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass (it slows the run down)")
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    encoding = get_encoding()
+    total_tokens = sum(len(encoding.encode_ordinary(page)) for page in synthetic_pages(size))
+    print(f"Input: {args.size_mb:g} MB, {total_tokens:,} tokens")
+
+    def streaming():
+        count = 0
+        for _ in iter_chunks(synthetic_pages(size)):
+            count += 1
+        return count
+
+    def legacy():
+        return len(legacy_chunk_text("".join(synthetic_pages(size))))
+
+    cases = [("streaming", streaming)] + ([("legacy", legacy)] if args.legacy else [])
+    for name, fn in cases:
+        result = run(name, fn, trace_memory=False)
+        line = f"{name:>10}: {result['chunks']:,} chunks in {result['seconds']:.2f}s, {total_tokens / result['seconds']:,.0f} tokens/s"
+        if not args.no_memory:
+            peak = run(name, fn, trace_memory=True)["peak_bytes"]
+            line += f", peak heap {peak / 1024 / 1024:.2f} MB"
+        print(line)
+    print(f"Max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
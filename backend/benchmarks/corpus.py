@@ -0,0 +1,139 @@
+"""
+Generate a reproducible synthetic corpus of TXT, JSON, DOCX and PDF documents.
+
+The same --seed always produces the same text. --size-kb is the amount of
+text per document; DOCX and PDF files are larger on disk than the text
+they hold. JSON documents are arrays of sales-like records (region,
+product, sales, expenses, profit, units, notes), so /json-query can
+aggregate and group them.
+
+Usage (from backend/):
+    python benchmarks/corpus.py /tmp/corpus
+    python benchmarks/corpus.py /tmp/corpus --count 50 --size-kb 1024 --types txt pdf
+"""
+import argparse
+import json
+import os
+import random
+
+WORDS = (
+    "the system shall restart the pump when pressure exceeds the configured limit "
+    "operator manual section valve controller sensor maintenance interval warning "
+    "planet orbit solar storm report quarterly revenue growth market customer"
+).split()
+REGIONS = ["North", "South", "East", "West", "Central"]
+PRODUCTS = ["pump", "valve", "sensor", "controller", "filter", "motor"]
+FILE_TYPES = ["txt", "json", "docx", "pdf"]
+
+# Characters of text per PDF page
+PDF_PAGE_CHARS = 3000
+
+
+def sentence(rng, words=None):
+    words = words or rng.randint(6, 20)
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def paragraphs(rng, size_bytes):
+    """Yield paragraphs of sentences until size_bytes characters were produced."""
+    produced = 0
+    while produced < size_bytes:
+        paragraph = " ".join(sentence(rng) for _ in range(rng.randint(3, 8)))
+        produced += len(paragraph) + 1
+        yield paragraph
+
+
+def write_txt(path, rng, size_bytes):
+    with open(path, "w", encoding="utf-8") as f:
+        for paragraph in paragraphs(rng, size_bytes):
+            f.write(paragraph + "\n")
+
+
+def write_json(path, rng, size_bytes):
+    records, produced = [], 0
+    while produced < size_bytes:
+        sales = rng.randint(100, 5000)
+        expenses = rng.randint(50, sales)
+        record = {
+            "id": len(records),
+            "region": rng.choice(REGIONS),
+            "product": rng.choice(PRODUCTS),
+            "sales": sales,
+            "expenses": expenses,
+            "profit": sales - expenses,
+            "units": rng.randint(1, 200),
+            "notes": sentence(rng),
+        }
+        records.append(record)
+        produced += len(json.dumps(record)) + 2
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(records, f)
+
+
+def write_docx(path, rng, size_bytes):
+    import docx
+
+    document = docx.Document()
+    for paragraph in paragraphs(rng, size_bytes):
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def write_pdf(path, rng, size_bytes):
+    import pymupdf
+
+    document = pymupdf.open()
+    page_text, length = [], 0
+    for paragraph in paragraphs(rng, size_bytes):
+        page_text.append(paragraph)
+        length += len(paragraph)
+        if length >= PDF_PAGE_CHARS:
+            _add_pdf_page(document, page_text)
+            page_text, length = [], 0
+    if page_text:
+        _add_pdf_page(document, page_text)
+    document.save(path)
+    document.close()
+
+
+def _add_pdf_page(document, page_text):
+    page = document.new_page()
+    page.insert_textbox(page.rect + (36, 36, -36, -36), "\n".join(page_text), fontsize=7)
+
+
+WRITERS = {"txt": write_txt, "json": write_json, "docx": write_docx, "pdf": write_pdf}
+
+
+def generate(out_dir, count=5, size_bytes=256 * 1024, types=FILE_TYPES, seed=0):
+    """
+    Write count documents of each type to out_dir. Returns [(path, file_type)].
+
+    Each document gets its own seeded generator, so adding types or documents
+    never changes the text of the others.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    files = []
+    for file_type in types:
+        for i in range(count):
+            path = os.path.join(out_dir, f"synthetic_{i:04d}.{file_type}")
+            WRITERS[file_type](path, random.Random(f"{seed}-{file_type}-{i}"), size_bytes)
+            files.append((path, file_type))
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", help="Directory to write the corpus to")
+    parser.add_argument("--count", type=int, default=5, help="Documents per file type")
+    parser.add_argument("--size-kb", type=int, default=256, help="Text per document, in KB")
+    parser.add_argument("--types", nargs="+", default=FILE_TYPES, choices=FILE_TYPES)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    files = generate(args.out_dir, args.count, args.size_kb * 1024, args.types, args.seed)
+    total = sum(os.path.getsize(path) for path, _ in files)
+    print(f"Wrote {len(files)} documents ({total / 1024 / 1024:.1f} MB) to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark PDF text extraction: the previous string-concatenation loop versus
+extract_pages with 1, 4 and N worker processes.
+
+Generates a synthetic PDF (2,000 pages by default) unless --pdf is given.
+Worker pools are started and warmed up before timing, as the ingestion job
+pool is long-lived; process start-up cost is reported separately.
+
+Usage (from backend/):
+    python benchmarks/extraction.py
+    python benchmarks/extraction.py --pages 500 --workers 1 2 8
+    python benchmarks/extraction.py --pdf /path/to/manual.pdf
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymupdf  # noqa: E402
+from text_processing import extract_pages, pdf_page_count  # noqa: E402
+
+WORDS = (
+    "the system shall restart the pump when pressure exceeds the configured limit "
+    "operator manual section valve controller sensor maintenance interval warning"
+).split()
+
+
+def make_pdf(path, pages, seed=0):
+    rng = random.Random(seed)
+    doc = pymupdf.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        text = "\n".join(
+            " ".join(rng.choice(WORDS) for _ in range(12)).capitalize() + "."
+            for _ in range(45)
+        )
+        page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+def legacy_extract(file_path):
+    """The extraction loop used before: one page at a time, quadratic string building."""
+    text = ""
+    doc = pymupdf.open(file_path)
+    for page in doc:
+        text += page.get_text("text") + "\n"
+    return text
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="Existing PDF to extract instead of a synthetic one")
+    parser.add_argument("--pages", type=int, default=2000, help="Pages in the synthetic PDF")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, os.cpu_count() or 1],
+                        help="Worker counts to benchmark")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.pdf
+        if path is None:
+            path = os.path.join(tmp, "synthetic.pdf")
+            make_pdf(path, args.pages)
+        with pymupdf.open(path) as doc:
+            page_count = doc.page_count
+        print(f"PDF: {path} ({page_count} pages, {os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+
+        text, elapsed = timed(lambda: legacy_extract(path))
+        print(f"{'legacy':>12}: {elapsed:7.2f}s  {page_count / elapsed:8.0f} pages/s  ({len(text):,} chars)")
+        for workers in sorted(set(args.workers)):
+            if workers <= 1:
+                pages, elapsed = timed(lambda: extract_pages(path, "pdf"))
+                startup = 0.0
+            else:
+                pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                _, startup = timed(lambda: list(pool.map(pdf_page_count, [path] * workers)))
+                pages, elapsed = timed(lambda: extract_pages(path, "pdf", workers=workers, executor=pool))
+                pool.shutdown()
+            chars = sum(len(page) for page in pages)
+            print(f"{f'{workers} worker(s)':>12}: {elapsed:7.2f}s  {page_count / elapsed:8.0f} pages/s  "
+                  f"({chars:,} chars, pool start-up {startup:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
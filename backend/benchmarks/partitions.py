@@ -0,0 +1,186 @@
+"""
+Partitioning benchmark: per-document query latency as the corpus grows.
+
+Grows a vector store to each of --sizes documents (--chunks-per-document
+synthetic chunks each, random unit vectors of --dim dimensions, so no
+embedding time is measured) and at every size measures:
+
+- p50 / p95 / p99 latency of a search scoped to one random document
+- p50 latency of deleting a whole document (dropping its partition)
+
+With a partitioned layout both should stay flat from the smallest to the
+largest size: a query only touches the partition of its document, however
+many other documents the store holds.
+
+By default a throwaway local store is used (it already keeps each
+document's rows apart). --use-env runs against the configured store instead,
+e.g. Weaviate with PARTITIONING=document; the benchmark's documents are
+named partition-bench/... and deleted afterwards.
+
+Results are written as JSON (--output); --baseline and --threshold compare
+them with an earlier run, like benchmarks/suite.py.
+
+Usage (from backend/):
+    python benchmarks/partitions.py
+    PARTITIONING=document python benchmarks/partitions.py --use-env --sizes 1000,10000
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import sentence  # noqa: E402
+from suite import Results, compare, git_commit  # noqa: E402
+
+FILL_BATCH = 10000
+PREFIX = "partition-bench/"
+
+
+class FixedEmbedder:
+    """Stands in for the store's embedder; the benchmark only ever passes precomputed vectors."""
+
+    def __init__(self, dim):
+        self.model = f"benchmark-{dim}"
+
+    def close(self):
+        pass
+
+
+def filename(i):
+    return f"{PREFIX}doc{i}.txt"
+
+
+def fill(store, start, end, chunks_per_document, dim, rng, vectors_rng):
+    """Add documents start..end-1 to the store."""
+    batch = []
+    for i in range(start, end):
+        for chunk_id in range(chunks_per_document):
+            batch.append({
+                "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+                "filename": filename(i),
+                "chunk_id": chunk_id,
+                "text_chunk": sentence(rng),
+                "page": None,
+                "hash": f"{rng.getrandbits(256):064x}",
+            })
+        if len(batch) >= FILL_BATCH or i == end - 1:
+            vectors = vectors_rng.standard_normal((len(batch), dim)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            store.import_chunks(batch, vectors)
+            batch = []
+
+
+def measure(store, results, documents, args, rng, vectors_rng, deleted):
+    queries = vectors_rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    samples = []
+    for query in queries:
+        target = rng.randrange(documents)
+        while target in deleted:
+            target = rng.randrange(documents)
+        started = time.perf_counter()
+        store.search(filename(target), None, args.top_k, vector=query)
+        samples.append(time.perf_counter() - started)
+    results.add_latencies(f"{documents}.search", samples)
+
+    samples = []
+    for _ in range(args.deletes):
+        target = rng.randrange(documents)
+        while target in deleted:
+            target = rng.randrange(documents)
+        deleted.add(target)
+        started = time.perf_counter()
+        store.delete_document(filename(target))
+        samples.append(time.perf_counter() - started)
+    results.add(f"{documents}.delete.p50_ms", np.percentile(samples, 50) * 1000, "ms", "lower")
+
+
+def run(store, args, sizes):
+    results = Results()
+    rng = random.Random(args.seed)
+    vectors_rng = np.random.default_rng(args.seed)
+    deleted = set()
+    stored = 0
+    for documents in sizes:
+        print(f"Growing the store to {documents} documents...")
+        started = time.perf_counter()
+        fill(store, stored, documents, args.chunks_per_document, args.dim, rng, vectors_rng)
+        print(f"  filled in {time.perf_counter() - started:.1f}s")
+        stored = documents
+        measure(store, results, documents, args, rng, vectors_rng, deleted)
+    smallest, largest = sizes[0], sizes[-1]
+    results.add(
+        "search_p50_growth",
+        results.metrics[f"{largest}.search.p50_ms"]["value"] / results.metrics[f"{smallest}.search.p50_ms"]["value"],
+        "x", "lower",
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated document counts to measure at")
+    parser.add_argument("--chunks-per-document", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=384, help="Vector dimensions")
+    parser.add_argument("--queries", type=int, default=200, help="Searches measured at each size")
+    parser.add_argument("--deletes", type=int, default=20, help="Document deletions measured at each size")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--use-env", action="store_true", help="Use the configured vector store instead of a local one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="partitions_results.json", help="Where to write the results")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change that counts as a regression")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+
+    if args.use_env:
+        import database
+        store = database.get_client()
+        try:
+            results = run(store, args, sizes)
+        finally:
+            print("Deleting the benchmark documents...")
+            for name in store.list_documents():
+                if name.startswith(PREFIX):
+                    store.delete_document(name)
+            database.close_client()
+    else:
+        from local_store import LocalVectorStore
+        with tempfile.TemporaryDirectory() as tmp:
+            store = LocalVectorStore(tmp, FixedEmbedder(args.dim))
+            results = run(store, args, sizes)
+            store.close()
+
+    report = {
+        "created_at": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "store": "configured" if args.use_env else "local",
+        "config": vars(args),
+        "metrics": results.metrics,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results.metrics, json.load(f)["metrics"], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Snapshot benchmark: export and import throughput, snapshot size, and the
+search quality kept by int8 quantization.
+
+Fills a throwaway local vector store with --chunks synthetic chunks (random
+unit vectors of --dim dimensions, so no embedding time is measured), then
+for each vector encoding exports it, imports the snapshot into a fresh
+store and measures:
+
+- export / import chunks per second
+- bytes per chunk on disk (vectors plus compressed text and metadata columns)
+- recall@10 of corpus-wide searches on the restored store against the
+  original (1.0 for float32; int8 quantization may reorder near ties)
+
+Results are written as JSON (--output); --baseline and --threshold compare
+them with an earlier run, like benchmarks/suite.py.
+
+Usage (from backend/):
+    python benchmarks/snapshot_roundtrip.py
+    python benchmarks/snapshot_roundtrip.py --chunks 1000000 --workers 8 --output snapshot.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import sentence  # noqa: E402
+from suite import Results, compare, git_commit  # noqa: E402
+
+FILL_BATCH = 10000
+QUERIES = 50
+
+
+class FixedEmbedder:
+    """Stands in for the store's embedder; the benchmark only ever passes precomputed vectors."""
+
+    def __init__(self, dim):
+        self.model = f"benchmark-{dim}"
+
+    def close(self):
+        pass
+
+
+def fill(store, chunks, dim, documents, seed):
+    rng = random.Random(seed)
+    vectors_rng = np.random.default_rng(seed)
+    for start in range(0, chunks, FILL_BATCH):
+        count = min(FILL_BATCH, chunks - start)
+        vectors = vectors_rng.standard_normal((count, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        batch = []
+        for i in range(start, start + count):
+            text = " ".join(sentence(rng) for _ in range(6))
+            batch.append({
+                "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+                "filename": f"doc{i % documents}.txt",
+                "chunk_id": i // documents,
+                "text_chunk": text,
+                "page": None,
+                "hash": f"{rng.getrandbits(256):064x}",
+            })
+        store.import_chunks(batch, vectors)
+
+
+def top_uuids(store, queries, k=10):
+    return [{hit["uuid"] for hit in store.search(None, None, k, vector=query)} for query in queries]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200000, help="Chunks in the store")
+    parser.add_argument("--dim", type=int, default=384, help="Vector dimensions")
+    parser.add_argument("--documents", type=int, default=100, help="Documents the chunks are spread over")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel import workers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="snapshot_results.json", help="Where to write the results")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change that counts as a regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The snapshot module reads its paths from the configuration at import time
+        os.environ["DATA_DIR"] = os.path.join(tmp, "data")
+        from local_store import LocalVectorStore
+        import snapshot
+
+        results = Results()
+        source = LocalVectorStore(os.path.join(tmp, "source"), FixedEmbedder(args.dim))
+        print(f"Filling a store with {args.chunks} chunks...")
+        fill(source, args.chunks, args.dim, args.documents, args.seed)
+        queries = np.random.default_rng(args.seed + 1).standard_normal((QUERIES, args.dim)).astype(np.float32)
+        expected = top_uuids(source, queries)
+
+        for quantization in sorted(snapshot.VECTOR_FILES):
+            print(f"Vectors: {quantization}")
+            path = os.path.join(tmp, f"snapshot-{quantization}")
+            started = time.perf_counter()
+            exported = snapshot.export_snapshot(source, path, quantization)
+            results.add(f"{quantization}.export_chunks_per_second", args.chunks / (time.perf_counter() - started), "chunks/s", "higher")
+            results.add(f"{quantization}.bytes_per_chunk", exported["bytes_per_chunk"], "bytes", "lower")
+
+            target = LocalVectorStore(os.path.join(tmp, f"target-{quantization}"), FixedEmbedder(args.dim))
+            started = time.perf_counter()
+            snapshot.import_snapshot(target, path, workers=args.workers)
+            results.add(f"{quantization}.import_chunks_per_second", args.chunks / (time.perf_counter() - started), "chunks/s", "higher")
+            restored = top_uuids(target, queries)
+            recall = np.mean([len(a & b) / len(a) for a, b in zip(expected, restored)])
+            results.add(f"{quantization}.recall_at_10", recall, "", "higher")
+            target.close()
+        source.close()
+
+    report = {
+        "created_at": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "metrics": results.metrics,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results.metrics, json.load(f)["metrics"], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
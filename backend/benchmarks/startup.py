@@ -0,0 +1,167 @@
+"""
+Startup-time benchmark: how long until the API can be imported, is live and is ready.
+
+Each measurement runs in a fresh interpreter, so nothing is cached in the
+process (the OS file cache still is; the first repetition is usually the
+slowest). It measures:
+
+- import_main: seconds to `import main` (the time before uvicorn can bind),
+  plus the slowest modules main imports directly, from `python -X importtime`
+- live / ready: seconds from spawning uvicorn until GET /live and GET /ready
+  answer 200, i.e. until the server accepts connections and until the
+  startup warm-up (vector store, catalog, keyword index) finished
+
+The median over --repeat runs counts. By default the API runs on a
+throwaway local vector store with the offline embedder; --use-env keeps the
+environment's configuration (e.g. a running Weaviate) instead.
+
+Results are written as JSON (--output); --baseline and --threshold compare
+them with an earlier run, like benchmarks/suite.py.
+
+Usage (from backend/):
+    python benchmarks/startup.py --output startup.json
+    python benchmarks/startup.py --output after.json --baseline startup.json --repeat 10
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from suite import Results, compare, git_commit  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_SCRIPT = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+
+def bench_environment(use_env, data_dir):
+    env = dict(os.environ)
+    if not use_env:
+        env.update(VECTOR_BACKEND="local", EMBEDDING_PROVIDER="local", DATA_DIR=data_dir)
+        env.pop("EMBEDDING_CACHE_PATH", None)
+    return env
+
+
+def parse_importtime(stderr, top):
+    """The modules imported directly by main with the largest cumulative import time, in seconds."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        # Two spaces of indentation per nesting level; main is at level 0, its imports at level 1
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1 and cumulative.strip().isdigit():
+            modules.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(modules, key=lambda module: module[1], reverse=True)[:top]
+
+
+def bench_import(env, repeat, top, results):
+    seconds, slowest = [], []
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", IMPORT_SCRIPT],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        seconds.append(float(completed.stdout.strip().splitlines()[-1]))
+        slowest = parse_importtime(completed.stderr, top)
+    results.add("import_main.seconds", statistics.median(seconds), "s", "lower")
+    # From the last run, which has the warmest file cache like the runs that set the median
+    print("  Slowest imports of main:")
+    for name, module_seconds in slowest:
+        print(f"    {name:<38} {module_seconds:12.3f} s")
+    return slowest
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, deadline):
+    """Poll url until it answers 200. Returns the time it did (perf_counter)."""
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{url} did not answer 200 in time")
+
+
+def bench_server(env, repeat, timeout, results):
+    live, ready = [], []
+    for _ in range(repeat):
+        port = free_port()
+        base = f"http://127.0.0.1:{port}"
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        try:
+            deadline = started + timeout
+            live.append(wait_for(f"{base}/live", deadline) - started)
+            ready.append(wait_for(f"{base}/ready", deadline) - started)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    results.add("startup.live_seconds", statistics.median(live), "s", "lower")
+    results.add("startup.ready_seconds", statistics.median(ready), "s", "lower")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (the median counts)")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to report")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for the server to get ready")
+    parser.add_argument("--use-env", action="store_true", help="Use the configured vector store and embedder")
+    parser.add_argument("--output", default="startup_results.json", help="Where to write the results")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change that counts as a regression")
+    args = parser.parse_args()
+
+    results = Results()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = bench_environment(args.use_env, os.path.join(tmp, "data"))
+        print("Import:")
+        slowest = bench_import(env, args.repeat, args.top, results)
+        print("Server:")
+        bench_server(env, args.repeat, args.timeout, results)
+
+    report = {
+        "created_at": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "metrics": results.metrics,
+        "slowest_imports": [{"module": name, "seconds": round(seconds, 6)} for name, seconds in slowest],
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results.metrics, json.load(f)["metrics"], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Reproducible ingest/query benchmark suite.
+
+Generates a synthetic corpus (see benchmarks/corpus.py) and runs the API
+in-process on a throwaway local vector store with the deterministic local
+embedder, so results depend only on this code and this machine. It measures:
+
+- extract_text / chunk_text throughput per file type (MB/s of input text, chunks/s)
+- end-to-end /upload throughput, from the first upload until every ingestion job finished
+- /query and /json-query latency (p50/p95/p99) with --concurrency parallel clients;
+  every query text is unique, so /query is never served from the query caches
+- peak RSS of the API process and of its ingestion worker processes
+
+Results are written as JSON (--output). Pass an earlier result file as
+--baseline to compare runs: every metric that got worse by more than
+--threshold (default 10%) is flagged as a regression, and the exit status is 1.
+Latency percentiles of short runs are noisy; compare runs with the same
+arguments on the same machine, and raise --requests (or --threshold) when
+small differences matter less than false alarms.
+
+Usage (from backend/):
+    python benchmarks/suite.py --output before.json
+    python benchmarks/suite.py --output after.json --baseline before.json
+    python benchmarks/suite.py --types json txt --count 20 --size-kb 512 --concurrency 16 --requests 1000
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import FILE_TYPES, WORDS, generate  # noqa: E402
+
+MB = 1024 * 1024
+AGGREGATIONS = ["avg", "max", "sum", "median"]
+
+
+class Results:
+    """Named measurements, each with a unit and whether higher or lower values are better."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, value, unit, better):
+        self.metrics[name] = {"value": round(float(value), 6), "unit": unit, "better": better}
+        print(f"  {name:<40} {value:12.3f} {unit}")
+
+    def add_latencies(self, name, latencies):
+        for q in (50, 95, 99):
+            self.add(f"{name}.p{q}_ms", np.percentile(latencies, q) * 1000, "ms", "lower")
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and the sum over its live child processes (Linux), in MB."""
+    import multiprocessing
+
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    own = own / MB if sys.platform == "darwin" else own / 1024  # bytes on macOS, KB elsewhere
+    children = 0.0
+    for child in multiprocessing.active_children():
+        try:
+            with open(f"/proc/{child.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        children += int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    return own, children
+
+
+def run_concurrently(concurrency, requests, send):
+    """Call send(i) for every request from concurrency threads. Returns per-request latencies in seconds."""
+    def timed(i):
+        started = time.perf_counter()
+        send(i)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(timed, range(requests)))
+
+
+def wait_until_ready(client, timeout=120):
+    """Poll /ready until the startup warm-up finished."""
+    deadline = time.monotonic() + timeout
+    while client.get("/ready").status_code != 200:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"API not ready after {timeout}s: {client.get('/ready').json()}")
+        time.sleep(0.05)
+
+
+def bench_processing(files, repeat, results):
+    """extract_text and chunk_text, one document at a time, per file type; the best of repeat passes counts."""
+    from text_processing import chunk_text, extract_text
+
+    for file_type in sorted({file_type for _, file_type in files}):
+        paths = [path for path, kind in files if kind == file_type]
+        extract_seconds = chunk_seconds = float("inf")
+        for _ in range(repeat):
+            text_bytes = chunks = 0
+            extract_pass = chunk_pass = 0.0
+            for path in paths:
+                started = time.perf_counter()
+                text = extract_text(path, file_type)
+                extract_pass += time.perf_counter() - started
+                started = time.perf_counter()
+                chunks += len(chunk_text(text, file_type))
+                chunk_pass += time.perf_counter() - started
+                text_bytes += len(text.encode("utf-8"))
+            extract_seconds = min(extract_seconds, extract_pass)
+            chunk_seconds = min(chunk_seconds, chunk_pass)
+        results.add(f"extract_text.{file_type}.mb_per_s", text_bytes / MB / extract_seconds, "MB/s", "higher")
+        results.add(f"chunk_text.{file_type}.mb_per_s", text_bytes / MB / chunk_seconds, "MB/s", "higher")
+        results.add(f"chunk_text.{file_type}.chunks_per_s", chunks / chunk_seconds, "chunks/s", "higher")
+
+
+def bench_upload(client, files, concurrency, results):
+    """Upload every document and wait for its ingestion job. Returns the names that ingested."""
+    def upload(i):
+        path, _ = files[i]
+        with open(path, "rb") as f:
+            response = client.post("/upload", files={"file": (os.path.basename(path), f)})
+        response.raise_for_status()
+        return response.json()["job_id"]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        job_ids = list(pool.map(upload, range(len(files))))
+    jobs = {}
+    while len(jobs) < len(job_ids):
+        for job_id in job_ids:
+            if job_id not in jobs:
+                job = client.get(f"/jobs/{job_id}").json()
+                if job["stage"] in ("completed", "failed"):
+                    jobs[job_id] = job
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    failed = [job for job in jobs.values() if job["stage"] == "failed"]
+    for job in failed:
+        print(f"  ingestion of {job['filename']} failed: {job['error']}")
+    total_bytes = sum(os.path.getsize(path) for path, _ in files)
+    total_chunks = sum(job["chunk_count"] or 0 for job in jobs.values())
+    results.add("upload.files_per_s", len(files) / elapsed, "files/s", "higher")
+    results.add("upload.mb_per_s", total_bytes / MB / elapsed, "MB/s", "higher")
+    results.add("upload.chunks_per_s", total_chunks / elapsed, "chunks/s", "higher")
+    results.add("upload.failed", len(failed), "files", "lower")
+    return [job["filename"] for job in jobs.values() if job["stage"] == "completed"]
+
+
+def bench_queries(client, documents, concurrency, requests, top_k, results):
+    import random
+
+    rng = random.Random(0)
+    warm_up = min(20, requests)
+    queries = [
+        (rng.choice(documents), " ".join(rng.choice(WORDS) for _ in range(6)) + f" q{i}")
+        for i in range(warm_up + requests)
+    ]
+
+    def query(i):
+        document_name, text = queries[i]
+        response = client.get("/query", params={"document_name": document_name, "query": text, "top_k": top_k})
+        response.raise_for_status()
+
+    run_concurrently(concurrency, warm_up, query)
+    results.add_latencies("query", run_concurrently(concurrency, requests, lambda i: query(warm_up + i)))
+
+
+def bench_json_query(client, documents, concurrency, requests, results):
+    def json_query(i):
+        params = {
+            "document_name": documents[i % len(documents)],
+            "field": "sales",
+            "operation": AGGREGATIONS[i % len(AGGREGATIONS)],
+        }
+        if i % 5 == 0:
+            params["group_by"] = "region"
+        response = client.get("/json-query", params=params)
+        response.raise_for_status()
+
+    run_concurrently(concurrency, min(20, requests), json_query)  # warm up (loads the sidecars)
+    results.add_latencies("json_query", run_concurrently(concurrency, requests, json_query))
+
+
+def compare(metrics, baseline, threshold):
+    """Print the change of every metric against a baseline run. Returns the names of regressions."""
+    regressions = []
+    print(f"\nCompared with baseline (regression threshold {threshold:.0%}):")
+    for name, metric in metrics.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        old, new = before["value"], metric["value"]
+        if old == 0:
+            change = 0.0 if new == 0 else float("inf")
+        else:
+            change = (new - old) / abs(old)
+        worse = change < -threshold if metric["better"] == "higher" else change > threshold
+        if worse:
+            regressions.append(name)
+        flag = "  REGRESSION" if worse else ""
+        print(f"  {name:<40} {old:12.3f} -> {new:12.3f} {metric['unit']:<9} {change:+8.1%}{flag}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--types", nargs="+", default=FILE_TYPES, choices=FILE_TYPES, help="File types in the corpus")
+    parser.add_argument("--count", type=int, default=5, help="Documents per file type")
+    parser.add_argument("--size-kb", type=int, default=256, help="Text per document, in KB")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus seed")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the corpus for extract/chunk throughput")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel clients for uploads and queries")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per latency benchmark")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the results")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change that counts as a regression")
+    args = parser.parse_args()
+
+    results = Results()
+    with tempfile.TemporaryDirectory() as tmp:
+        # A throwaway local store and the offline embedder; set before the app modules are imported
+        os.environ.update(VECTOR_BACKEND="local", EMBEDDING_PROVIDER="local", DATA_DIR=os.path.join(tmp, "data"))
+        os.environ.pop("EMBEDDING_CACHE_PATH", None)
+        from fastapi.testclient import TestClient
+        from main import app
+
+        started = time.perf_counter()
+        files = generate(os.path.join(tmp, "corpus"), args.count, args.size_kb * 1024, args.types, args.seed)
+        print(f"Generated {len(files)} documents in {time.perf_counter() - started:.1f}s")
+
+        print("Text processing:")
+        bench_processing(files, args.repeat, results)
+
+        with TestClient(app) as client:
+            wait_until_ready(client)
+            print("Ingestion:")
+            documents = bench_upload(client, files, args.concurrency, results)
+            print("Queries:")
+            if documents:
+                bench_queries(client, documents, args.concurrency, args.requests, args.top_k, results)
+            json_documents = [name for name in documents if name.endswith(".json")]
+            if json_documents:
+                bench_json_query(client, json_documents, args.concurrency, args.requests, results)
+            own, children = peak_rss_mb()
+            results.add("peak_rss.api_mb", own, "MB", "lower")
+            results.add("peak_rss.workers_mb", children, "MB", "lower")
+
+    report = {
+        "created_at": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "metrics": results.metrics,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results.metrics, json.load(f)["metrics"], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
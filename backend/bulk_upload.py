@@ -0,0 +1,288 @@
+import asyncio
+import lzma
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.responses import StreamingResponse
+from config import UPLOAD_TMP_DIR, UPLOAD_IO_WORKERS, ARCHIVE_MAX_MEMBERS, ARCHIVE_MAX_BYTES
+
+# Bytes copied at a time when saving uploads and extracting archive members
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# Upload disk I/O has its own threads, so a burst of uploads never takes the
+# default executor's threads away from queries
+_io_pool = ThreadPoolExecutor(max_workers=UPLOAD_IO_WORKERS, thread_name_prefix="upload-io")
+
+
+async def run_io(fn, *args):
+    """Run a blocking upload I/O call on the upload threads."""
+    return await asyncio.get_running_loop().run_in_executor(_io_pool, fn, *args)
+
+
+def new_temp_path(filename):
+    """Create a unique, empty temp file for an upload. The caller (or its ingestion job) removes it."""
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR, prefix="upload_", suffix=f"_{os.path.basename(filename)[-100:]}")
+    os.close(fd)
+    return path
+
+
+class ArchiveError(Exception):
+    """An archive is corrupt or over the extraction limits; status_code is the one to report it with."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _BoundedReader:
+    """Archive member reader that raises ArchiveError once the archive's members read more than max_bytes together."""
+
+    def __init__(self, source, total, max_bytes):
+        self.source = source
+        self.total = total
+        self.max_bytes = max_bytes
+
+    def read(self, size=-1):
+        block = self.source.read(size)
+        self.total += len(block)
+        if self.total > self.max_bytes:
+            raise ArchiveError(f"Archive extracts to more than {self.max_bytes} bytes", 413)
+        return block
+
+
+def save_upload(source, filename):
+    """Copy a file object to a new temp file in fixed-size blocks and return its path."""
+    path = new_temp_path(filename)
+    try:
+        with open(path, "wb") as f:
+            shutil.copyfileobj(source, f, UPLOAD_BLOCK_SIZE)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def is_archive(filename):
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def document_name(name):
+    """
+    Return the name an uploaded or archived file is stored under: its relative
+    path with "/" separators, e.g. "reports/2024/summary.pdf". Returns None for
+    absolute paths and paths that climb out with "..".
+    """
+    parts = name.replace("\\", "/").split("/")
+    if name.startswith(("/", "\\")) or parts[0][1:] == ":" or ".." in parts:
+        return None
+    parts = [part for part in parts if part not in ("", ".")]
+    return "/".join(parts) or None
+
+
+def _member_name(name):
+    path = document_name(name)
+    if path is None:
+        raise ArchiveError(f"Archive member has an unsafe path: {name}")
+    return path
+
+
+def _skip_member(name):
+    base = os.path.basename(name)
+    return not base or base.startswith(".") or name.startswith("__MACOSX/")
+
+
+def _is_corrupt(e):
+    # Decompressors report bad data as OSError without an errno; disk errors carry one
+    return isinstance(e, (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error, lzma.LZMAError)) or (
+        isinstance(e, OSError) and e.errno is None
+    )
+
+
+def iter_archive(path, max_members=ARCHIVE_MAX_MEMBERS, max_bytes=ARCHIVE_MAX_BYTES):
+    """
+    Yield (filename, temp_path) for every regular file in a zip or tar archive.
+
+    Members are extracted one at a time, each to its own temp file, so an
+    archive of any size is processed with constant memory. Members are named
+    by their path inside the archive, so "a/report.pdf" and "b/report.pdf"
+    stay two documents.
+
+    Raises ArchiveError if the archive is corrupt, has a member with an
+    absolute or ".." path, or once it holds more than max_members files or
+    extracts to more than max_bytes; members yielded before stay valid.
+    """
+    try:
+        yield from _extract_members(path, max_members, max_bytes)
+    except Exception as e:
+        if not _is_corrupt(e):
+            raise
+        raise ArchiveError(f"Corrupt archive: {str(e) or type(e).__name__}") from e
+
+
+def _extract_members(path, max_members, max_bytes):
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            members = [info for info in archive.infolist() if not info.is_dir() and not _skip_member(info.filename)]
+            # The central directory lists every member up front
+            if len(members) > max_members:
+                raise ArchiveError(f"Archive holds more than {max_members} files", 413)
+            names = [_member_name(info.filename) for info in members]
+            extracted = 0
+            for info, name in zip(members, names):
+                with archive.open(info) as member:
+                    reader = _BoundedReader(member, extracted, max_bytes)
+                    temp_path = save_upload(reader, info.filename)
+                extracted = reader.total
+                yield name, temp_path
+        return
+
+    with tarfile.open(path, "r:*") as archive:
+        count = extracted = 0
+        for info in archive:
+            if not info.isfile() or _skip_member(info.name):
+                continue
+            count += 1
+            if count > max_members:
+                raise ArchiveError(f"Archive holds more than {max_members} files", 413)
+            name = _member_name(info.name)
+            with archive.extractfile(info) as member:
+                reader = _BoundedReader(member, extracted, max_bytes)
+                temp_path = save_upload(reader, info.name)
+            extracted = reader.total
+            yield name, temp_path
+
+
+class _MultipartFileWriter:
+    """Callbacks for MultipartParser that write each file part to its own temp file."""
+
+    def __init__(self):
+        self.completed = []  # (filename, temp_path) of parts received in full
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._filename = None
+        self._file = None
+        self._path = None
+        self._pending = []  # data received since the last flush
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._filename = None
+
+    def on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = options.get(b"filename")
+        if filename:
+            # Parts without a filename are plain form fields and are ignored; an
+            # unsafe name is kept as sent, for check_upload to reject
+            filename = filename.decode("utf-8", "replace")
+            self._filename = document_name(filename) or filename
+            self._path = new_temp_path(self._filename)
+            self._file = open(self._path, "wb")
+
+    def on_part_data(self, data, start, end):
+        if self._file is not None:
+            self._pending.append((self._file, data[start:end]))
+
+    def on_part_end(self):
+        if self._file is not None:
+            self._pending.append((self._file, None))
+            self.completed.append((self._filename, self._path))
+            self._file = self._path = None
+
+    def flush(self):
+        """Write buffered part data and close finished parts (blocking; run off the event loop)."""
+        pending, self._pending = self._pending, []
+        for file, data in pending:
+            if data is None:
+                file.close()
+            else:
+                file.write(data)
+
+    def abort(self):
+        """Close and remove the temp file of a part that was not received in full."""
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._path)
+            self._file = self._path = None
+
+
+async def iter_multipart_files(request):
+    """
+    Yield (filename, temp_path) for each file part of a multipart/form-data request.
+
+    The body is parsed as it arrives, and each part is yielded as soon as it
+    has been received in full, so later parts are still being uploaded
+    while earlier ones are processed.
+    """
+    _, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise ValueError("Missing boundary in multipart request")
+
+    writer = _MultipartFileWriter()
+    parser = MultipartParser(boundary, writer.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            await run_io(writer.flush)
+            while writer.completed:
+                yield writer.completed.pop(0)
+        parser.finalize()
+        await run_io(writer.flush)
+        while writer.completed:
+            yield writer.completed.pop(0)
+    finally:
+        writer.abort()
+        # Parts received but never handed to the caller
+        for _, path in writer.completed:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class UploadStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for endpoints that keep reading the request body while they respond.
+
+    StreamingResponse normally listens for the client disconnecting by
+    reading from the request in parallel, which would swallow the body
+    messages the endpoint is still parsing. Here the endpoint's own reads
+    notice a disconnect while the body is arriving.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            pass
+        if self.background is not None:
+            await self.background()
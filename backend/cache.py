@@ -0,0 +1,265 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+import metrics
+from config import QUERY_EMBEDDING_CACHE_BYTES, QUERY_RESULT_CACHE_BYTES, QUERY_CACHE_TTL, QUERY_COALESCING
+
+# Rough per-entry bookkeeping overhead (key tuple, OrderedDict node, floats)
+ENTRY_OVERHEAD = 200
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by an approximate byte budget, with a TTL.
+
+    Callers pass the size of each value; the least recently used entries are
+    evicted once the total exceeds max_bytes. on_evict is called with the key
+    of every entry that leaves the cache other than through pop().
+    """
+
+    def __init__(self, max_bytes, ttl=None, on_evict=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        size += ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size, expires_at)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+
+    def _remove(self, key):
+        self.bytes -= self._data.pop(key)[1]
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class QueryCache:
+    """
+    Two-level cache for /query.
+
+    Query embeddings are cached on the normalized query text, so the same
+    question is embedded once regardless of document. Results are cached on
+    (document_name, normalized query, top_k) and dropped whenever the
+    document is uploaded or deleted.
+    """
+
+    def __init__(self, embedding_bytes=QUERY_EMBEDDING_CACHE_BYTES, result_bytes=QUERY_RESULT_CACHE_BYTES, ttl=QUERY_CACHE_TTL):
+        self.embeddings = LRUCache(embedding_bytes, ttl)
+        self.results = LRUCache(result_bytes, ttl, on_evict=self._forget_result)
+        self._keys_by_document = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.lower().split())
+
+    def get_embedding(self, query, embed):
+        """Return the cached embedding of a query, computing it with embed(query) on a miss."""
+        key = self.normalize(query)
+        vector = self.embeddings.get(key)
+        if vector is None:
+            vector = embed(query)
+            self.embeddings.put(key, vector, vector.nbytes + len(key))
+        return vector
+
+    async def get_embedding_async(self, query, embed):
+        """get_embedding with an async embed(query)."""
+        key = self.normalize(query)
+        vector = self.embeddings.get(key)
+        if vector is None:
+            vector = await embed(query)
+            self.embeddings.put(key, vector, vector.nbytes + len(key))
+        return vector
+
+    def get_embeddings(self, queries, embed_many):
+        """
+        Return the embeddings of several queries, in order.
+
+        Every query missing from the cache is embedded by a single
+        embed_many(queries) call; repeated queries are embedded once.
+        """
+        keys, vectors, missing = self._lookup_embeddings(queries)
+        if missing:
+            self._put_embeddings(vectors, missing, embed_many(list(missing.values())))
+        return [vectors[key] for key in keys]
+
+    async def get_embeddings_async(self, queries, embed_many):
+        """get_embeddings with an async embed_many(queries)."""
+        keys, vectors, missing = self._lookup_embeddings(queries)
+        if missing:
+            self._put_embeddings(vectors, missing, await embed_many(list(missing.values())))
+        return [vectors[key] for key in keys]
+
+    def _lookup_embeddings(self, queries):
+        """Cache keys of the queries, {key: cached vector or None} and {key: query} of the misses."""
+        keys = [self.normalize(query) for query in queries]
+        vectors = {key: self.embeddings.get(key) for key in dict.fromkeys(keys)}
+        missing = {}
+        for key, query in zip(keys, queries):
+            if vectors[key] is None:
+                missing.setdefault(key, query)
+        return keys, vectors, missing
+
+    def _put_embeddings(self, vectors, missing, embedded):
+        for key, vector in zip(missing, embedded):
+            self.embeddings.put(key, vector, vector.nbytes + len(key))
+            vectors[key] = vector
+
+    def get_results(self, document_name, query, top_k):
+        return self.results.get((document_name, self.normalize(query), top_k))
+
+    def generation(self, document_name):
+        """Counter bumped on every invalidation; read it before searching and pass it to put_results."""
+        return self._generations.get(document_name, 0)
+
+    def put_results(self, document_name, query, top_k, results, generation):
+        key = (document_name, self.normalize(query), top_k)
+        size = len(document_name) + len(key[1]) + sum(len(item["text"]) + ENTRY_OVERHEAD for item in results)
+        with self._lock:
+            # The document changed while the search ran; the results may be stale
+            if self._generations.get(document_name, 0) != generation:
+                return
+            self._keys_by_document.setdefault(document_name, set()).add(key)
+        self.results.put(key, results, size)
+
+    def invalidate_document(self, document_name):
+        """Drop every cached result for a document (call on upload and delete)."""
+        with self._lock:
+            self._generations[document_name] = self._generations.get(document_name, 0) + 1
+            keys = self._keys_by_document.pop(document_name, set())
+        for key in keys:
+            self.results.pop(key)
+
+    def _forget_result(self, key):
+        with self._lock:
+            keys = self._keys_by_document.get(key[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_document[key[0]]
+
+    def stats(self):
+        return {"embeddings": self.embeddings.stats(), "results": self.results.stats()}
+
+
+class _Flight:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller of a key starts the
+    call, callers arriving while it runs wait for the same outcome.
+
+    The call runs as its own task, so a waiter that disconnects does not
+    cancel it for the others; it is cancelled only once every waiter left.
+    Waiters are resumed in arrival order, and all of them get the result or
+    the exception. Nothing is kept after the call finished (the result
+    caches do that), so keys should include whatever makes an outcome stale,
+    e.g. the document's cache generation.
+    """
+
+    def __init__(self, operation, enabled=QUERY_COALESCING):
+        self.operation = operation
+        self.enabled = enabled
+        self.executed = 0
+        self.coalesced = 0
+        self._flights = {}
+
+    async def do(self, key, fn):
+        """Return the outcome of fn() (a coroutine function), shared with concurrent calls of the same key."""
+        if not self.enabled:
+            return await fn()
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(fn()))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.executed += 1
+            metrics.COALESCED.inc(operation=self.operation, outcome="executed")
+        else:
+            self.coalesced += 1
+            metrics.COALESCED.inc(operation=self.operation, outcome="coalesced")
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Nobody wants the outcome any more; later callers start afresh
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self):
+        executed = self.executed
+        return {
+            "enabled": self.enabled,
+            "executed": executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._flights),
+            # Requests served per backend call
+            "fan_in": round((executed + self.coalesced) / executed, 4) if executed else 0.0,
+        }
+
+
+query_cache = QueryCache()
+query_flights = SingleFlight("query")
+json_query_flights = SingleFlight("json_query")
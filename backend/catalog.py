@@ -0,0 +1,159 @@
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_right, insort
+from partitions import partition_of
+from config import CATALOG_PATH
+
+
+class DocumentCatalog:
+    """
+    In-memory index of ingested documents, persisted to SQLite.
+
+    Routes answer "does this document exist?" and list documents from here
+    instead of querying the vector store. The catalog is loaded at startup,
+    reconciled with the documents the store actually holds, and updated by
+    the ingestion jobs (and deletions).
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self._documents = {}
+        self._names = []  # sorted filenames, for cursor pagination
+        self._lock = threading.Lock()
+        self._db = None
+
+    def load(self, store=None):
+        """Read the persisted catalog and reconcile it with the store's documents."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "filename TEXT PRIMARY KEY, file_type TEXT NOT NULL, chunk_count INTEGER NOT NULL, "
+            "byte_size INTEGER, ingested_at REAL)"
+        )
+        self._db.commit()
+        documents = {
+            row[0]: self._entry(*row)
+            for row in self._db.execute("SELECT filename, file_type, chunk_count, byte_size, ingested_at FROM documents")
+        }
+
+        if store is not None and getattr(store, "partitioned", False):
+            # Counting every partition's chunks would reactivate offloaded partitions; only drop documents
+            # whose partition is gone (partition names are hashes, so unknown partitions cannot be listed)
+            try:
+                partitions = store.list_partitions()
+            except Exception as e:
+                print(f"Warning: Could not reconcile document catalog with the vector store: {str(e)}")
+            else:
+                gone = [filename for filename in documents if partition_of(filename, store.partitioning) not in partitions]
+                for filename in gone:
+                    del documents[filename]
+                self._db.executemany("DELETE FROM documents WHERE filename = ?", [(filename,) for filename in gone])
+                self._db.commit()
+        elif store is not None:
+            try:
+                stored = store.list_documents()
+            except Exception as e:
+                print(f"Warning: Could not reconcile document catalog with the vector store: {str(e)}")
+            else:
+                for filename in set(documents) - set(stored):
+                    del documents[filename]
+                for filename, chunk_count in stored.items():
+                    entry = documents.get(filename)
+                    if entry is None:
+                        documents[filename] = self._entry(filename, filename.split(".")[-1].lower(), chunk_count, None, None)
+                    else:
+                        entry["chunk_count"] = chunk_count
+                self._db.execute("DELETE FROM documents")
+                self._db.executemany(
+                    "INSERT INTO documents VALUES (?, ?, ?, ?, ?)",
+                    [tuple(entry.values()) for entry in documents.values()],
+                )
+                self._db.commit()
+
+        with self._lock:
+            self._documents = documents
+            self._names = sorted(documents)
+
+    @staticmethod
+    def _entry(filename, file_type, chunk_count, byte_size, ingested_at):
+        return {
+            "filename": filename,
+            "file_type": file_type,
+            "chunk_count": chunk_count,
+            "byte_size": byte_size,
+            "ingested_at": ingested_at,
+        }
+
+    def exists(self, filename):
+        return filename in self._documents
+
+    def get(self, filename):
+        return self._documents.get(filename)
+
+    def filenames(self):
+        with self._lock:
+            return list(self._names)
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, filename, file_type, chunk_count, byte_size=None, ingested_at=None):
+        """Record a newly ingested (or re-ingested) document."""
+        entry = self._entry(filename, file_type, chunk_count, byte_size, ingested_at or time.time())
+        with self._lock:
+            if filename not in self._documents:
+                insort(self._names, filename)
+            self._documents[filename] = entry
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)", tuple(entry.values()))
+                self._db.commit()
+        return entry
+
+    def remove(self, filename):
+        with self._lock:
+            if self._documents.pop(filename, None) is None:
+                return
+            self._names.pop(bisect_right(self._names, filename) - 1)
+            if self._db is not None:
+                self._db.execute("DELETE FROM documents WHERE filename = ?", (filename,))
+                self._db.commit()
+
+    def total_chunks(self):
+        with self._lock:
+            return sum(entry["chunk_count"] for entry in self._documents.values())
+
+    def oldest_first(self):
+        """Every document, least recently ingested first (documents of unknown age first of all)."""
+        with self._lock:
+            entries = [dict(entry) for entry in self._documents.values()]
+        return sorted(entries, key=lambda entry: entry["ingested_at"] or 0.0)
+
+    def list(self, after=None, limit=100, file_type=None):
+        """
+        Page through documents in filename order.
+
+        Returns (documents, next_cursor); pass next_cursor as `after` to get the
+        following page. next_cursor is None on the last page.
+        """
+        with self._lock:
+            start = bisect_right(self._names, after) if after is not None else 0
+            page = []
+            for filename in self._names[start:]:
+                entry = self._documents[filename]
+                if file_type is None or entry["file_type"] == file_type:
+                    page.append(dict(entry))
+                    if len(page) > limit:
+                        break
+        if len(page) > limit:
+            return page[:limit], page[limit - 1]["filename"]
+        return page, None
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+
+
+catalog = DocumentCatalog()
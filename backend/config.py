@@ -7,4 +7,99 @@ load_dotenv()
 # Load API keys
 WEAVIATE_URL = os.getenv("WEAVIATE_URL")
 WEAVIATE_API_KEY = os.getenv("WEAVIATE_API_KEY")
-COHERE_API_KEY = os.getenv("COHERE_API_KEY")
\ No newline at end of file
+COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+
+# Vector store backend: "weaviate" (Weaviate Cloud) or "local" (embedded NumPy engine)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "weaviate").lower()
+
+# Local state (embedded vector store, sidecar files, caches)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", os.path.join(DATA_DIR, "vector_store"))
+LOCAL_INDEX_TYPE = os.getenv("LOCAL_INDEX_TYPE", "exact").lower()  # "exact" or "hnsw"
+
+# Embeddings used by the local backend: "cohere" or "local" (deterministic, offline)
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "cohere" if COHERE_API_KEY else "local").lower()
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "embed-multilingual-light-v3.0")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "384"))
+# Chunk embeddings are requested in batches of this many texts (Cohere accepts at most 96 per call)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "96"))
+# Persistent cache of chunk embeddings keyed by (model, content hash); set to "" to disable
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(DATA_DIR, "embedding_cache.db"))
+
+# Background ingestion: process pool for extraction/chunking, threads for embedding/storage
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+INGEST_STORE_WORKERS = int(os.getenv("INGEST_STORE_WORKERS", "2"))
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "1000"))
+
+# Columnar sidecars for /json-query aggregations
+AGGREGATES_PATH = os.getenv("AGGREGATES_PATH", os.path.join(DATA_DIR, "aggregates"))
+MAX_GROUP_CARDINALITY = int(os.getenv("MAX_GROUP_CARDINALITY", "10000"))
+JSON_BATCH_SIZE = int(os.getenv("JSON_BATCH_SIZE", "500"))  # records per store write when streaming JSON
+
+# Query caches: embeddings keyed on normalized query text, results on (document, query, top_k)
+QUERY_EMBEDDING_CACHE_BYTES = int(os.getenv("QUERY_EMBEDDING_CACHE_BYTES", str(16 * 1024 * 1024)))
+QUERY_RESULT_CACHE_BYTES = int(os.getenv("QUERY_RESULT_CACHE_BYTES", str(64 * 1024 * 1024)))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))  # seconds
+# Let concurrent identical /query and /json-query requests share one backend call
+QUERY_COALESCING = os.getenv("QUERY_COALESCING", "true").lower() == "true"
+
+# Document catalog (filename, type, chunk count, size, ingest time) persisted across restarts
+CATALOG_PATH = os.getenv("CATALOG_PATH", os.path.join(DATA_DIR, "catalog.db"))
+
+# POST /query/batch: maximum items per request and searches run at once
+QUERY_BATCH_MAX_ITEMS = int(os.getenv("QUERY_BATCH_MAX_ITEMS", "100"))
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", "8"))
+
+# BM25 inverted index for keyword and hybrid (/search) retrieval
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", os.path.join(DATA_DIR, "search_index"))
+SEARCH_POSTINGS_CACHE_BYTES = int(os.getenv("SEARCH_POSTINGS_CACHE_BYTES", str(128 * 1024 * 1024)))  # decoded posting blocks
+
+# Uploads are written here (one unique temp file each) until their ingestion job finishes
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", os.path.join(DATA_DIR, "uploads"))
+# POST /upload/bulk: ingestion jobs a single request keeps running at once
+BULK_MAX_JOBS = int(os.getenv("BULK_MAX_JOBS", "4"))
+# Limits of a single archive in a bulk upload, so a zip bomb cannot fill the disk
+ARCHIVE_MAX_MEMBERS = int(os.getenv("ARCHIVE_MAX_MEMBERS", "10000"))  # files extracted
+ARCHIVE_MAX_BYTES = int(os.getenv("ARCHIVE_MAX_BYTES", str(10 * 1024 * 1024 * 1024)))  # bytes extracted, in total
+
+# Add a Server-Timing header with the stage breakdown of each request (GET /metrics has the aggregates)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+
+# Start the ingestion workers (and load their parsers and tokenizer) during startup instead of on the first upload
+WARM_UP_INGEST_WORKERS = os.getenv("WARM_UP_INGEST_WORKERS", "true").lower() == "true"
+
+# Layout of the Weaviate Documents collection: "none" (one shared index, queries filter on filename),
+# "document" (one tenant per document) or "group" (documents hashed into PARTITION_GROUPS tenants)
+PARTITIONING = os.getenv("PARTITIONING", "none").lower()
+PARTITION_GROUPS = int(os.getenv("PARTITION_GROUPS", "64"))
+# Partitions not read or written for this long are deactivated until next used (0 disables); checked every interval
+PARTITION_IDLE_SECONDS = float(os.getenv("PARTITION_IDLE_SECONDS", "3600"))
+PARTITION_OFFLOAD_INTERVAL = float(os.getenv("PARTITION_OFFLOAD_INTERVAL", "60"))
+# Status idle partitions are moved to: "inactive" (on local disk) or "offloaded" (cloud storage, needs an offload module)
+PARTITION_OFFLOAD_STATUS = os.getenv("PARTITION_OFFLOAD_STATUS", "inactive").lower()
+
+# Retention, checked every RETENTION_INTERVAL seconds: delete documents ingested more than RETENTION_MAX_AGE
+# seconds ago, and the oldest documents while more than RETENTION_MAX_CHUNKS chunks are stored (0 disables each)
+RETENTION_MAX_AGE = float(os.getenv("RETENTION_MAX_AGE", "0"))
+RETENTION_MAX_CHUNKS = int(os.getenv("RETENTION_MAX_CHUNKS", "0"))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "300"))
+
+# Connections per API worker process for the async vector store and embedding clients
+STORE_POOL_SIZE = int(os.getenv("STORE_POOL_SIZE", "32"))
+
+# Admission control per route class: requests running at once, requests waiting for a turn (beyond that: 429),
+# and for uploads the request bytes in flight; a request that waits longer than ADMISSION_QUEUE_TIMEOUT gets a 503
+QUERY_MAX_CONCURRENCY = int(os.getenv("QUERY_MAX_CONCURRENCY", "64"))
+QUERY_MAX_QUEUED = int(os.getenv("QUERY_MAX_QUEUED", "256"))
+UPLOAD_MAX_CONCURRENCY = int(os.getenv("UPLOAD_MAX_CONCURRENCY", "4"))
+UPLOAD_MAX_QUEUED = int(os.getenv("UPLOAD_MAX_QUEUED", "16"))
+UPLOAD_MAX_BYTES_IN_FLIGHT = int(os.getenv("UPLOAD_MAX_BYTES_IN_FLIGHT", str(512 * 1024 * 1024)))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))  # seconds
+# Ingestion jobs waiting or running before /upload answers 503
+INGEST_MAX_PENDING_JOBS = int(os.getenv("INGEST_MAX_PENDING_JOBS", "100"))
+# Queries go first: ingestion defers its store writes and extraction steps while queries run, for at most this long in total per job
+INGEST_MAX_DEFER = float(os.getenv("INGEST_MAX_DEFER", "0.5"))  # seconds
+# Niceness of the extraction/chunking worker processes, so the API process gets the CPU first (0 disables)
+INGEST_WORKER_NICE = int(os.getenv("INGEST_WORKER_NICE", "10"))
+# Threads that write uploads to disk, kept apart from the default executor used by queries
+UPLOAD_IO_WORKERS = int(os.getenv("UPLOAD_IO_WORKERS", "4"))
@@ -1,47 +1,47 @@
-import weaviate
-from weaviate.classes.init import Auth
-from weaviate.classes.config import Configure
-from config import WEAVIATE_URL, WEAVIATE_API_KEY, COHERE_API_KEY
-
-def create_weaviate_client():
-    """Create and configure a Weaviate client connection."""
-    headers = {"X-Cohere-Api-Key": COHERE_API_KEY}
-    
-    client = weaviate.connect_to_weaviate_cloud(
-        cluster_url=WEAVIATE_URL,
-        auth_credentials=Auth.api_key(WEAVIATE_API_KEY),
-        headers=headers
-    )
-    
-    return client
-
-def setup_collection(client):
-    """Set up the Documents collection in Weaviate if it doesn't exist."""
-    try:
-        client.collections.create(
-            "Documents",
-            vectorizer_config=[
-                Configure.NamedVectors.text2vec_cohere(
-                    name="content_vector",
-                    source_properties=["text_chunk"],
-                    model="embed-multilingual-light-v3.0"
-                )
-            ]
-        )
-        print("Collection created successfully")
-    except Exception as e:
-        print(f"Collection already exists or error: {str(e)}")
-
-# Initialize the client
-client = create_weaviate_client()
-
-# Set up the collection
-setup_collection(client)
+import threading
+from config import VECTOR_BACKEND, LOCAL_STORE_PATH, LOCAL_INDEX_TYPE
+
+def create_store():
+    """Create the vector store selected by VECTOR_BACKEND."""
+    from embeddings import get_embedder
+
+    if VECTOR_BACKEND == "local":
+        from local_store import LocalVectorStore
+        return LocalVectorStore(LOCAL_STORE_PATH, get_embedder(), index_type=LOCAL_INDEX_TYPE)
+
+    from weaviate_store import WeaviateStore, create_weaviate_client, setup_collection
+    client = create_weaviate_client()
+    # Chunks are embedded client-side with the model of the collection's vectorizer
+    store = WeaviateStore(client, get_embedder("cohere"))  # checks the settings before the schema is touched
+    setup_collection(client)
+    return store
+
+# Created on first use (normally by the startup warm-up), not at import time
+_store = None
+_store_lock = threading.Lock()
 
 def get_client():
-    """Get the Weaviate client instance."""
-    return client
+    """Get the vector store instance (Weaviate or local, depending on VECTOR_BACKEND), connecting on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store()
+    return _store
+
+def is_connected():
+    """Whether the store has been created (without creating it)."""
+    return _store is not None
+
+async def aclose_client():
+    """Close the store's async connections, if it was opened; call from the event loop before close_client()."""
+    if _store is not None:
+        await _store.aclose()
 
 def close_client():
-    """Close the Weaviate client connection."""
-    client.close()
\ No newline at end of file
+    """Close the vector store connection, if it was opened."""
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
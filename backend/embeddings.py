@@ -0,0 +1,327 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import numpy as np
+import metrics
+from text_processing import chunk_hash
+from config import (
+    COHERE_API_KEY, EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_DIM,
+    EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE_PATH, STORE_POOL_SIZE,
+)
+
+# Seconds before an async Cohere call gives up
+COHERE_TIMEOUT = 60
+
+
+class EmbeddingProvider:
+    """
+    Interface of an embedding provider.
+
+    model names the embedding space: vectors from providers with different
+    model names are never mixed, in the cache or in a store.
+    """
+
+    model = None
+
+    def embed_documents(self, texts):
+        """Embed document chunks. Returns a float32 matrix of shape (len(texts), dim)."""
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        """Embed a single search query. Returns a float32 vector."""
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts):
+        """Embed several search queries. Returns a float32 matrix."""
+        raise NotImplementedError
+
+    async def embed_query_async(self, text):
+        """embed_query without blocking the event loop (on a worker thread unless overridden)."""
+        return await asyncio.to_thread(self.embed_query, text)
+
+    async def embed_queries_async(self, texts):
+        """embed_queries without blocking the event loop (on a worker thread unless overridden)."""
+        return await asyncio.to_thread(self.embed_queries, texts)
+
+    async def aclose(self):
+        """Close connections opened by the async methods."""
+
+
+class CohereEmbedder(EmbeddingProvider):
+    """Embeds text with the Cohere API (same model the Weaviate vectorizer uses)."""
+
+    def __init__(self, api_key=COHERE_API_KEY, model=EMBEDDING_MODEL):
+        import cohere
+
+        self.client = cohere.Client(api_key)
+        self.api_key = api_key
+        self.model = model
+        # Opened on first async use, in the event loop of the worker process that serves queries
+        self._async_client = None
+        self._http = None
+
+    def _embed(self, texts, input_type):
+        response = self.client.embed(texts=list(texts), model=self.model, input_type=input_type)
+        return np.asarray(response.embeddings, dtype=np.float32)
+
+    async def _embed_async(self, texts, input_type):
+        if self._async_client is None:
+            import cohere
+            import httpx
+
+            # One keep-alive connection pool per worker process, shared by all concurrent queries
+            self._http = httpx.AsyncClient(
+                timeout=COHERE_TIMEOUT, limits=httpx.Limits(max_connections=STORE_POOL_SIZE, max_keepalive_connections=STORE_POOL_SIZE)
+            )
+            self._async_client = cohere.AsyncClient(self.api_key, httpx_client=self._http)
+        response = await self._async_client.embed(texts=list(texts), model=self.model, input_type=input_type)
+        return np.asarray(response.embeddings, dtype=np.float32)
+
+    def embed_documents(self, texts):
+        """Embed document chunks. Returns a float32 matrix of shape (len(texts), dim)."""
+        return self._embed(texts, "search_document")
+
+    def embed_query(self, text):
+        """Embed a single search query. Returns a float32 vector."""
+        return self._embed([text], "search_query")[0]
+
+    def embed_queries(self, texts):
+        """Embed several search queries in one API call. Returns a float32 matrix."""
+        return self._embed(texts, "search_query")
+
+    async def embed_query_async(self, text):
+        return (await self._embed_async([text], "search_query"))[0]
+
+    async def embed_queries_async(self, texts):
+        return await self._embed_async(texts, "search_query")
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = self._async_client = None
+
+
+class LocalEmbedder(EmbeddingProvider):
+    """
+    Deterministic feature-hashing embedder for offline runs and load tests.
+
+    Words and word bigrams are hashed into a fixed number of signed buckets and
+    the result is L2-normalised, so texts sharing vocabulary score as similar.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.model = f"local-hash-{dim}"
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = re.findall(r"\w+", text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dim] += 1.0 if value >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts):
+        """Embed document chunks. Returns a float32 matrix of shape (len(texts), dim)."""
+        return np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+
+    def embed_query(self, text):
+        """Embed a single search query. Returns a float32 vector."""
+        return self._vector(text)
+
+    def embed_queries(self, texts):
+        """Embed several search queries. Returns a float32 matrix."""
+        return self.embed_documents(texts)
+
+    async def embed_query_async(self, text):
+        # Hashing a query takes microseconds, less than handing it to a thread
+        return self.embed_query(text)
+
+    async def embed_queries_async(self, texts):
+        return self.embed_queries(texts)
+
+
+PROVIDERS = {
+    "cohere": CohereEmbedder,
+    "local": LocalEmbedder,
+}
+
+
+class EmbeddingCache:
+    """
+    Persistent chunk embeddings keyed by (model, content hash), stored in SQLite.
+
+    Identical text is embedded once per model, whichever document it occurs
+    in and however often it is re-ingested, including across restarts.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash)) WITHOUT ROWID"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, model, hashes):
+        """Cached vectors of the given content hashes, as {hash: vector}."""
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                cursor = self._db.execute(
+                    f"SELECT hash, vector FROM vectors WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                )
+                for content_hash, vector in cursor:
+                    found[content_hash] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, model, items):
+        """Store (hash, vector) pairs."""
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO vectors (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, content_hash, np.asarray(vector, dtype=np.float32).tobytes()) for content_hash, vector in items],
+            )
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CachedEmbedder:
+    """
+    Client-side embedding stage in front of a provider.
+
+    Document chunks are looked up by content hash in the persistent cache,
+    then (through lookup) among the vectors the store already holds; only
+    the remaining distinct texts go to the provider, in fixed-size batches.
+    Queries are passed straight through (QueryCache caches those).
+    """
+
+    def __init__(self, provider, cache=None, batch_size=EMBEDDING_BATCH_SIZE):
+        self.provider = provider
+        self.cache = cache
+        self.batch_size = batch_size
+        self.model = provider.model
+        self._lock = threading.Lock()
+        self._texts = 0
+        self._cache_hits = 0
+        self._store_hits = 0
+        self._embedded = 0
+        self._calls = 0
+        self._calls_saved = 0
+
+    def embed_documents(self, texts, hashes=None, lookup=None):
+        """
+        Embed document chunks. Returns a float32 matrix of shape (len(texts), dim).
+
+        hashes optionally gives the content hash of each text; lookup(hashes)
+        may return {hash: vector} for texts the cache lacks but the caller
+        already stores.
+        """
+        texts = list(texts)
+        if not texts:
+            return np.asarray(self.provider.embed_documents([]), dtype=np.float32)
+        hashes = hashes if hashes is not None else [chunk_hash(text) for text in texts]
+        unique = list(dict.fromkeys(hashes))
+        vectors = self.cache.get_many(self.model, unique) if self.cache is not None else {}
+        cache_hits = len(vectors)
+        store_hits = 0
+        if lookup is not None and len(vectors) < len(unique):
+            stored = lookup([content_hash for content_hash in unique if content_hash not in vectors])
+            store_hits = len(stored)
+            vectors.update(stored)
+            if stored and self.cache is not None:
+                self.cache.put_many(self.model, stored.items())
+
+        # Embed each remaining text once, even if it repeats within the call
+        missing = {}
+        for text, content_hash in zip(texts, hashes):
+            if content_hash not in vectors:
+                missing.setdefault(content_hash, text)
+        missing = list(missing.items())
+        calls = 0
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            with metrics.stage("ingest", "embedding"):
+                embedded = np.asarray(self.provider.embed_documents([text for _, text in batch]), dtype=np.float32)
+            calls += 1
+            batch_vectors = list(zip((content_hash for content_hash, _ in batch), embedded))
+            vectors.update(batch_vectors)
+            if self.cache is not None:
+                self.cache.put_many(self.model, batch_vectors)
+
+        with self._lock:
+            self._texts += len(texts)
+            self._cache_hits += cache_hits
+            self._store_hits += store_hits
+            self._embedded += len(missing)
+            self._calls += calls
+            # Provider calls these texts would have needed without the cache and deduplication
+            self._calls_saved += -(-len(texts) // self.batch_size) - calls
+        metrics.CHUNKS.inc(len(missing), operation="embedded")
+        metrics.CHUNKS.inc(len(texts) - len(missing), operation="embedding_cached")
+        return np.stack([vectors[content_hash] for content_hash in hashes]).astype(np.float32, copy=False)
+
+    def embed_query(self, text):
+        return self.provider.embed_query(text)
+
+    def embed_queries(self, texts):
+        return self.provider.embed_queries(texts)
+
+    async def embed_query_async(self, text):
+        return await self.provider.embed_query_async(text)
+
+    async def embed_queries_async(self, texts):
+        return await self.provider.embed_queries_async(texts)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "model": self.model,
+                "batch_size": self.batch_size,
+                "texts": self._texts,
+                "cache_hits": self._cache_hits,
+                "store_hits": self._store_hits,
+                "embedded": self._embedded,
+                "hit_rate": round(1 - self._embedded / self._texts, 4) if self._texts else 0.0,
+                "provider_calls": self._calls,
+                "provider_calls_saved": self._calls_saved,
+            }
+        stats["entries"] = len(self.cache) if self.cache is not None else 0
+        return stats
+
+    async def aclose(self):
+        await self.provider.aclose()
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+
+
+def get_embedder(provider=EMBEDDING_PROVIDER, cache_path=EMBEDDING_CACHE_PATH):
+    """
+    Create the embedding stage for the configured provider (EMBEDDING_PROVIDER).
+
+    Chunk embeddings are cached on disk at cache_path; pass an empty path to
+    disable the persistent cache.
+    """
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown embedding provider: {provider}")
+    return CachedEmbedder(PROVIDERS[provider](), EmbeddingCache(cache_path) if cache_path else None)
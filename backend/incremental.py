@@ -0,0 +1,65 @@
+import uuid
+from collections import deque
+from text_processing import chunk_hash
+
+
+class ChunkDiff:
+    """
+    Matches the chunks of a new version of a document against the stored version by content hash.
+
+    Feed the new chunks in order to match(): chunks whose text is already
+    stored are kept (and renumbered if they moved), so only new chunks are
+    embedded and written. Whatever is left unmatched once every chunk has been
+    fed was removed from the document.
+
+    The stored positions and the uuids given to new chunks are remembered, so
+    a failed update can be undone (see original() and new_uuids()).
+    """
+
+    def __init__(self, stored_chunks):
+        self._stored = {}
+        self._original = []
+        self._new_uuids = []
+        for chunk in stored_chunks:
+            entry = (chunk["uuid"], chunk["chunk_id"], chunk["page"])
+            self._stored.setdefault(chunk_hash(chunk["text_chunk"]), deque()).append(entry)
+            self._original.append(entry)
+        self.added = 0
+        self.kept = 0
+
+    def match(self, chunks, start_id=0, pages=None):
+        """
+        Match the next chunks of the new version, numbered from start_id.
+
+        Returns (new, moved): new lists (uuid, chunk_id, text, page) of chunks
+        to store, moved lists (uuid, chunk_id, page) of kept chunks whose
+        position changed.
+        """
+        new, moved = [], []
+        for i, chunk in enumerate(chunks):
+            chunk_id = start_id + i
+            page = pages[i] if pages is not None else None
+            candidates = self._stored.get(chunk_hash(chunk))
+            if candidates:
+                uid, stored_id, stored_page = candidates.popleft()
+                self.kept += 1
+                if (stored_id, stored_page) != (chunk_id, page):
+                    moved.append((uid, chunk_id, page))
+            else:
+                uid = str(uuid.uuid4())
+                self._new_uuids.append(uid)
+                new.append((uid, chunk_id, chunk, page))
+        self.added += len(new)
+        return new, moved
+
+    def removed(self):
+        """uuids of stored chunks that no longer occur in the new version."""
+        return [uid for entries in self._stored.values() for uid, _, _ in entries]
+
+    def original(self):
+        """(uuid, chunk_id, page) of every stored chunk as it was before the update."""
+        return list(self._original)
+
+    def new_uuids(self):
+        """uuids handed out to new chunks so far."""
+        return list(self._new_uuids)
@@ -0,0 +1,429 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import queue as queue_module
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import database
+import aggregates
+import metrics
+from admission import DeferBudget, yield_to_queries
+from cache import query_cache
+from catalog import catalog
+from incremental import ChunkDiff
+from search_index import search_index
+from text_processing import (
+    JSON_FILE_TYPES, chunk_pages, extract_and_chunk, extract_pdf_range,
+    pdf_page_count, pdf_page_ranges, stream_json_chunks, warm_up as warm_up_text_processing,
+)
+from config import INGEST_WORKERS, INGEST_STORE_WORKERS, JOB_HISTORY_LIMIT, INGEST_WORKER_NICE
+
+# Batches of JSON chunks buffered between the parsing worker and the store writer
+JSON_QUEUE_DEPTH = 4
+
+
+def _lower_priority():
+    """Process pool initializer: run extraction and chunking at a lower CPU priority than the API."""
+    if INGEST_WORKER_NICE:
+        try:
+            os.nice(INGEST_WORKER_NICE)
+        except (AttributeError, OSError):  # not available on this platform
+            pass
+
+
+class IngestionJob:
+    """State of one document ingestion, as reported by /jobs/{id}."""
+
+    def __init__(self, filename, file_type, byte_size=None, update=False):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.file_type = file_type
+        self.byte_size = byte_size
+        self.mode = "update" if update else "create"
+        self.stage = "queued"
+        self.chunk_count = None
+        self.chunks_added = None
+        self.chunks_kept = None
+        self.chunks_removed = None
+        self.error = None
+        self.created_at = time.time()
+        self.timings = {}
+        self.defer_budget = DeferBudget()
+        self.finished = asyncio.Event()  # set once the job completed or failed
+        self._stage_started = time.perf_counter()
+
+    def enter_stage(self, stage):
+        """Close the timer of the current stage and start the next one."""
+        now = time.perf_counter()
+        self.timings[self.stage] = round(now - self._stage_started, 4)
+        self.stage = stage
+        self._stage_started = now
+
+    @property
+    def done(self):
+        return self.stage in ("completed", "failed")
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "stage": self.stage,
+            "mode": self.mode,
+            "chunk_count": self.chunk_count,
+            "chunks_added": self.chunks_added,
+            "chunks_kept": self.chunks_kept,
+            "chunks_removed": self.chunks_removed,
+            "error": self.error,
+            "created_at": self.created_at,
+            "timings": self.timings,
+        }
+
+
+class JobManager:
+    """
+    Runs document ingestion off the event loop.
+
+    Extraction and chunking are CPU-bound and run in a bounded process pool;
+    embedding and storage are I/O-bound and run in a separate thread pool, so
+    a large upload never blocks request handling. JSON files are streamed: the
+    worker parses records into a bounded queue while the job writes each batch
+    to the store, so memory stays constant regardless of file size.
+    """
+
+    def __init__(self, max_workers=INGEST_WORKERS, store_workers=INGEST_STORE_WORKERS, history_limit=JOB_HISTORY_LIMIT):
+        self.max_workers = max_workers
+        self.history_limit = history_limit
+        self._process_pool = None
+        self._queue_manager = None
+        self._store_pool = ThreadPoolExecutor(max_workers=store_workers, thread_name_prefix="ingest-store")
+        self._jobs = OrderedDict()
+        self._tasks = set()
+        self._deleting = set()
+        self._reserved = set()
+
+    def _get_process_pool(self):
+        # Created lazily; "spawn" keeps workers from inheriting the vector store connection
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_lower_priority
+            )
+        return self._process_pool
+
+    def _get_queue_manager(self):
+        # Manager queues can be handed to pool workers, unlike plain multiprocessing queues
+        if self._queue_manager is None:
+            self._queue_manager = multiprocessing.get_context("spawn").Manager()
+        return self._queue_manager
+
+    async def warm_up(self):
+        """Start the worker processes and load the text-processing libraries in each of them."""
+        await asyncio.gather(*(self._run_in_pool(warm_up_text_processing) for _ in range(self.max_workers)))
+
+    def submit(self, file_path, filename, file_type, update=False):
+        """
+        Queue a saved upload for ingestion and return its job. Must be called from the event loop.
+
+        With update=True the upload replaces the stored document of the same
+        name, writing only the chunks that changed.
+        """
+        job = IngestionJob(filename, file_type, os.path.getsize(file_path), update)
+        self._jobs[job.id] = job
+        self._prune()
+        task = asyncio.get_running_loop().create_task(self._run(job, file_path))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def is_pending(self, filename):
+        """Check whether a job for this filename is still running (or reserved, or the document is being deleted)."""
+        return (
+            filename in self._reserved or filename in self._deleting
+            or any(job.filename == filename and not job.done for job in self._jobs.values())
+        )
+
+    def reserve(self, filename):
+        """
+        Count a filename as pending while its upload is still being received.
+
+        Call right after checking is_pending, before the first await, so a
+        concurrent upload of the same name is rejected; release() once the
+        job is submitted (or the upload failed).
+        """
+        self._reserved.add(filename)
+
+    def release(self, filename):
+        self._reserved.discard(filename)
+
+    async def delete(self, filename):
+        """
+        Delete a stored document: its chunks, keyword index entries, aggregation
+        sidecar, catalog entry and cached query results. Must be called from the event loop.
+
+        The filename counts as pending until the deletion finished, so uploads
+        of it are rejected meanwhile. Returns the number of chunks deleted.
+        """
+        entry = catalog.get(filename)
+        self._deleting.add(filename)
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._store_pool, self._delete_document, filename)
+        finally:
+            query_cache.invalidate_document(filename)
+            self._deleting.discard(filename)
+        chunk_count = entry["chunk_count"] if entry is not None else 0
+        metrics.CHUNKS.inc(chunk_count, operation="deleted")
+        return chunk_count
+
+    async def compact(self):
+        """
+        Reclaim the space deleted documents left in the vector store and the
+        keyword index. Must be called from the event loop.
+
+        Returns (store rows, index doc ids) reclaimed.
+        """
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(self._store_pool, database.get_client().compact)
+        doc_ids = await loop.run_in_executor(self._store_pool, search_index.compact)
+        return rows, doc_ids
+
+    def pending_count(self):
+        """Jobs queued or running."""
+        return len(self._tasks)
+
+    def stats(self):
+        stages = {}
+        for job in self._jobs.values():
+            if not job.done:
+                stages[job.stage] = stages.get(job.stage, 0) + 1
+        return {"pending": len(self._tasks), "stages": stages}
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(self._jobs) - self.history_limit)]:
+            del self._jobs[job_id]
+
+    async def _run(self, job, file_path):
+        # JSON columns are built by the worker next to the final sidecar and installed once stored
+        sidecar_path = f"{aggregates.sidecar_path(job.filename)}.{job.id}" if job.file_type in JSON_FILE_TYPES else None
+        loop = asyncio.get_running_loop()
+        store = database.get_client()
+        # The job outlives the upload request it was submitted from
+        metrics.detach_request_timings()
+        metrics.IN_FLIGHT.inc(operation="ingest_jobs")
+        diff = None
+        try:
+            if job.mode == "update":
+                # Hash what is stored now; unchanged chunks keep their embeddings
+                diff = await loop.run_in_executor(self._store_pool, lambda: ChunkDiff(store.fetch_chunks(job.filename)))
+                await loop.run_in_executor(self._store_pool, search_index.remove_document, job.filename)
+            if job.file_type in JSON_FILE_TYPES:
+                await self._stream_json(job, file_path, sidecar_path, diff)
+            else:
+                await self._extract_and_store(job, file_path, diff)
+            if diff is not None:
+                job.chunks_removed = await loop.run_in_executor(
+                    self._store_pool, store.delete_chunks, job.filename, diff.removed()
+                )
+                job.chunks_added, job.chunks_kept = diff.added, diff.kept
+            else:
+                job.chunks_added, job.chunks_kept, job.chunks_removed = job.chunk_count, 0, 0
+            if sidecar_path is not None:
+                aggregates.install_sidecar(job.filename, sidecar_path)
+            catalog.add(job.filename, job.file_type, job.chunk_count, job.byte_size)
+            job.enter_stage("completed")
+            metrics.CHUNKS.inc(job.chunk_count, operation="ingested")
+            metrics.BYTES.inc(job.byte_size, operation="ingested")
+        except Exception as e:
+            job.error = str(e)
+            try:
+                if diff is not None:
+                    # Put the stored version back: the document was changed in place
+                    await loop.run_in_executor(self._store_pool, self._restore_document, job.filename, diff)
+                elif job.mode == "create":
+                    # Drop the batches already written, so a retried upload starts from a clean slate
+                    await loop.run_in_executor(self._store_pool, self._delete_document, job.filename)
+            except Exception as cleanup_error:
+                print(f"Warning: Could not clean up after the failed ingestion of {job.filename}: {str(cleanup_error)}")
+            job.enter_stage("failed")
+        finally:
+            query_cache.invalidate_document(job.filename)
+            job.timings["total"] = round(sum(job.timings.values()), 4)
+            metrics.IN_FLIGHT.dec(operation="ingest_jobs")
+            metrics.INGEST_JOBS.inc(status=job.stage)
+            metrics.observe_stage("ingest", "queued", job.timings.get("queued", 0.0))
+            metrics.observe_stage("ingest", "total", job.timings["total"])
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            if sidecar_path is not None:
+                shutil.rmtree(sidecar_path, ignore_errors=True)
+            job.finished.set()
+
+    async def _run_in_pool(self, fn, *args, budget=None):
+        await yield_to_queries(budget)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_process_pool(), fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a huge file); start a fresh pool for the next job
+            self._process_pool = None
+            raise
+
+    async def _extract_and_store(self, job, file_path, diff=None):
+        loop = asyncio.get_running_loop()
+        job.enter_stage("extracting")
+        pages = None
+        if job.file_type == "pdf":
+            # Spread page ranges over the pool, then chunk the ordered pages in one worker
+            with metrics.stage("ingest", "extraction"):
+                page_count = await self._run_in_pool(pdf_page_count, file_path, budget=job.defer_budget)
+                ranges = pdf_page_ranges(page_count, self.max_workers)
+                page_texts = await asyncio.gather(*(
+                    self._run_in_pool(extract_pdf_range, file_path, start, stop, budget=job.defer_budget)
+                    for start, stop in ranges
+                ))
+            job.enter_stage("chunking")
+            with metrics.stage("ingest", "chunking"):
+                chunks, pages = await self._run_in_pool(
+                    chunk_pages, [page for part in page_texts for page in part], budget=job.defer_budget
+                )
+        else:
+            chunks, timings = await self._run_in_pool(extract_and_chunk, file_path, job.file_type, budget=job.defer_budget)
+            for stage, seconds in timings.items():
+                metrics.observe_stage("ingest", stage, seconds)
+        job.chunk_count = len(chunks)
+
+        job.enter_stage("storing")
+        await yield_to_queries(job.defer_budget)
+        await loop.run_in_executor(
+            self._store_pool, functools.partial(self._store_chunks, job.filename, chunks, pages=pages, diff=diff)
+        )
+
+    async def _stream_json(self, job, file_path, sidecar_path, diff=None):
+        loop = asyncio.get_running_loop()
+        manager = self._get_queue_manager()
+        queue = manager.Queue(maxsize=JSON_QUEUE_DEPTH)
+        cancelled = manager.Event()
+        batches = asyncio.Queue(maxsize=1)
+
+        job.enter_stage("streaming")
+        job.chunk_count = 0
+        parsing = asyncio.ensure_future(
+            self._run_in_pool(
+                stream_json_chunks, file_path, job.file_type, queue, cancelled, sidecar_path, budget=job.defer_budget
+            )
+        )
+        # Waiting on the worker's queue would tie up a store pool thread, so it gets a thread of its own
+        worker_gone = threading.Event()
+        parsing.add_done_callback(lambda _: worker_gone.set())
+        threading.Thread(
+            target=self._read_batches, args=(queue, worker_gone, loop, batches), name="ingest-reader", daemon=True
+        ).start()
+        try:
+            while True:
+                batch = await batches.get()
+                if batch is None:
+                    break
+                await yield_to_queries(job.defer_budget)
+                await loop.run_in_executor(
+                    self._store_pool, functools.partial(self._store_chunks, job.filename, batch, job.chunk_count, diff=diff)
+                )
+                job.chunk_count += len(batch)
+        except BaseException:
+            # Stop the worker and unblock it if it is waiting on a full queue
+            cancelled.set()
+            while await batches.get() is not None:
+                pass
+            raise
+        finally:
+            await parsing
+        _, timings = parsing.result()
+        for stage, seconds in timings.items():
+            metrics.observe_stage("ingest", stage, seconds)
+
+    @staticmethod
+    def _store_chunks(filename, chunks, start_id=0, pages=None, diff=None):
+        """
+        Write chunks to the vector store and the keyword index (runs on the store pool).
+
+        When updating a document, only chunks missing from the stored version
+        are written; kept chunks are renumbered in place.
+        """
+        store = database.get_client()
+        if diff is None:
+            store.add_chunks(filename, chunks, start_id, pages=pages)
+        else:
+            new, moved = diff.match(chunks, start_id, pages)
+            if moved:
+                store.update_chunks(filename, moved)
+            if new:
+                uuids, chunk_ids, texts, new_pages = zip(*new)
+                store.add_chunks(
+                    filename, list(texts), pages=list(new_pages) if pages is not None else None,
+                    chunk_ids=list(chunk_ids), uuids=list(uuids)
+                )
+        with metrics.stage("ingest", "keyword_index"):
+            search_index.add(filename, chunks, start_id)
+
+    @staticmethod
+    def _restore_document(filename, diff):
+        """
+        Undo a failed update (runs on the store pool): delete the chunks it
+        added, renumber the kept chunks back and re-index the stored version.
+        Removed chunks are only deleted once an update succeeded, so they are still there.
+        """
+        store = database.get_client()
+        store.delete_chunks(filename, diff.new_uuids())
+        store.update_chunks(filename, diff.original())
+        search_index.remove_document(filename)
+        search_index.index_documents(store, [filename])
+
+    @staticmethod
+    def _delete_document(filename):
+        """Remove a document everywhere it is stored (runs on the store pool); the catalog entry goes last."""
+        database.get_client().delete_document(filename)
+        search_index.remove_document(filename)
+        aggregates.delete_sidecar(filename)
+        catalog.remove(filename)
+
+    @staticmethod
+    def _read_batches(queue, worker_gone, loop, batches):
+        """
+        Hand the worker's batches to the job's asyncio queue, ending with None once
+        the stream ended or the worker is gone (runs on a thread of its own).
+        """
+        while True:
+            try:
+                batch = queue.get(timeout=1)
+            except queue_module.Empty:
+                if not worker_gone.is_set():
+                    continue
+                batch = None
+            # Blocks while the job is busy with the previous batch, so the worker's queue stays bounded
+            asyncio.run_coroutine_threadsafe(batches.put(batch), loop).result()
+            if batch is None:
+                return
+
+    def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._process_pool is not None:
+            # Workers busy with a document (or still starting up) would outlive the server otherwise
+            workers = list((getattr(self._process_pool, "_processes", None) or {}).values())
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            for worker in workers:
+                worker.terminate()
+        if self._queue_manager is not None:
+            self._queue_manager.shutdown()
+        self._store_pool.shutdown(wait=False, cancel_futures=True)
+
+
+job_manager = JobManager()
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+import database
+from catalog import catalog
+from jobs import job_manager
+from search_index import search_index
+from config import WARM_UP_INGEST_WORKERS
+
+# Seconds between attempts to reach a vector store that is not up yet (e.g. Weaviate still starting)
+STORE_RETRY_INTERVAL = 5
+
+# Components that must be up before the API can serve documents and queries
+REQUIRED = ("vector_store", "catalog", "search_index")
+
+
+class WarmUp:
+    """
+    Startup work that runs after the server is already accepting connections.
+
+    The vector store connection (and its schema check), the keyword index and
+    the ingestion workers are brought up in parallel; the catalog follows
+    the store it is reconciled with. Each component reports pending, ready
+    or failed with its duration, for GET /ready.
+    """
+
+    def __init__(self):
+        self.started_at = None
+        self.components = {}
+        self.ready = False
+
+    def _component(self, name):
+        return self.components.setdefault(name, {"status": "pending", "seconds": None, "error": None})
+
+    async def _step(self, name, fn, *args):
+        """Run fn (in a thread, unless it is a coroutine function) as the named component, recording its outcome."""
+        component = self._component(name)
+        started = time.perf_counter()
+        try:
+            result = await (fn(*args) if asyncio.iscoroutinefunction(fn) else asyncio.to_thread(fn, *args))
+        except Exception as e:
+            component.update(status="failed", error=str(e))
+            raise
+        finally:
+            component["seconds"] = round(time.perf_counter() - started, 4)
+        component.update(status="ready", error=None)
+        return result
+
+    async def _open_store(self):
+        # Both clients are opened in the serving process (after any fork), the async one in its event loop
+        store = await asyncio.to_thread(database.get_client)
+        await store.connect_async()
+        return store
+
+    async def _connect_store(self):
+        while True:
+            try:
+                return await self._step("vector_store", self._open_store)
+            except Exception as e:
+                print(f"Warning: Could not connect to the vector store, retrying in {STORE_RETRY_INTERVAL}s: {str(e)}")
+                await asyncio.sleep(STORE_RETRY_INTERVAL)
+
+    async def _load_catalog(self):
+        store = await self._connect_store()
+        await self._step("catalog", catalog.load, store)
+        return store
+
+    async def _warm_up_workers(self):
+        component = self._component("ingest_workers")
+        started = time.perf_counter()
+        try:
+            await job_manager.warm_up()
+        except Exception as e:
+            # Not fatal: the first upload retries, and reports the error if it persists
+            component.update(status="failed", error=str(e))
+            print(f"Warning: Could not warm up the ingestion workers: {str(e)}")
+        else:
+            component["status"] = "ready"
+        component["seconds"] = round(time.perf_counter() - started, 4)
+
+    async def run(self):
+        self.started_at = time.time()
+        for name in REQUIRED:
+            self._component(name)
+        # Worker start-up does not hold up readiness
+        workers = asyncio.ensure_future(self._warm_up_workers()) if WARM_UP_INGEST_WORKERS else None
+        try:
+            store, _ = await asyncio.gather(self._load_catalog(), self._step("search_index", search_index.load))
+        except Exception as e:
+            print(f"Error: Startup failed, the API stays unready: {str(e)}")
+        else:
+            self.ready = True
+            # Index documents stored before the keyword index existed
+            missing = [filename for filename in catalog.filenames() if not search_index.has_document(filename)]
+            if missing:
+                threading.Thread(target=search_index.index_documents, args=(store, missing), daemon=True).start()
+        if workers is not None:
+            await workers
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "uptime_seconds": round(time.time() - self.started_at, 3) if self.started_at else None,
+            "components": self.components,
+        }
+
+
+warm_up = WarmUp()
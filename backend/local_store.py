@@ -0,0 +1,491 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import uuid
+import numpy as np
+import metrics
+from text_processing import chunk_hash
+
+try:
+    import hnswlib
+except ImportError:  # HNSW is optional; exact search is used without it
+    hnswlib = None
+
+# Documents with fewer chunks than this are always searched exactly: a brute
+# force dot product over a few thousand rows beats any graph traversal.
+HNSW_MIN_ROWS = 5000
+INITIAL_CAPACITY = 1024
+
+
+class LocalVectorStore:
+    """
+    In-process vector store.
+
+    Vectors live in a single memory-mapped float32 matrix (one row per chunk),
+    metadata (filename, chunk_id, text, content hash) in a SQLite table keyed
+    by the same row number. The rows of every document are kept in memory so
+    a single-document query is one dot product over that document's slice of
+    the matrix. Chunks whose text is already stored (in any document) reuse
+    the stored vector instead of being embedded again. Deleted chunks leave
+    their matrix row unused until compact() renumbers the rows.
+
+    Writes hold the lock. Searches take the matrix and a document's rows
+    under it and compute outside it (the arrays are replaced, never changed
+    in place); every SQLite statement runs under the lock.
+    """
+
+    backend = "local"
+
+    def __init__(self, path, embedder, index_type="exact"):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.embedder = embedder
+        self.index_type = index_type
+        self._lock = threading.RLock()
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._hnsw_path = os.path.join(path, "hnsw.bin")
+
+        self._db = sqlite3.connect(os.path.join(path, "metadata.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY, uuid TEXT NOT NULL, filename TEXT NOT NULL, "
+            "chunk_id INTEGER NOT NULL, text_chunk TEXT NOT NULL, page INTEGER)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(chunks)")]
+        if "page" not in columns:
+            self._db.execute("ALTER TABLE chunks ADD COLUMN page INTEGER")
+        if "hash" not in columns:
+            self._db.execute("ALTER TABLE chunks ADD COLUMN hash TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_chunks_filename ON chunks (filename, chunk_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_chunks_uuid ON chunks (uuid)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_chunks_hash ON chunks (hash)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+
+        dim = self._db.execute("SELECT value FROM info WHERE key = 'dim'").fetchone()
+        self.dim = int(dim[0]) if dim else None
+        self._count = self._db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM chunks").fetchone()[0]
+        self._vectors = None
+        self._capacity = 0
+        if self.dim is not None and os.path.exists(self._vectors_path):
+            self._map(os.path.getsize(self._vectors_path) // (self.dim * 4))
+
+        self._rows = {}
+        # Rows in ascending order (not chunk_id order, which an update may permute), like _append keeps them
+        for filename, row in self._db.execute("SELECT filename, row FROM chunks ORDER BY filename, row"):
+            self._rows.setdefault(filename, []).append(row)
+        self._rows = {name: np.asarray(rows, dtype=np.int64) for name, rows in self._rows.items()}
+        self._live_rows = None
+        # Bumped by compact(): row numbers taken before it no longer name the same chunks
+        self._generation = 0
+
+        self._hnsw = None
+        if index_type == "hnsw":
+            if hnswlib is None:
+                print("hnswlib is not installed, falling back to exact search")
+            elif self.dim is not None:
+                self._load_hnsw()
+
+    # Storage helpers
+
+    def _map(self, capacity):
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._capacity = capacity
+
+    def _ensure_capacity(self, needed):
+        if needed <= self._capacity:
+            return
+        capacity = max(INITIAL_CAPACITY, self._capacity * 2, needed)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._map(capacity)
+        if self._hnsw is not None:
+            self._hnsw.resize_index(capacity)
+
+    def _load_hnsw(self, rebuild=False):
+        self._hnsw = hnswlib.Index(space="ip", dim=self.dim)
+        if os.path.exists(self._hnsw_path) and not rebuild:
+            self._hnsw.load_index(self._hnsw_path, max_elements=max(self._capacity, 1))
+            return
+        self._hnsw.init_index(max_elements=max(self._capacity, INITIAL_CAPACITY), ef_construction=200, M=16)
+        if self._count:
+            self._hnsw.add_items(self._vectors[:self._count], np.arange(self._count))
+
+    @staticmethod
+    def _doc_vectors(vectors, rows):
+        # Chunks of a document are written in one batch, so their rows are
+        # usually consecutive and can be read as a zero-copy slice.
+        if rows[-1] - rows[0] + 1 == len(rows) and np.all(np.diff(rows) == 1):
+            return vectors[rows[0]:rows[-1] + 1]
+        return vectors[rows]
+
+    def _all_rows(self):
+        # Every row still holding a chunk, for corpus-wide search
+        if self._live_rows is None:
+            live = sum(len(rows) for rows in self._rows.values())
+            if live == self._count:
+                self._live_rows = np.arange(self._count)
+            else:
+                self._live_rows = np.sort(np.concatenate(list(self._rows.values()))) if live else np.zeros(0, dtype=np.int64)
+        return self._live_rows
+
+    def _fetch_rows(self, rows, generation=None):
+        placeholders = ",".join("?" * len(rows))
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return None
+            cursor = self._db.execute(
+                f"SELECT row, uuid, filename, chunk_id, text_chunk, page FROM chunks WHERE row IN ({placeholders})",
+                [int(row) for row in rows],
+            ).fetchall()
+        return {
+            row: {"uuid": uid, "filename": filename, "chunk_id": chunk_id, "text_chunk": text, "page": page}
+            for row, uid, filename, chunk_id, text, page in cursor
+        }
+
+    # Store interface
+
+    def document_exists(self, filename):
+        """Check whether any chunk of the document is stored."""
+        return filename in self._rows
+
+    def _stored_vectors(self, hashes):
+        """Vectors of already stored chunks with the given content hashes, as {hash: vector}."""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            cursor = self._db.execute(
+                f"SELECT hash, MIN(row) FROM chunks WHERE hash IN ({','.join('?' * len(batch))}) GROUP BY hash", batch
+            )
+            for content_hash, row in cursor:
+                found[content_hash] = np.array(self._vectors[row])
+        return found
+
+    def _locked_stored_vectors(self, hashes):
+        with self._lock:
+            return self._stored_vectors(hashes) if self._vectors is not None else {}
+
+    def add_chunks(self, filename, chunks, start_id=0, pages=None, chunk_ids=None, uuids=None):
+        """
+        Embed and store the chunks of a document, numbered from start_id.
+        
+        pages optionally gives the page number of each chunk, chunk_ids
+        explicit (not necessarily consecutive) chunk ids and uuids the uuid of
+        each chunk (random by default). Chunks whose text is
+        in the embedding cache or already stored reuse that vector. Returns the
+        number of chunks written.
+        """
+        if not chunks:
+            return 0
+        hashes = [chunk_hash(chunk) for chunk in chunks]
+        vectors = self.embedder.embed_documents(chunks, hashes=hashes, lookup=self._locked_stored_vectors)
+        pages = pages if pages is not None else [None] * len(chunks)
+        chunk_ids = chunk_ids if chunk_ids is not None else range(start_id, start_id + len(chunks))
+        uuids = uuids if uuids is not None else [str(uuid.uuid4()) for _ in chunks]
+        records = [
+            (uid, filename, chunk_id, chunk, page, content_hash)
+            for uid, chunk_id, chunk, page, content_hash in zip(uuids, chunk_ids, chunks, pages, hashes)
+        ]
+        with self._lock, metrics.stage("ingest", "store_write"):
+            self._append(records, vectors)
+        return len(chunks)
+
+    def _append(self, records, vectors):
+        """Write (uuid, filename, chunk_id, text_chunk, page, hash) records and their vectors to new rows; hold the lock."""
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._db.execute("INSERT INTO info (key, value) VALUES ('dim', ?)", (str(self.dim),))
+            if self.index_type == "hnsw" and hnswlib is not None:
+                self._ensure_capacity(len(records))
+                self._load_hnsw()
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Vectors have {vectors.shape[1]} dimensions, the store holds {self.dim}")
+        start = self._count
+        rows = np.arange(start, start + len(records))
+        self._ensure_capacity(start + len(records))
+        self._vectors[start:start + len(records)] = vectors
+        self._vectors.flush()
+        self._db.executemany(
+            "INSERT INTO chunks (row, uuid, filename, chunk_id, text_chunk, page, hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(int(row), *record) for row, record in zip(rows, records)],
+        )
+        self._db.commit()
+        if self._hnsw is not None:
+            self._hnsw.add_items(vectors, rows)
+        self._count += len(records)
+        by_file = {}
+        for row, record in zip(rows.tolist(), records):
+            by_file.setdefault(record[1], []).append(row)
+        for filename, file_rows in by_file.items():
+            file_rows = np.asarray(file_rows, dtype=np.int64)
+            existing = self._rows.get(filename)
+            self._rows[filename] = file_rows if existing is None else np.concatenate([existing, file_rows])
+        self._live_rows = None
+
+    def import_chunks(self, chunks, vectors):
+        """
+        Store chunks with precomputed vectors (e.g. from a snapshot) under their own uuids.
+
+        Nothing is embedded. Chunks whose uuid is already stored are skipped,
+        so importing the same batch twice (when resuming) is harmless. Returns
+        the number of chunks written.
+        """
+        with self._lock, metrics.stage("ingest", "store_write"):
+            stored = set()
+            uuids = [chunk["uuid"] for chunk in chunks]
+            for i in range(0, len(uuids), 500):
+                batch = uuids[i:i + 500]
+                stored.update(uid for (uid,) in self._db.execute(
+                    f"SELECT uuid FROM chunks WHERE uuid IN ({','.join('?' * len(batch))})", batch
+                ))
+            keep = [i for i, chunk in enumerate(chunks) if chunk["uuid"] not in stored]
+            if not keep:
+                return 0
+            records = [
+                (chunk["uuid"], chunk["filename"], chunk["chunk_id"], chunk["text_chunk"], chunk["page"], chunk["hash"])
+                for chunk in (chunks[i] for i in keep)
+            ]
+            self._append(records, np.asarray(vectors, dtype=np.float32)[keep])
+        return len(keep)
+
+    def export_chunks(self, after=None, batch_size=1000):
+        """
+        Yield every stored chunk with its vector, as (chunks, vectors, cursor) batches in row order.
+
+        Chunks carry uuid, filename, chunk_id, text_chunk, page and hash;
+        passing a batch's cursor as after continues with the next batch.
+        """
+        after = -1 if after is None else int(after)
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT row, uuid, filename, chunk_id, text_chunk, page, hash FROM chunks "
+                    "WHERE row > ? ORDER BY row LIMIT ?",
+                    (after, batch_size),
+                ).fetchall()
+                if not rows:
+                    return
+                vectors = np.array(self._vectors[[row[0] for row in rows]])
+            chunks = [
+                {
+                    "uuid": uid, "filename": filename, "chunk_id": chunk_id, "text_chunk": text, "page": page,
+                    "hash": content_hash or chunk_hash(text),
+                }
+                for _, uid, filename, chunk_id, text, page, content_hash in rows
+            ]
+            after = rows[-1][0]
+            yield chunks, vectors, after
+            if len(rows) < batch_size:
+                return
+
+    def update_chunks(self, filename, updates):
+        """Renumber stored chunks of a document without re-embedding them; updates are (uuid, chunk_id, page) tuples."""
+        with self._lock:
+            self._db.executemany(
+                "UPDATE chunks SET chunk_id = ?, page = ? WHERE filename = ? AND uuid = ?",
+                [(chunk_id, page, filename, uid) for uid, chunk_id, page in updates],
+            )
+            self._db.commit()
+
+    def delete_chunks(self, filename, uuids):
+        """Delete chunks of a document by uuid. Returns the number of chunks deleted."""
+        uuids = list(uuids)
+        if not uuids:
+            return 0
+        with self._lock:
+            rows = []
+            for i in range(0, len(uuids), 500):
+                batch = uuids[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows.extend(row for (row,) in self._db.execute(
+                    f"SELECT row FROM chunks WHERE filename = ? AND uuid IN ({placeholders})", [filename, *batch]
+                ))
+                self._db.execute(f"DELETE FROM chunks WHERE filename = ? AND uuid IN ({placeholders})", [filename, *batch])
+            self._db.commit()
+            if self._hnsw is not None:
+                for row in rows:
+                    self._hnsw.mark_deleted(row)
+            remaining = np.setdiff1d(self._rows.get(filename, np.zeros(0, dtype=np.int64)), rows)
+            if len(remaining):
+                self._rows[filename] = remaining
+            else:
+                self._rows.pop(filename, None)
+            self._live_rows = None
+        return len(rows)
+
+    def delete_document(self, filename):
+        """Delete every chunk of a document. Its matrix rows stay unused until compact()."""
+        with self._lock:
+            rows = self._rows.pop(filename, None)
+            if rows is None:
+                return
+            self._db.execute("DELETE FROM chunks WHERE filename = ?", (filename,))
+            self._db.commit()
+            if self._hnsw is not None:
+                for row in rows.tolist():
+                    self._hnsw.mark_deleted(row)
+            self._live_rows = None
+
+    def compact(self):
+        """
+        Reclaim the matrix rows of deleted chunks.
+
+        Live rows are renumbered in order, the matrix is rewritten without the
+        unused ones and the HNSW graph is rebuilt; export cursors taken before
+        stop being valid. Returns the number of rows reclaimed.
+        """
+        with self._lock:
+            live = self._all_rows()
+            if len(live) == self._count:
+                return 0
+            capacity = max(INITIAL_CAPACITY, len(live))
+            # Written to a new file and swapped in: searches already running keep reading the old mapping
+            compacted = np.memmap(self._vectors_path + ".tmp", dtype=np.float32, mode="w+", shape=(capacity, self.dim))
+            for i in range(0, len(live), 100000):
+                batch = live[i:i + 100000]
+                compacted[i:i + len(batch)] = self._vectors[batch]
+            compacted.flush()
+            del compacted
+            # Rows only ever move down, so renumbering in ascending order never collides
+            self._db.executemany(
+                "UPDATE chunks SET row = ? WHERE row = ?", zip(range(len(live)), live.tolist())
+            )
+            self._db.commit()
+            os.replace(self._vectors_path + ".tmp", self._vectors_path)
+            self._map(capacity)
+
+            new_rows = np.full(self._count, -1, dtype=np.int64)
+            new_rows[live] = np.arange(len(live))
+            self._rows = {filename: new_rows[rows] for filename, rows in self._rows.items()}
+            reclaimed = self._count - len(live)
+            self._count = len(live)
+            self._live_rows = None
+            self._generation += 1
+            if self._hnsw is not None:
+                self._load_hnsw(rebuild=True)
+                self._hnsw.save_index(self._hnsw_path)
+        return reclaimed
+
+    def list_documents(self):
+        """Return {filename: chunk_count} for every stored document."""
+        with self._lock:
+            return {filename: len(rows) for filename, rows in self._rows.items()}
+
+    def embed_query(self, query):
+        """Embed a query with the store's embedder."""
+        return np.asarray(self.embedder.embed_query(query), dtype=np.float32)
+
+    def embed_queries(self, queries):
+        """Embed several queries with one embedder call. Returns a float32 matrix."""
+        return np.asarray(self.embedder.embed_queries(queries), dtype=np.float32)
+
+    async def embed_query_async(self, query):
+        return np.asarray(await self.embedder.embed_query_async(query), dtype=np.float32)
+
+    async def embed_queries_async(self, queries):
+        return np.asarray(await self.embedder.embed_queries_async(queries), dtype=np.float32)
+
+    # The async methods run the lookups on worker threads: the matrix products and
+    # SQLite reads release the GIL, so concurrent requests search in parallel
+    async def connect_async(self):
+        pass
+
+    async def document_exists_async(self, filename):
+        return await asyncio.to_thread(self.document_exists, filename)
+
+    async def search_async(self, filename, query, top_k, vector=None):
+        if vector is None:
+            vector = await self.embed_query_async(query)
+        return await asyncio.to_thread(self.search, filename, query, top_k, vector)
+
+    async def get_chunks_async(self, refs):
+        return await asyncio.to_thread(self.get_chunks, refs)
+
+    def search(self, filename, query, top_k, vector=None):
+        """
+        Return the top_k chunks of a document closest to the query, nearest first.
+        
+        A precomputed query vector (from embed_query) skips embedding the query.
+        With filename=None the whole corpus is searched.
+        """
+        with self._lock:
+            rows = self._rows.get(filename) if filename is not None else self._all_rows()
+            vectors, generation = self._vectors, self._generation
+        if rows is None or len(rows) == 0:
+            return []
+        query_vector = self.embed_query(query) if vector is None else np.asarray(vector, dtype=np.float32)
+        k = min(top_k, len(rows))
+
+        if self._hnsw is not None and len(rows) >= HNSW_MIN_ROWS:
+            with self._lock:
+                self._hnsw.set_ef(max(64, 2 * k))
+                if filename is None:
+                    labels, distances = self._hnsw.knn_query(query_vector, k=k)
+                else:
+                    allowed = set(rows.tolist())
+                    labels, distances = self._hnsw.knn_query(query_vector, k=k, filter=lambda label: label in allowed)
+            hits = list(zip(labels[0].tolist(), distances[0].tolist()))
+        else:
+            similarities = self._doc_vectors(vectors, rows) @ query_vector
+            top = np.argpartition(-similarities, k - 1)[:k]
+            top = top[np.argsort(-similarities[top])]
+            hits = [(int(rows[i]), 1.0 - float(similarities[i])) for i in top]
+
+        metadata = self._fetch_rows([row for row, _ in hits], generation)
+        if metadata is None:
+            # Compacted meanwhile; the row numbers are stale
+            return self.search(filename, query, top_k, query_vector)
+        # Chunks deleted since the rows were taken are left out
+        return [dict(metadata[row], distance=distance) for row, distance in hits if row in metadata]
+
+    def get_chunks(self, refs):
+        """Return {(filename, chunk_id): chunk} for the given (filename, chunk_id) pairs."""
+        by_file = {}
+        for filename, chunk_id in refs:
+            by_file.setdefault(filename, []).append(int(chunk_id))
+        chunks = {}
+        for filename, chunk_ids in by_file.items():
+            with self._lock:
+                cursor = self._db.execute(
+                    "SELECT uuid, filename, chunk_id, text_chunk, page FROM chunks "
+                    f"WHERE filename = ? AND chunk_id IN ({','.join('?' * len(chunk_ids))})",
+                    [filename, *chunk_ids],
+                ).fetchall()
+            for uid, name, chunk_id, text, page in cursor:
+                chunks[(name, chunk_id)] = {"uuid": uid, "filename": name, "chunk_id": chunk_id, "text_chunk": text, "page": page}
+        return chunks
+
+    def fetch_chunks(self, filename, after=None, page_size=1000):
+        """Yield the chunks of a document in chunk_id order (those after chunk_id `after`), one page at a time."""
+        last_chunk_id = -1 if after is None else after
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT uuid, filename, chunk_id, text_chunk, page FROM chunks "
+                    "WHERE filename = ? AND chunk_id > ? ORDER BY chunk_id LIMIT ?",
+                    (filename, last_chunk_id, page_size),
+                ).fetchall()
+            for uid, name, chunk_id, text, page in rows:
+                yield {"uuid": uid, "filename": name, "chunk_id": chunk_id, "text_chunk": text, "page": page}
+            if len(rows) < page_size:
+                return
+            last_chunk_id = rows[-1][2]
+
+    async def aclose(self):
+        await self.embedder.aclose()
+
+    def close(self):
+        """Flush vectors and the HNSW graph to disk and close the metadata table."""
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            if self._hnsw is not None:
+                self._hnsw.save_index(self._hnsw_path)
+            self._db.close()
+        self.embedder.close()
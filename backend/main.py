@@ -1,7 +1,45 @@
-from fastapi import FastAPI
+import asyncio
+import contextlib
+import time
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
 from routes import documents, query, system
 from fastapi.middleware.cors import CORSMiddleware
 import database
+import metrics
+from admission import AdmissionMiddleware
+from catalog import catalog
+from jobs import job_manager
+from lifecycle import warm_up
+from partitions import offload_idle_partitions
+from retention import enforce_retention
+from search_index import search_index
+from config import SERVER_TIMING
+
+# Routes that answer while the startup warm-up is still running
+STARTUP_ROUTES = {"/live", "/ready", "/health", "/metrics", "/docs", "/redoc", "/openapi.json"}
+
+# Lifespan: start accepting connections at once and bring the vector store, catalog,
+# keyword index and ingestion workers up in the background (GET /ready reports progress),
+# deactivate idle vector store partitions and apply the retention policy periodically; on shutdown,
+# stop ingestion workers and close the vector store connection
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup = asyncio.create_task(warm_up.run())
+    offloader = asyncio.create_task(offload_idle_partitions())
+    retention = asyncio.create_task(enforce_retention())
+    try:
+        yield
+    finally:
+        for task in (retention, offloader, startup):
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        job_manager.shutdown()
+        catalog.close()
+        search_index.close()
+        await database.aclose_client()
+        database.close_client()
 
 # FastAPI App with metadata for Swagger UI
 app = FastAPI(
@@ -17,6 +55,7 @@ app = FastAPI(
         "name": "Shrey Pant", 
         "email": "pantshrey01@gmail.com",
     },
+    lifespan=lifespan,
 )
 
 # CORS configuration - FIXED SYNTAX
@@ -26,6 +65,21 @@ origins = [
     "https://ringg-rag-six.vercel.app",  # Remove in local development done only for my production deployment between vercel and render
 ]
 
+# Concurrency and byte budgets per route class (inside CORS, so rejections carry CORS headers)
+app.add_middleware(AdmissionMiddleware)
+
+# Until the warm-up finished, answer document and query routes with 503 instead of failing on a half-loaded catalog
+# (added before CORS so it runs inside it and the 503s carry CORS headers)
+@app.middleware("http")
+async def wait_for_startup(request: Request, call_next):
+    if not warm_up.ready and request.url.path not in STARTUP_ROUTES:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"error": "The service is starting, try again shortly"},
+            headers={"Retry-After": "1"},
+        )
+    return await call_next(request)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -34,12 +88,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency, in-flight requests and (optionally) a Server-Timing breakdown of each request's stages
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    timings = metrics.start_request_timings()
+    started = time.perf_counter()
+    status_code = 500
+    metrics.IN_FLIGHT.inc(operation="http_requests")
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.IN_FLIGHT.dec(operation="http_requests")
+        # Label by route template (not the raw path) to keep the label set bounded
+        route = request.scope.get("route")
+        metrics.REQUEST_SECONDS.observe(
+            elapsed, method=request.method, route=route.path if route is not None else "unmatched", status=status_code
+        )
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings, elapsed)
+    return response
+
 # Include routers
 app.include_router(documents.router)
 app.include_router(query.router)
 app.include_router(system.router)
-
-# Shutdown Hook: Close Weaviate connection
-@app.on_event("shutdown")
-def shutdown():
-    database.close_client()
@@ -0,0 +1,226 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram buckets in seconds, from cache hits to multi-minute ingestion stages
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+# Stage timings of the current request, for the Server-Timing header (None outside a timed request)
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Base of the metric types: a named family of values keyed by label values."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing total, e.g. chunks ingested."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. requests in flight."""
+
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the enclosed block as in progress."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (latencies in seconds) over fixed buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            samples = [(key, [list(entry[0]), entry[1], entry[2]]) for key, entry in sorted(self._values.items())]
+        for key, (counts, total, count) in samples:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in _metrics for line in metric.render()) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each stage of an operation (upload, ingest, query, search, watcher).",
+    ("operation", "stage"),
+)
+REQUEST_SECONDS = Histogram(
+    "rag_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status")
+)
+IN_FLIGHT = Gauge("rag_in_flight", "Requests, jobs and uploads currently in progress.", ("operation",))
+CHUNKS = Counter("rag_chunks_total", "Chunks processed, by operation (ingested, embedded, embedding_cached, deleted).", ("operation",))
+INGEST_JOBS = Counter("rag_ingest_jobs_total", "Finished ingestion jobs, by outcome.", ("status",))
+COALESCED = Counter(
+    "rag_coalesced_requests_total",
+    "Requests that ran their own backend call (executed) or joined an identical in-flight one (coalesced).",
+    ("operation", "outcome"),
+)
+ADMISSION = Counter(
+    "rag_admission_total",
+    "Requests per route class (query, upload) that were admitted, rejected over budget or timed out waiting.",
+    ("route_class", "outcome"),
+)
+BYTES = Counter("rag_bytes_total", "Bytes processed, by operation (uploaded, ingested, watcher_uploaded).", ("operation",))
+
+
+def observe_stage(operation, stage, seconds):
+    """Record a stage duration measured elsewhere (e.g. in an ingestion worker process)."""
+    STAGE_SECONDS.observe(seconds, operation=operation, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+class _StageTimer:
+    seconds = None
+
+
+@contextmanager
+def stage(operation, name):
+    """
+    Time the enclosed block as one stage of an operation (and of the current request's Server-Timing).
+
+    Yields a timer whose seconds attribute is set when the block ends.
+    """
+    timer = _StageTimer()
+    started = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.seconds = time.perf_counter() - started
+        observe_stage(operation, name, timer.seconds)
+
+
+def start_request_timings():
+    """Start collecting stage timings for the current request; returns the list they are appended to."""
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def detach_request_timings():
+    """Stop reporting to the request that started this task (for background work outliving it)."""
+    _request_timings.set(None)
+
+
+def server_timing_header(timings, total=None):
+    """Format (stage, seconds) pairs as a Server-Timing header value (durations in milliseconds)."""
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="0.0.0.0"):
+    """Serve /metrics on a background thread, for processes without an API (the watcher)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -1,9 +1,41 @@
 from pydantic import BaseModel, Field
-from typing import List, Union
+from typing import Dict, List, Optional, Union
+from config import QUERY_BATCH_MAX_ITEMS
 
 # Define response models for better Swagger documentation
 class UploadResponse(BaseModel):
     message: str = Field(..., description="Status message for the upload operation")
+    job_id: str = Field(..., description="Identifier of the background ingestion job")
+
+class JobStatusResponse(BaseModel):
+    job_id: str = Field(..., description="Identifier of the ingestion job")
+    filename: str = Field(..., description="Name of the document being ingested")
+    mode: str = Field(..., description="create for a new document, update when replacing a stored one")
+    stage: str = Field(..., description="Current stage: queued, extracting, chunking, storing, streaming, completed or failed")
+    chunk_count: Optional[int] = Field(None, description="Number of chunks produced, once extraction has finished")
+    chunks_added: Optional[int] = Field(None, description="Chunks embedded and written, once the job has completed")
+    chunks_kept: Optional[int] = Field(None, description="Unchanged chunks whose stored embedding was kept (update mode)")
+    chunks_removed: Optional[int] = Field(None, description="Stored chunks deleted because they no longer occur (update mode)")
+    error: Optional[str] = Field(None, description="Error message if the job failed")
+    created_at: float = Field(..., description="Unix timestamp when the job was created")
+    timings: Dict[str, float] = Field(..., description="Seconds spent in each completed stage")
+
+class DocumentInfo(BaseModel):
+    filename: str = Field(..., description="Name of the document")
+    file_type: str = Field(..., description="File type (pdf, docx, json, ndjson, jsonl or txt)")
+    chunk_count: int = Field(..., description="Number of chunks stored for the document")
+    byte_size: Optional[int] = Field(None, description="Size of the uploaded file in bytes, if known")
+    ingested_at: Optional[float] = Field(None, description="Unix timestamp when ingestion completed, if known")
+
+class DocumentListResponse(BaseModel):
+    documents: List[DocumentInfo] = Field(..., description="One page of documents in filename order")
+    total: int = Field(..., description="Total number of documents in the catalog")
+    next_cursor: Optional[str] = Field(None, description="Pass as `after` to fetch the next page; null on the last page")
+
+class DeleteResponse(BaseModel):
+    message: str = Field(..., description="Status message for the delete operation")
+    filename: str = Field(..., description="Name of the deleted document")
+    chunks_deleted: int = Field(..., description="Number of chunks deleted from the vector store")
 
 class ErrorResponse(BaseModel):
     error: str = Field(..., description="Error message describing what went wrong")
@@ -11,6 +43,7 @@ class ErrorResponse(BaseModel):
 class QueryResultItem(BaseModel):
     text: str = Field(..., description="Retrieved text chunk from the document")
     chunk_id: int = Field(..., description="Identifier for the specific chunk within the document")
+    page: Optional[int] = Field(None, description="Page the chunk starts on (PDF documents only)")
     similarity_score: float = Field(..., description="Similarity score between the query and the chunk (0-1 where 1 is most similar)")
     document_name: str = Field(..., description="Name of the document containing this chunk")
     vector_id: str = Field(..., description="Unique identifier for the vector in the database")
@@ -19,8 +52,43 @@ class QueryResponse(BaseModel):
     query: str = Field(..., description="Original query that was submitted")
     results: List[QueryResultItem] = Field(..., description="List of text chunks relevant to the query")
 
+class BatchQueryItem(BaseModel):
+    document_name: str = Field(..., description="Name of the document to query")
+    query: str = Field(..., description="Natural language query to search for in the document")
+    top_k: int = Field(3, description="Number of results to return", ge=1, le=20)
+
+class BatchQueryRequest(BaseModel):
+    items: List[BatchQueryItem] = Field(..., description="Queries to run", min_length=1, max_length=QUERY_BATCH_MAX_ITEMS)
+
+class BatchQueryResultItem(BaseModel):
+    document_name: str = Field(..., description="Document the query was run against")
+    query: str = Field(..., description="Original query that was submitted")
+    results: Optional[List[QueryResultItem]] = Field(None, description="Relevant text chunks, or null if the query failed")
+    error: Optional[str] = Field(None, description="Error message if this query failed")
+    status_code: int = Field(200, description="HTTP status the equivalent /query call would have returned")
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResultItem] = Field(..., description="One entry per submitted query, in request order")
+
+class SearchResultItem(BaseModel):
+    text: str = Field(..., description="Retrieved text chunk")
+    chunk_id: int = Field(..., description="Identifier for the specific chunk within the document")
+    page: Optional[int] = Field(None, description="Page the chunk starts on (PDF documents only)")
+    document_name: str = Field(..., description="Name of the document containing this chunk")
+    vector_id: str = Field(..., description="Unique identifier for the vector in the database")
+    score: float = Field(..., description="Ranking score: BM25 (keyword), similarity (vector) or reciprocal rank fusion (hybrid)")
+    keyword_rank: Optional[int] = Field(None, description="1-based rank in the BM25 ranking, if the chunk was retrieved by keyword")
+    vector_rank: Optional[int] = Field(None, description="1-based rank in the vector ranking, if the chunk was retrieved by similarity")
+
+class SearchResponse(BaseModel):
+    query: str = Field(..., description="Original query that was submitted")
+    mode: str = Field(..., description="Retrieval mode used: hybrid, keyword or vector")
+    results: List[SearchResultItem] = Field(..., description="Best matching chunks across the corpus, best first")
+
 class AggregationResponse(BaseModel):
     document: str = Field(..., description="Name of the JSON document")
     field: str = Field(..., description="Field that was aggregated")
-    operation: str = Field(..., description="Aggregation operation performed (max, min, sum, avg)")
-    result: Union[float, int] = Field(..., description="Result of the aggregation operation")
\ No newline at end of file
+    operation: str = Field(..., description="Aggregation operation performed (max, min, sum, avg, count, median, percentile)")
+    percentile: Optional[float] = Field(None, description="Percentile computed by the percentile operation")
+    group_by: Optional[str] = Field(None, description="Field the results were grouped by, if any")
+    result: Union[int, float, Dict[str, Union[int, float]]] = Field(..., description="Result of the aggregation operation, or a mapping of group to result when grouped")
\ No newline at end of file
@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import threading
+import time
+import database
+from config import PARTITIONING, PARTITION_GROUPS, PARTITION_IDLE_SECONDS, PARTITION_OFFLOAD_INTERVAL
+
+PARTITIONING_MODES = ("none", "document", "group")
+
+
+def partition_of(filename, mode=PARTITIONING, groups=PARTITION_GROUPS):
+    """
+    Name of the partition (Weaviate tenant) holding a document, or None in the flat layout.
+
+    Names are derived from a hash of the filename, so they are stable across
+    processes and restarts and fit Weaviate's tenant name rules.
+    """
+    if mode == "none":
+        return None
+    digest = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+    if mode == "document":
+        return f"d{digest}"
+    return f"g{int(digest[:8], 16) % groups}"
+
+
+class PartitionActivity:
+    """Last time each partition was read or written by this process, for offloading idle ones."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def touch(self, partition):
+        if partition is not None:
+            self._last_used[partition] = time.time()
+
+    def forget(self, partition):
+        with self._lock:
+            self._last_used.pop(partition, None)
+
+    def idle(self, partitions, idle_seconds):
+        """The given partitions not used for idle_seconds; unseen ones count as used at startup."""
+        cutoff = time.time() - idle_seconds
+        with self._lock:
+            return [name for name in partitions if self._last_used.get(name, self.started_at) < cutoff]
+
+
+activity = PartitionActivity()
+
+
+async def offload_idle_partitions(interval=PARTITION_OFFLOAD_INTERVAL, idle_seconds=PARTITION_IDLE_SECONDS):
+    """Background task: every interval, deactivate the store's partitions idle for idle_seconds."""
+    if PARTITIONING == "none" or not idle_seconds:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        if not database.is_connected():
+            continue
+        store = database.get_client()
+        if not getattr(store, "partitioned", False):
+            return
+        try:
+            offloaded = await asyncio.to_thread(store.offload_idle_partitions, idle_seconds)
+        except Exception as e:
+            print(f"Warning: Could not offload idle partitions: {str(e)}")
+        else:
+            if offloaded:
+                print(f"Offloaded {offloaded} idle partition(s)")
@@ -0,0 +1,55 @@
+import asyncio
+import time
+from catalog import catalog
+from jobs import job_manager
+from lifecycle import warm_up
+from config import RETENTION_INTERVAL, RETENTION_MAX_AGE, RETENTION_MAX_CHUNKS
+
+
+def select_evictions(documents, now, max_age=RETENTION_MAX_AGE, max_chunks=RETENTION_MAX_CHUNKS):
+    """
+    Filenames to delete under the retention policy, given catalog entries oldest first.
+
+    A document goes if it was ingested more than max_age seconds ago, or while
+    the documents kept so far would exceed max_chunks chunks in total, oldest
+    first. Documents of unknown age never expire, but are evicted first for size.
+    """
+    total = sum(entry["chunk_count"] for entry in documents)
+    evicted = []
+    for entry in documents:
+        expired = max_age and entry["ingested_at"] is not None and entry["ingested_at"] < now - max_age
+        if expired or (max_chunks and total > max_chunks):
+            evicted.append(entry["filename"])
+            total -= entry["chunk_count"]
+    return evicted
+
+
+async def enforce_retention(interval=RETENTION_INTERVAL, max_age=RETENTION_MAX_AGE, max_chunks=RETENTION_MAX_CHUNKS):
+    """Background task: every interval, delete the documents the retention policy evicts."""
+    if not max_age and not max_chunks:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        if not warm_up.ready:
+            continue
+        evicted = 0
+        for filename in select_evictions(catalog.oldest_first(), time.time(), max_age, max_chunks):
+            # Being re-uploaded (or already being deleted); looked at again next round
+            if job_manager.is_pending(filename):
+                continue
+            try:
+                chunk_count = await job_manager.delete(filename)
+            except Exception as e:
+                print(f"Warning: Could not evict {filename}: {str(e)}")
+            else:
+                evicted += 1
+                print(f"Retention: deleted {filename} ({chunk_count} chunks)")
+        if not evicted:
+            continue
+        # Deleting only marks the chunks unused; the budget is met once their space is given back
+        try:
+            rows, doc_ids = await job_manager.compact()
+        except Exception as e:
+            print(f"Warning: Could not compact after evictions: {str(e)}")
+        else:
+            print(f"Retention: compacted {rows} vector rows and {doc_ids} keyword index entries")
@@ -1,86 +1,368 @@
+import asyncio
+import contextlib
+import itertools
+import json
 import os
-from fastapi import APIRouter, File, UploadFile, status
-from fastapi.responses import JSONResponse
-from weaviate.classes.query import Filter
+from typing import Optional
+from fastapi import APIRouter, File, UploadFile, Path, Query, Request, status
+from fastapi.responses import JSONResponse, StreamingResponse
 import database
-from text_processing import extract_text, chunk_text
-from models import UploadResponse, ErrorResponse
+import metrics
+from bulk_upload import ArchiveError, UploadStreamingResponse, document_name, iter_archive, iter_multipart_files, is_archive, run_io, save_upload
+from config import BULK_MAX_JOBS, INGEST_MAX_PENDING_JOBS
+from catalog import catalog
+from jobs import job_manager
+from text_processing import SUPPORTED_FILE_TYPES
+from models import UploadResponse, ErrorResponse, JobStatusResponse, DocumentListResponse, DeleteResponse
 
 router = APIRouter(tags=["Document Management"])
 
+# Retry-After (seconds) when the ingestion backlog is full
+BACKLOG_RETRY_AFTER = 5
+# Chunks serialized per write of a chunk export stream
+EXPORT_LINES_PER_WRITE = 200
+
 @router.post(
     "/upload", 
     response_model=UploadResponse,
     responses={
-        200: {"description": "Document successfully uploaded and processed"},
+        200: {"description": "Document accepted and queued for processing"},
         400: {"model": ErrorResponse, "description": "Bad request, such as unsupported file format"},
-        500: {"model": ErrorResponse, "description": "Server error during processing"}
+        409: {"model": ErrorResponse, "description": "A document with the same name already exists (without update=true) or is being processed"},
+        429: {"model": ErrorResponse, "description": "Too many uploads in progress; retry after Retry-After seconds"},
+        500: {"model": ErrorResponse, "description": "Server error during processing"},
+        503: {"model": ErrorResponse, "description": "Ingestion backlog full or no upload slot in time; retry after Retry-After seconds"}
     },
     summary="Upload and process a document",
     description="""
-    Upload a document file (PDF, DOCX, JSON, or TXT) to be processed and indexed.
+    Upload a document file (PDF, DOCX, JSON, NDJSON/JSONL, or TXT) to be processed and indexed.
     
-    The system will:
+    The file is saved and queued as a background ingestion job; the response
+    returns immediately with a job id. The job will:
     1. Extract text from the document
     2. Split the text into meaningful chunks
     3. Generate embeddings for each chunk
     4. Store the chunks and embeddings in the vector database
     
-    If a document with the same name already exists, it will be replaced.
+    Track progress with `GET /jobs/{job_id}`.
+    
+    Pass `update=true` to replace a stored document of the same name. Each
+    chunk is hashed and compared with the stored chunks: only new chunks are
+    embedded and written, removed chunks are deleted and unchanged chunks keep
+    their embeddings. The job reports how many chunks were added, kept and removed.
     """
 )
-async def upload_document(file: UploadFile = File(..., description="The document file to upload and process")):
+async def upload_document(
+    file: UploadFile = File(..., description="The document file to upload and process"),
+    update: bool = Query(False, description="Replace an existing document with the same name, re-embedding only changed chunks")
+):
     try:
-        # Check file extension
         file_extension = file.filename.split(".")[-1].lower()
-        if file_extension not in ["pdf", "docx", "json", "txt"]:
-            return JSONResponse(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                content={"error": f"Unsupported file format: {file_extension}. Supported formats are PDF, DOCX, JSON, and TXT"}
-            )
-            
-        file_path = f"temp_{file.filename}"
-        # Get Weaviate client
-        client = database.get_client()
-        collection = client.collections.get("Documents")
+        with metrics.stage("upload", "validate"):
+            rejection = check_upload(file.filename, file_extension, update)
+        if rejection is not None:
+            status_code, error = rejection
+            headers = {"Retry-After": str(BACKLOG_RETRY_AFTER)} if status_code == status.HTTP_503_SERVICE_UNAVAILABLE else None
+            return JSONResponse(status_code=status_code, content={"error": error}, headers=headers)
+
+        # Hold the name until the job is submitted, so a concurrent upload of it is rejected
+        job_manager.reserve(file.filename)
+        try:
+            # Save to a unique temp file in fixed-size blocks; the ingestion job removes it when done
+            with metrics.stage("upload", "save"):
+                file_path = await run_io(save_upload, file.file, file.filename)
+            metrics.BYTES.inc(os.path.getsize(file_path), operation="uploaded")
 
+            # Extract, chunk and store in the background
+            try:
+                job = job_manager.submit(file_path, file.filename, file_extension, update=update and catalog.exists(file.filename))
+            except BaseException:
+                os.remove(file_path)
+                raise
+        finally:
+            job_manager.release(file.filename)
+        return {"message": f"{file.filename} uploaded and queued for processing.", "job_id": job.id}
         
+    except Exception as e:
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={"error": f"Upload failed: {str(e)}"}
+        )
+
+def check_upload(filename, file_extension, update):
+    """Return (status_code, error) if an upload must be rejected, else None."""
+    if document_name(filename) != filename:
+        return status.HTTP_400_BAD_REQUEST, f"Invalid file name: {filename} (absolute and \"..\" paths are not allowed)"
+    if file_extension not in SUPPORTED_FILE_TYPES:
+        return (
+            status.HTTP_400_BAD_REQUEST,
+            f"Unsupported file format: {file_extension}. Supported formats are PDF, DOCX, JSON, NDJSON/JSONL, and TXT"
+        )
+    if job_manager.pending_count() >= INGEST_MAX_PENDING_JOBS:
+        return status.HTTP_503_SERVICE_UNAVAILABLE, "Upload failed: the ingestion backlog is full, try again later"
+    try:
+        if job_manager.is_pending(filename):
+            return status.HTTP_409_CONFLICT, "Upload failed: file is already being processed"
+        if catalog.exists(filename) and not update:
+            return status.HTTP_409_CONFLICT, "Upload failed: file name already exists (use update=true to replace it)"
+    except Exception as e:
+        print(f"Warning: Could not check for existing files: {str(e)}")
+    return None
+
+@router.post(
+    "/upload/bulk",
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "NDJSON stream with one line per file event"
+        },
+        400: {"model": ErrorResponse, "description": "The request is not multipart/form-data"}
+    },
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}}
+                    }
+                }
+            }
+        }
+    },
+    summary="Upload several documents or an archive",
+    description="""
+    Upload any number of document files, and/or zip or tar archives
+    (`.zip`, `.tar`, `.tar.gz`/`.tgz`, `.tar.bz2`, `.tar.xz`) of documents, in one
+    multipart request.
+    
+    The body is parsed as it arrives: each file is written to its own temp
+    file in fixed-size blocks and archives are extracted one member at a time,
+    so neither the request nor an archive is ever held in memory. Documents
+    are queued for ingestion as soon as they are received, with at most
+    `BULK_MAX_JOBS` of them ingesting at once.
+    
+    The response is a stream of JSON lines, written while processing continues:
+    
+    - `{"filename", "status": "queued", "job_id"}` when a document is queued,
+    - `{"filename", "status": "completed" | "failed", "job_id", "chunk_count", "error"}` when its job ends,
+    - `{"filename", "status": "rejected", "status_code", "error"}` for unsupported or duplicate files,
+      and for archives that are corrupt or over `ARCHIVE_MAX_MEMBERS` files / `ARCHIVE_MAX_BYTES`
+      extracted (members queued before the problem was found keep going),
+    - `{"status": "error", "error"}` if the upload itself could not be read.
+    
+    `update=true` replaces existing documents as in `/upload`. Jobs that were
+    queued keep running if the client disconnects; follow them with `GET /jobs/{job_id}`.
+    """
+)
+async def upload_bulk(
+    request: Request,
+    update: bool = Query(False, description="Replace existing documents with the same names, re-embedding only changed chunks")
+):
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"error": "Bulk upload expects a multipart/form-data request"}
+        )
+    return UploadStreamingResponse(_bulk_events(request, update), media_type="application/x-ndjson")
+
+async def _bulk_events(request, update):
+    """Ingest every document of a bulk upload, yielding one NDJSON line per event."""
+    events = asyncio.Queue()
+    slots = asyncio.Semaphore(BULK_MAX_JOBS)
+    running = []
+
+    async def report(job):
+        try:
+            await job.finished.wait()
+        finally:
+            slots.release()
+        await events.put({
+            "filename": job.filename, "status": job.stage, "job_id": job.id,
+            "chunk_count": job.chunk_count, "error": job.error
+        })
+
+    async def ingest(filename, file_path):
+        metrics.BYTES.inc(os.path.getsize(file_path), operation="uploaded")
+        file_extension = filename.split(".")[-1].lower()
+        rejection = check_upload(filename, file_extension, update)
+        if rejection is not None:
+            os.remove(file_path)
+            status_code, error = rejection
+            await events.put({"filename": filename, "status": "rejected", "status_code": status_code, "error": error})
+            return
+        # Hold the name while waiting for a free slot, which also stops reading the upload until one is free
+        job_manager.reserve(filename)
         try:
-            existing_objects = collection.query.fetch_objects(
-                filters=Filter.by_property("filename").equal(file.filename),
-                limit=1
-            )
-            
-            if existing_objects.objects:
-                return JSONResponse(
-                    status_code=status.HTTP_409_CONFLICT,
-                    content={"error": "Upload failed: file name already exists"}
-                )
+            await slots.acquire()
+            try:
+                job = job_manager.submit(file_path, filename, file_extension, update=update and catalog.exists(filename))
+            except BaseException:
+                slots.release()
+                os.remove(file_path)
+                raise
+        finally:
+            job_manager.release(filename)
+        await events.put({"filename": filename, "status": "queued", "job_id": job.id})
+        running.append(asyncio.create_task(report(job)))
+
+    async def produce():
+        try:
+            async for filename, file_path in iter_multipart_files(request):
+                if not is_archive(filename):
+                    await ingest(filename, file_path)
+                    continue
+                members = iter_archive(file_path)
+                try:
+                    while (member := await run_io(next, members, None)) is not None:
+                        await ingest(*member)
+                except ArchiveError as e:
+                    # Only this archive is skipped (after the members already queued); the upload goes on
+                    await events.put({"filename": filename, "status": "rejected", "status_code": e.status_code, "error": str(e)})
+                finally:
+                    with contextlib.suppress(ValueError):  # still extracting in its thread if we were cancelled
+                        members.close()
+                    os.remove(file_path)
         except Exception as e:
-            print(f"Warning: Could not check for existing files: {str(e)}")
-        # Save file temporarily
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
+            await events.put({"status": "error", "error": f"Bulk upload failed: {str(e)}"})
+        finally:
+            await asyncio.gather(*running, return_exceptions=True)
+            await events.put(None)
 
-        # Extract text
-        file_type = file.filename.split(".")[-1].lower()
-        text = extract_text(file_path, file_type)
-        chunks = chunk_text(text, file_type)
+    producer = asyncio.create_task(produce())
+    try:
+        while (event := await events.get()) is not None:
+            yield json.dumps(event) + "\n"
+    finally:
+        # Client went away: stop reading the upload; queued jobs keep running
+        producer.cancel()
 
+@router.get(
+    "/jobs/{job_id}",
+    response_model=JobStatusResponse,
+    responses={
+        200: {"description": "Current state of the ingestion job"},
+        404: {"model": ErrorResponse, "description": "Job not found"}
+    },
+    summary="Get the status of an ingestion job",
+    description="""
+    Report the progress of a document ingestion job started by `/upload`.
+    
+    Stages are `queued`, `extracting`, `chunking` (PDF only), `storing` (or
+    `streaming` for JSON files, which are parsed and stored batch by batch),
+    then `completed` or `failed`.
+    Timings are reported per stage in seconds.
+    """
+)
+async def get_job(job_id: str = Path(..., description="Job id returned by /upload")):
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"error": f"Job '{job_id}' not found"}
+        )
+    return job.to_dict()
 
+@router.get(
+    "/documents",
+    response_model=DocumentListResponse,
+    responses={
+        200: {"description": "One page of ingested documents"}
+    },
+    summary="List ingested documents",
+    description="""
+    List the documents in the catalog, in filename order.
+    
+    The listing is served from the in-memory document catalog and never
+    queries the vector store. Pass `next_cursor` from a response as `after`
+    to fetch the following page.
+    """
+)
+async def list_documents(
+    after: Optional[str] = Query(None, description="Return documents after this filename (the previous page's next_cursor)"),
+    limit: int = Query(100, description="Maximum number of documents to return", ge=1, le=1000),
+    file_type: Optional[str] = Query(None, description="Only list documents of this type, e.g. pdf or json")
+):
+    documents, next_cursor = catalog.list(after=after, limit=limit, file_type=file_type.lower() if file_type else None)
+    return {"documents": documents, "total": len(catalog), "next_cursor": next_cursor}
 
-        # Store new embeddings
-        with collection.batch.dynamic() as batch:
-            for i, chunk in enumerate(chunks):
-                batch.add_object(
-                    properties={"filename": file.filename, "text_chunk": chunk, "chunk_id": i}
-                )
+@router.get(
+    "/documents/{filename:path}/chunks",
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "NDJSON stream with one line per chunk, in chunk_id order"
+        },
+        404: {"model": ErrorResponse, "description": "Document not found"}
+    },
+    summary="Export the chunks of a document",
+    description="""
+    Stream the stored chunks of a document as JSON lines
+    (`{"uuid", "filename", "chunk_id", "text_chunk", "page"}`), in `chunk_id` order.
+    
+    Chunks are read from the vector store one page at a time while the
+    response is written, so memory stays constant however large the document.
+    To resume an interrupted export, or to read the next page after one with
+    `limit` lines, pass the last `chunk_id` received as `after`.
+    """
+)
+async def export_chunks(
+    filename: str = Path(..., description="Name of the document"),
+    after: Optional[int] = Query(None, description="Return chunks after this chunk_id (the last one received)", ge=0),
+    limit: Optional[int] = Query(None, description="Maximum number of chunks to return (default: all)", ge=1)
+):
+    if not catalog.exists(filename):
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"error": f"Document '{filename}' not found"}
+        )
+    store = database.get_client()
+    page_size = min(limit, 1000) if limit is not None else 1000
+    chunks = itertools.islice(store.fetch_chunks(filename, after=after, page_size=page_size), limit)
+    return StreamingResponse(_chunk_lines(chunks), media_type="application/x-ndjson")
 
-        os.remove(file_path)
-        return {"message": f"{file.filename} uploaded and processed successfully. {len(chunks)} chunks were created and indexed."}
-        
+def _chunk_lines(chunks):
+    """Serialize chunks as NDJSON, several lines per write (iterated on a worker thread)."""
+    while batch := list(itertools.islice(chunks, EXPORT_LINES_PER_WRITE)):
+        yield "".join(json.dumps(chunk) + "\n" for chunk in batch)
+
+@router.delete(
+    "/documents/{filename:path}",
+    response_model=DeleteResponse,
+    responses={
+        200: {"description": "Document deleted"},
+        404: {"model": ErrorResponse, "description": "Document not found"},
+        409: {"model": ErrorResponse, "description": "The document is being processed or deleted"},
+        500: {"model": ErrorResponse, "description": "Server error during deletion"}
+    },
+    summary="Delete a document",
+    description="""
+    Delete a document and all of its chunks.
+    
+    The chunks are deleted by the vector store server in batches (with
+    `PARTITIONING=document`, the document's partition is dropped), and the
+    document is removed from the keyword index, the catalog, the `/json-query`
+    aggregates and the query cache. Uploads of the same name are rejected
+    until the deletion finished.
+    """
+)
+async def delete_document(filename: str = Path(..., description="Name of the document to delete")):
+    if not catalog.exists(filename):
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"error": f"Document '{filename}' not found"}
+        )
+    if job_manager.is_pending(filename):
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"error": "Delete failed: the document is being processed or deleted"}
+        )
+    try:
+        chunks_deleted = await job_manager.delete(filename)
     except Exception as e:
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            content={"error": f"Upload failed: {str(e)}"}
-        )
\ No newline at end of file
+            content={"error": f"Delete failed: {str(e)}"}
+        )
+    return {"message": f"{filename} deleted.", "filename": filename, "chunks_deleted": chunks_deleted}
@@ -1,12 +1,41 @@
+import asyncio
 import json
+from typing import Optional
 from fastapi import APIRouter, Query, status
 from fastapi.responses import JSONResponse
-from weaviate.classes.query import MetadataQuery, Filter
 import database
-from models import QueryResponse, ErrorResponse, AggregationResponse
+import metrics
+from cache import json_query_flights, query_cache, query_flights
+from catalog import catalog
+from search_index import search_index
+from aggregates import OPERATIONS, FieldNotFoundError, NonNumericFieldError, get_aggregates
+from text_processing import JSON_FILE_TYPES
+from config import QUERY_BATCH_CONCURRENCY
+from models import (
+    QueryResponse, ErrorResponse, AggregationResponse, BatchQueryRequest, BatchQueryResponse, SearchResponse,
+)
 
 router = APIRouter()
 
+SEARCH_MODES = ["hybrid", "keyword", "vector"]
+# Reciprocal rank fusion constant and the depth of each ranking that is fused
+RRF_K = 60
+MIN_FUSION_CANDIDATES = 50
+
+def format_results(document_name, hits):
+    """Convert store hits into /query result items."""
+    return [
+        {
+            "text": hit["text_chunk"],
+            "chunk_id": hit["chunk_id"],
+            "page": hit["page"],
+            "similarity_score": 1 - hit["distance"],  # Convert distance to similarity
+            "document_name": document_name,
+            "vector_id": hit["uuid"]
+        }
+        for hit in hits
+    ]
+
 @router.get(
     "/query", 
     response_model=QueryResponse,
@@ -25,7 +54,9 @@ router = APIRouter()
     2. Find the most semantically similar chunks in the specified document
     3. Return the text chunks along with relevance scores and metadata
     
-    Results are ordered by similarity to your query.
+    Results are ordered by similarity to your query. Query embeddings and
+    results are cached; cached results for a document are dropped when it changes.
+    Concurrent identical queries share one embedding and search.
     """
 )
 async def query_document(
@@ -34,39 +65,37 @@ async def query_document(
     top_k: int = Query(3, description="Number of results to return", ge=1, le=20)
 ):
     try:
-        client = database.get_client()
-        collection = client.collections.get("Documents")
+        # Repeated questions are answered from the result cache
+        with metrics.stage("query", "cache"):
+            cached = query_cache.get_results(document_name, query, top_k)
+        if cached is not None:
+            return {"query": query, "results": cached}
+        generation = query_cache.generation(document_name)
+
+        store = database.get_client()
         
         # Check if document exists
-        doc_check = collection.query.fetch_objects(
-            filters=Filter.by_property("filename").equal(document_name),
-            limit=1
-        )
-        
-        if len(doc_check.objects) == 0:
+        with metrics.stage("query", "exists"):
+            exists = catalog.exists(document_name)
+        if not exists:
             return JSONResponse(
                 status_code=status.HTTP_404_NOT_FOUND, 
                 content={"error": f"Document '{document_name}' not found"}
             )
         
-        response = collection.query.near_text(
-            query=query,
-            filters=Filter.by_property("filename").equal(document_name),
-            limit=top_k,
-            return_metadata=MetadataQuery(distance=True)
-        )
-        
-        # Enhanced metadata in results
-        results = [
-            {
-                "text": obj.properties["text_chunk"],
-                "chunk_id": obj.properties["chunk_id"],
-                "similarity_score": 1 - obj.metadata.distance,  # Convert distance to similarity
-                "document_name": document_name,
-                "vector_id": str(obj.uuid)  # Convert UUID to string
-            }
-            for obj in response.objects
-        ]
+        async def search():
+            with metrics.stage("query", "embedding"):
+                vector = await query_cache.get_embedding_async(query, store.embed_query_async)
+            with metrics.stage("query", "search"):
+                hits = await store.search_async(document_name, query, top_k, vector=vector)
+
+            # Enhanced metadata in results
+            results = format_results(document_name, hits)
+            query_cache.put_results(document_name, query, top_k, results, generation)
+            return results
+
+        # Identical questions asked at the same time share one embedding and search
+        results = await query_flights.do((document_name, query_cache.normalize(query), top_k, generation), search)
         
         return {"query": query, "results": results}
         
@@ -76,6 +105,180 @@ async def query_document(
             content={"error": f"Query failed: {str(e)}"}
         )
 
+@router.post(
+    "/query/batch",
+    response_model=BatchQueryResponse,
+    tags=["Document Retrieval"],
+    responses={
+        200: {"description": "Batch executed; each item carries its own results or error"},
+        422: {"description": "Malformed request or too many items"}
+    },
+    summary="Run several semantic searches in one request",
+    description="""
+    Run a list of `/query` searches (document_name, query, top_k) in one request.
+    
+    All query texts that are not already cached are embedded with a single
+    provider call, then the searches run concurrently (at most
+    `QUERY_BATCH_CONCURRENCY` at a time). Results are returned in request
+    order. A failing item reports its own `error` and `status_code` instead of
+    failing the whole batch.
+    """
+)
+async def query_batch(request: BatchQueryRequest):
+    items = request.items
+    outcomes = [None] * len(items)
+    store = database.get_client()
+
+    pending = []
+    with metrics.stage("query_batch", "cache"):
+        for i, item in enumerate(items):
+            cached = query_cache.get_results(item.document_name, item.query, item.top_k)
+            if cached is not None:
+                outcomes[i] = {"results": cached}
+            elif not catalog.exists(item.document_name):
+                outcomes[i] = {"error": f"Document '{item.document_name}' not found", "status_code": status.HTTP_404_NOT_FOUND}
+            else:
+                pending.append(i)
+
+    if pending:
+        generations = {i: query_cache.generation(items[i].document_name) for i in pending}
+        try:
+            with metrics.stage("query_batch", "embedding"):
+                vectors = await query_cache.get_embeddings_async(
+                    [items[i].query for i in pending], store.embed_queries_async
+                )
+        except Exception as e:
+            vectors = None
+            for i in pending:
+                outcomes[i] = {"error": f"Query failed: {str(e)}", "status_code": status.HTTP_500_INTERNAL_SERVER_ERROR}
+
+        if vectors is not None:
+            semaphore = asyncio.Semaphore(QUERY_BATCH_CONCURRENCY)
+
+            async def search(i, vector):
+                item = items[i]
+                async with semaphore:
+                    try:
+                        hits = await store.search_async(item.document_name, item.query, item.top_k, vector)
+                    except Exception as e:
+                        outcomes[i] = {"error": f"Query failed: {str(e)}", "status_code": status.HTTP_500_INTERNAL_SERVER_ERROR}
+                        return
+                results = format_results(item.document_name, hits)
+                query_cache.put_results(item.document_name, item.query, item.top_k, results, generations[i])
+                outcomes[i] = {"results": results}
+
+            with metrics.stage("query_batch", "search"):
+                await asyncio.gather(*(search(i, vector) for i, vector in zip(pending, vectors)))
+
+    return {
+        "results": [
+            {"document_name": item.document_name, "query": item.query, **outcome}
+            for item, outcome in zip(items, outcomes)
+        ]
+    }
+
+@router.get(
+    "/search",
+    response_model=SearchResponse,
+    tags=["Document Retrieval"],
+    responses={
+        200: {"description": "Search successfully executed"},
+        400: {"model": ErrorResponse, "description": "Invalid search mode"},
+        404: {"model": ErrorResponse, "description": "Document not found"},
+        500: {"model": ErrorResponse, "description": "Server error during search"}
+    },
+    summary="Search the whole corpus with keyword, vector or hybrid retrieval",
+    description="""
+    Find the best matching chunks across every document, or within one document when `document_name` is given.
+    
+    Modes:
+    - keyword: BM25 ranking from the local inverted index; matches exact terms and identifiers (e.g. part numbers)
+    - vector: semantic similarity ranking from the vector store
+    - hybrid: both rankings fused with reciprocal rank fusion (default)
+    
+    Keyword search never calls the embedding provider.
+    """
+)
+async def search_corpus(
+    query: str = Query(..., description="Query text"),
+    top_k: int = Query(5, description="Number of results to return", ge=1, le=50),
+    mode: str = Query("hybrid", description="Retrieval mode (hybrid, keyword, vector)"),
+    document_name: Optional[str] = Query(None, description="Only search this document")
+):
+    try:
+        if mode not in SEARCH_MODES:
+            return JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"error": f"Invalid mode. Supported modes are: {', '.join(SEARCH_MODES)}"}
+            )
+        if document_name is not None and not catalog.exists(document_name):
+            return JSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content={"error": f"Document '{document_name}' not found"}
+            )
+
+        store = database.get_client()
+        depth = top_k if mode != "hybrid" else max(top_k * 4, MIN_FUSION_CANDIDATES)
+
+        async def keyword_search():
+            if mode == "vector":
+                return []
+            with metrics.stage("search", "keyword"):
+                return await asyncio.to_thread(search_index.search, query, depth, filename=document_name)
+
+        async def vector_search():
+            if mode == "keyword":
+                return []
+            with metrics.stage("search", "embedding"):
+                vector = await query_cache.get_embedding_async(query, store.embed_query_async)
+            with metrics.stage("search", "vector"):
+                return await store.search_async(document_name, query, depth, vector=vector)
+
+        # Both rankings are retrieved concurrently
+        keyword_hits, vector_hits = await asyncio.gather(keyword_search(), vector_search())
+
+        # Fuse the two rankings on (document, chunk_id)
+        candidates = {}
+        for rank, (filename, chunk_id, score) in enumerate(keyword_hits, 1):
+            candidates[(filename, chunk_id)] = {"keyword_rank": rank, "vector_rank": None, "score": score, "chunk": None}
+        for rank, hit in enumerate(vector_hits, 1):
+            entry = candidates.setdefault(
+                (hit["filename"], hit["chunk_id"]), {"keyword_rank": None, "vector_rank": None, "score": 1 - hit["distance"]}
+            )
+            entry["vector_rank"] = rank
+            entry["chunk"] = hit
+        if mode == "hybrid":
+            for entry in candidates.values():
+                entry["score"] = sum(1 / (RRF_K + rank) for rank in (entry["keyword_rank"], entry["vector_rank"]) if rank)
+        ranked = sorted(candidates.items(), key=lambda item: -item[1]["score"])[:top_k]
+
+        # Keyword-only hits carry no text yet; load them from the store in one call
+        missing = [key for key, entry in ranked if entry["chunk"] is None]
+        with metrics.stage("search", "fetch"):
+            chunks = await store.get_chunks_async(missing) if missing else {}
+        results = []
+        for key, entry in ranked:
+            chunk = entry["chunk"] or chunks.get(key)
+            if chunk is None:
+                continue
+            results.append({
+                "text": chunk["text_chunk"],
+                "chunk_id": chunk["chunk_id"],
+                "page": chunk["page"],
+                "document_name": chunk["filename"],
+                "vector_id": chunk["uuid"],
+                "score": entry["score"],
+                "keyword_rank": entry["keyword_rank"],
+                "vector_rank": entry["vector_rank"]
+            })
+        return {"query": query, "mode": mode, "results": results}
+
+    except Exception as e:
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={"error": f"Search failed: {str(e)}"}
+        )
+
 @router.get(
     "/json-query", 
     response_model=AggregationResponse,
@@ -95,6 +298,15 @@ async def query_document(
     - min: Find the minimum value of the specified field
     - sum: Calculate the sum of all values for the specified field
     - avg: Calculate the average (mean) of all values for the specified field
+    - count: Count the records that have a numeric value for the field
+    - median: Find the median value of the specified field
+    - percentile: Find the given percentile (0-100) of the specified field
+    
+    Pass `group_by` with a string field (e.g. `region`) to get one result per distinct value.
+    
+    Numeric fields are stored as columns when the document is ingested, so
+    aggregations do not re-read the document's chunks. Concurrent identical
+    aggregations are computed once.
     
     This endpoint is useful for quick data analysis.
     """
@@ -102,71 +314,70 @@ async def query_document(
 async def json_query(
     document_name: str = Query(..., description="Name of the JSON document to analyze"),
     field: str = Query(..., description="Field name to aggregate "),
-    operation: str = Query(..., description="Aggregation operation (max, min, sum, avg)")
+    operation: str = Query(..., description="Aggregation operation (max, min, sum, avg, count, median, percentile)"),
+    percentile: Optional[float] = Query(None, description="Percentile to compute for the percentile operation", ge=0, le=100),
+    group_by: Optional[str] = Query(None, description="String field to group results by (e.g. region)")
 ):
     try:
-        if operation not in ["max", "min", "sum", "avg"]:
+        if operation not in OPERATIONS:
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                content={"error": "Invalid operation. Supported operations are: max, min, sum, avg"}
+                content={"error": f"Invalid operation. Supported operations are: {', '.join(OPERATIONS)}"}
+            )
+        if operation == "percentile" and percentile is None:
+            return JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"error": "The percentile operation requires a 'percentile' parameter between 0 and 100"}
             )
             
-        client = database.get_client()
-        collection = client.collections.get("Documents")
+        store = database.get_client()
 
         # Check if document exists and is JSON
-        doc_check = collection.query.fetch_objects(
-            filters=Filter.by_property("filename").equal(document_name),
-            limit=1
-        )
-        
-        if len(doc_check.objects) == 0:
+        if not catalog.exists(document_name):
             return JSONResponse(
                 status_code=status.HTTP_404_NOT_FOUND, 
                 content={"error": f"Document '{document_name}' not found"}
             )
             
-        if not document_name.lower().endswith('.json'):
+        if document_name.split(".")[-1].lower() not in JSON_FILE_TYPES:
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 content={"error": "This operation is only supported for JSON documents"}
             )
 
-        # Fetch all objects (chunks) belonging to the given document
-        response = collection.query.fetch_objects(
-            filters=Filter.by_property("filename").equal(document_name)
-        )
-
-        # Merge JSON chunks into a single list
-        json_chunks = [json.loads(obj.properties["text_chunk"]) for obj in response.objects]
-
-        # Extract values for the given field
-        values = [entry[field] for entry in json_chunks if field in entry]
+        def aggregate():
+            # Columnar sidecar built at ingestion (or once from stored chunks for older documents)
+            columns = get_aggregates(document_name, store)
+            return columns.aggregate(field, operation, percentile=percentile, group_by=group_by)
 
-        if not values:
+        # Identical aggregations requested at the same time are computed once
+        key = (document_name, field, operation, percentile, group_by, query_cache.generation(document_name))
+        try:
+            result = await json_query_flights.do(key, lambda: asyncio.to_thread(aggregate))
+        except FieldNotFoundError as e:
+            missing = e.args[0]
+            if missing == group_by:
+                error = f"Field '{group_by}' is not a groupable string field in document '{document_name}'"
+            else:
+                error = f"Field '{field}' not found in document '{document_name}'"
             return JSONResponse(
                 status_code=status.HTTP_404_NOT_FOUND,
-                content={"error": f"Field '{field}' not found in document '{document_name}'"}
+                content={"error": error}
             )
-            
-        # Check if values are numeric
-        if not all(isinstance(val, (int, float)) for val in values):
+        except NonNumericFieldError:
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 content={"error": f"Field '{field}' contains non-numeric values. Aggregation requires numeric data."}
             )
 
-        # Perform requested aggregation
-        if operation == "max":
-            result = max(values)
-        elif operation == "min":
-            result = min(values)
-        elif operation == "sum":
-            result = sum(values)
-        elif operation == "avg":
-            result = sum(values) / len(values)
-
-        return {"document": document_name, "field": field, "operation": operation, "result": result}
+        return {
+            "document": document_name,
+            "field": field,
+            "operation": operation,
+            "percentile": percentile if operation == "percentile" else None,
+            "group_by": group_by,
+            "result": result
+        }
         
     except json.JSONDecodeError:
         return JSONResponse(
@@ -177,4 +388,4 @@ async def json_query(
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content={"error": f"Operation failed: {str(e)}"}
-        )
\ No newline at end of file
+        )
@@ -1,22 +1,110 @@
+import asyncio
 from fastapi import APIRouter, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import database
+import metrics
+from admission import gates
+from jobs import job_manager
+from cache import json_query_flights, query_cache, query_flights
+from lifecycle import warm_up
 
 router = APIRouter(tags=["System"])
 
+@router.get(
+    "/live",
+    summary="Liveness probe",
+    description="""
+    Answers as soon as the server accepts connections, without touching the
+    vector store. Use it as the liveness probe; a failing `/ready` must not
+    get the process restarted.
+    """
+)
+async def liveness():
+    return {"status": "alive"}
+
+@router.get(
+    "/ready",
+    summary="Readiness probe",
+    description="""
+    Returns 200 once the startup warm-up connected to the vector store and
+    loaded the document catalog and keyword index, and 503 until then. The
+    body lists each startup component (`vector_store`, `catalog`,
+    `search_index`, `ingest_workers`) with its status, duration and error.
+    Ingestion workers warm up in the background and do not affect readiness.
+    """
+)
+async def readiness():
+    report = warm_up.status()
+    if not report["ready"]:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=report)
+    return report
+
 @router.get(
     "/health",
     summary="Check system health",
-    description="Verify if the API and its connections to Weaviate are working properly."
+    description="""
+    Verify that the API can reach the vector store: Weaviate must report
+    ready and have the Documents collection; the local store must answer a
+    lookup. The round trip time is reported as `store_latency_ms`.
+    
+    `queues` reports admission control per route class (`query`, `upload`:
+    requests running and waiting, bytes in flight, admitted, rejected and
+    timed out) and the ingestion backlog (`ingest`: pending jobs by stage).
+    """
 )
 async def health_check():
     try:
-        # Test Weaviate connection
-        client = database.get_client()
-        collection = client.collections.get("Documents")
-        return {"status": "healthy", "weaviate_connection": "ok"}
+        # Test vector store connection with a real round trip
+        store = await asyncio.to_thread(database.get_client)
+        with metrics.stage("health", "store") as timer:
+            if store.backend == "weaviate":
+                ready = await asyncio.to_thread(store.client.is_ready)
+                if not ready or not await asyncio.to_thread(store.client.collections.exists, "Documents"):
+                    raise RuntimeError("Weaviate is not ready or the Documents collection is missing")
+            else:
+                await asyncio.to_thread(store.document_exists, "")
+        latency_ms = round(timer.seconds * 1000, 2)
+        queues = {**{name: gate.stats() for name, gate in gates.items()}, "ingest": job_manager.stats()}
+        if store.backend == "weaviate":
+            return {
+                "status": "healthy", "weaviate_connection": "ok", "partitioning": store.partitioning,
+                "store_latency_ms": latency_ms, "queues": queues,
+            }
+        return {"status": "healthy", "vector_store": store.backend, "store_latency_ms": latency_ms, "queues": queues}
     except Exception as e:
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content={"status": "unhealthy", "error": str(e)}
-        )
\ No newline at end of file
+        )
+
+@router.get(
+    "/cache/stats",
+    summary="Cache statistics",
+    description="""
+    Hit, miss, eviction and size counters for the query embedding and result
+    caches, and for the persistent chunk embedding cache (`chunk_embeddings`):
+    how many chunk texts were served from the cache or the store instead of
+    being embedded, and how many provider calls that saved. `coalescing`
+    counts /query and /json-query requests that ran their own backend call
+    (`executed`) or joined an identical one in flight (`coalesced`);
+    `fan_in` is requests served per backend call.
+    """
+)
+async def cache_stats():
+    return {
+        **query_cache.stats(),
+        "chunk_embeddings": database.get_client().embedder.stats(),
+        "coalescing": {"query": query_flights.stats(), "json_query": json_query_flights.stats()},
+    }
+
+@router.get(
+    "/metrics",
+    summary="Prometheus metrics",
+    description="""
+    Request latency by route, per-stage latency histograms (upload, ingest,
+    query, search), chunk and byte counters, ingestion job outcomes and
+    in-flight gauges, in the Prometheus text exposition format.
+    """
+)
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,426 @@
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from collections import Counter
+from itertools import chain
+import numpy as np
+from cache import LRUCache
+from config import SEARCH_INDEX_PATH, SEARCH_POSTINGS_CACHE_BYTES
+
+# Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# A term's postings are written as one block per ingested batch; once a term
+# has MERGE_FANOUT blocks at one level they are merged into a single block at
+# the next level, so lookups read O(log n) blocks and ingestion never rewrites
+# a large posting list for every batch.
+MERGE_FANOUT = 8
+# Posting blocks shorter than this are stored uncompressed (zlib would not pay off)
+COMPRESS_MIN_POSTINGS = 32
+INITIAL_CAPACITY = 1024
+MAX_QUERY_TERMS = 32
+# Removed chunks are tombstoned; once they make up this share of the doc ids
+# (and at least COMPACT_MIN_DELETED of them), the docs array and postings are
+# rewritten without them.
+COMPACT_DELETED_RATIO = 0.25
+COMPACT_MIN_DELETED = 1024
+
+# Words, numbers and identifiers such as "AB-1234", "v2.1.0" or "snake_case"
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+TOKEN_SEPARATORS = re.compile(r"[-./:]")
+
+DOC_DTYPE = np.dtype([("file", "<i4"), ("chunk", "<i4"), ("length", "<u4")])
+
+
+def tokenize(text, split_compounds=True):
+    """
+    Lowercased terms of a text.
+
+    Compound identifiers are kept whole (so "AB-1234" matches exactly) and,
+    with split_compounds, also indexed by their parts. Queries keep compounds
+    whole: an identifier is matched exactly rather than through its parts.
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        if split_compounds and not token.isalnum():
+            terms.extend(part for part in TOKEN_SEPARATORS.split(token) if part)
+    return terms
+
+
+def _pack(delta_bytes, tf_bytes, count):
+    data = delta_bytes + tf_bytes
+    return zlib.compress(data, 1) if count >= COMPRESS_MIN_POSTINGS else data
+
+
+def encode_postings(doc_ids, tfs):
+    """Delta-encode ascending doc ids and pack them with their term frequencies (uint32 + uint16)."""
+    deltas = np.diff(doc_ids, prepend=0).astype("<u4")
+    return _pack(deltas.tobytes(), np.minimum(tfs, 65535).astype("<u2").tobytes(), len(deltas))
+
+
+def encode_batch(postings, first):
+    """
+    Encode the postings of one ingested batch: {term: [(offset, tf), ...]} with
+    offsets relative to doc id first. Returns (term, count, data) rows.
+
+    Deltas for every term are computed in a single vectorised pass; each
+    term's block is then a slice of the shared buffers.
+    """
+    counts = np.fromiter((len(entries) for entries in postings.values()), dtype=np.int64, count=len(postings))
+    pairs = np.fromiter(chain.from_iterable(chain.from_iterable(postings.values())), dtype=np.int64, count=2 * int(counts.sum()))
+    doc_ids = first + pairs[0::2]
+    starts = np.cumsum(counts) - counts
+    deltas = np.diff(doc_ids, prepend=0)
+    deltas[starts] = doc_ids[starts]
+    delta_bytes = deltas.astype("<u4").tobytes()
+    tf_bytes = np.minimum(pairs[1::2], 65535).astype("<u2").tobytes()
+    return [
+        (term, count, _pack(delta_bytes[4 * start:4 * (start + count)], tf_bytes[2 * start:2 * (start + count)], count))
+        for term, start, count in zip(postings, starts.tolist(), counts.tolist())
+    ]
+
+
+def decode_postings(data, count):
+    raw = zlib.decompress(data) if count >= COMPRESS_MIN_POSTINGS else data
+    doc_ids = np.cumsum(np.frombuffer(raw, dtype="<u4", count=count), dtype=np.int64)
+    tfs = np.frombuffer(raw, dtype="<u2", count=count, offset=4 * count)
+    return doc_ids, tfs
+
+
+class SearchIndex:
+    """
+    On-disk BM25 inverted index over every stored chunk.
+
+    Postings live in SQLite as compressed blocks keyed by term; per-chunk
+    metadata (document, chunk_id, length in terms) is a memory-mapped array
+    indexed by the index's own sequential doc id. Chunks are added as they
+    are ingested, so the index is never rebuilt from scratch; removed chunks
+    are tombstoned and reclaimed by compact().
+
+    total_length and live_count cover live chunks only, so removed documents
+    do not skew the BM25 statistics.
+    """
+
+    def __init__(self, path=SEARCH_INDEX_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = None
+        self._docs = None
+        self._capacity = 0
+        self.doc_count = 0
+        self.total_length = 0
+        self._file_ids = {}
+        self._filenames = {}
+        self._block_seq = 0
+        self._deleted = np.zeros(0, dtype=np.int64)
+        self._postings_cache = LRUCache(SEARCH_POSTINGS_CACHE_BYTES)
+
+    def load(self):
+        """Open (or create) the index on disk."""
+        os.makedirs(self.path, exist_ok=True)
+        self._docs_path = os.path.join(self.path, "docs.bin")
+        self._db = sqlite3.connect(os.path.join(self.path, "postings.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, block INTEGER NOT NULL, level INTEGER NOT NULL, "
+            "count INTEGER NOT NULL, data BLOB NOT NULL, PRIMARY KEY (term, block)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS files (file_id INTEGER PRIMARY KEY, filename TEXT UNIQUE NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.commit()
+
+        info = dict(self._db.execute("SELECT key, value FROM info"))
+        self.doc_count = info.get("doc_count", 0)
+        self.total_length = info.get("total_length", 0)
+        self._block_seq = info.get("block_seq", 0)
+        self._file_ids = {filename: file_id for file_id, filename in self._db.execute("SELECT file_id, filename FROM files")}
+        self._filenames = {file_id: filename for filename, file_id in self._file_ids.items()}
+        if os.path.exists(self._docs_path):
+            self._map(os.path.getsize(self._docs_path) // DOC_DTYPE.itemsize)
+            self._deleted = np.flatnonzero(self._docs["file"][:self.doc_count] < 0)
+            # Indexes written before removals were subtracted counted removed chunks too
+            docs = self._docs[:self.doc_count]
+            self.total_length = int(docs["length"][docs["file"] >= 0].sum(dtype=np.int64))
+
+    @property
+    def live_count(self):
+        """Number of indexed chunks that have not been removed."""
+        return self.doc_count - len(self._deleted)
+
+    def _map(self, capacity):
+        self._docs = np.memmap(self._docs_path, dtype=DOC_DTYPE, mode="r+", shape=(capacity,))
+        self._capacity = capacity
+
+    def _ensure_capacity(self, needed):
+        if needed <= self._capacity:
+            return
+        capacity = max(INITIAL_CAPACITY, self._capacity * 2, needed)
+        if self._docs is not None:
+            self._docs.flush()
+            self._docs = None
+        with open(self._docs_path, "ab") as f:
+            f.truncate(capacity * DOC_DTYPE.itemsize)
+        self._map(capacity)
+
+    def has_document(self, filename):
+        return filename in self._file_ids
+
+    def add(self, filename, chunks, start_id=0):
+        """Index chunks of a document, numbered from start_id like the store's chunk_ids."""
+        if not chunks:
+            return
+        postings = {}
+        lengths = []
+        for i, chunk in enumerate(chunks):
+            terms = Counter(tokenize(chunk))
+            lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((i, tf))
+
+        with self._lock:
+            file_id = self._file_ids.get(filename)
+            if file_id is None:
+                file_id = self._db.execute("INSERT INTO files (filename) VALUES (?)", (filename,)).lastrowid
+                self._file_ids[filename] = file_id
+                self._filenames[file_id] = filename
+
+            first = self.doc_count
+            self._ensure_capacity(first + len(chunks))
+            docs = self._docs[first:first + len(chunks)]
+            docs["file"] = file_id
+            docs["chunk"] = np.arange(start_id, start_id + len(chunks))
+            docs["length"] = lengths
+            self._docs.flush()
+
+            self._block_seq += 1
+            self._db.executemany(
+                "INSERT INTO postings (term, block, level, count, data) VALUES (?, ?, 0, ?, ?)",
+                [(term, self._block_seq, count, data) for term, count, data in encode_batch(postings, first)],
+            )
+            self._merge(list(postings))
+
+            self.doc_count += len(chunks)
+            self.total_length += sum(lengths)
+            self._save_info()
+            self._db.commit()
+
+    def _save_info(self):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+            [("doc_count", self.doc_count), ("total_length", self.total_length), ("block_seq", self._block_seq)],
+        )
+
+    def remove_document(self, filename):
+        """
+        Drop a document from search results.
+
+        Its chunks are tombstoned in the doc array and left out of the BM25
+        statistics; their postings are skipped when scoring until enough
+        tombstones accumulate for compact() to reclaim them.
+        """
+        with self._lock:
+            file_id = self._file_ids.pop(filename, None)
+            if file_id is None:
+                return
+            del self._filenames[file_id]
+            files = self._docs["file"]
+            removed = np.flatnonzero(files[:self.doc_count] == file_id)
+            files[removed] = -1
+            self._docs.flush()
+            self._deleted = np.concatenate([self._deleted, removed])
+            self.total_length -= int(self._docs["length"][removed].sum(dtype=np.int64))
+            self._db.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+            self._save_info()
+            self._db.commit()
+            if len(self._deleted) >= max(COMPACT_MIN_DELETED, COMPACT_DELETED_RATIO * self.doc_count):
+                self.compact()
+
+    def compact(self):
+        """
+        Reclaim the doc ids and postings of removed chunks.
+
+        Live chunks are renumbered in order, every term's postings are
+        rewritten as a single block without the removed ones, and the docs
+        file is shrunk to fit. Returns the number of doc ids reclaimed.
+        """
+        with self._lock:
+            if not len(self._deleted):
+                return 0
+            docs = self._docs[:self.doc_count]
+            live = np.flatnonzero(docs["file"] >= 0)
+            new_ids = np.full(self.doc_count, -1, dtype=np.int64)
+            new_ids[live] = np.arange(len(live))
+            kept = docs[live]
+
+            # Compacted blocks take a fresh block number, so cached blocks of the old layout are never served again
+            self._block_seq += 1
+            terms = [term for (term,) in self._db.execute("SELECT DISTINCT term FROM postings").fetchall()]
+            for term in terms:
+                blocks = self._db.execute(
+                    "SELECT level, count, data FROM postings WHERE term = ? ORDER BY block", (term,)
+                ).fetchall()
+                decoded = [decode_postings(data, count) for _, count, data in blocks]
+                doc_ids = new_ids[np.concatenate([ids for ids, _ in decoded])]
+                tfs = np.concatenate([tf for _, tf in decoded])
+                keep = doc_ids >= 0
+                self._db.execute("DELETE FROM postings WHERE term = ?", (term,))
+                if keep.any():
+                    # Blocks are appended in doc id order, so the remapped ids stay ascending
+                    self._db.execute(
+                        "INSERT INTO postings (term, block, level, count, data) VALUES (?, ?, ?, ?, ?)",
+                        (term, self._block_seq, max(level for level, _, _ in blocks), int(keep.sum()),
+                         encode_postings(doc_ids[keep], tfs[keep])),
+                    )
+
+            reclaimed = self.doc_count - len(live)
+            self.doc_count = len(live)
+            self._deleted = np.zeros(0, dtype=np.int64)
+            # Written to a new file and swapped in: searches already running keep reading the old mapping
+            capacity = max(INITIAL_CAPACITY, self.doc_count)
+            compacted = np.zeros(capacity, dtype=DOC_DTYPE)
+            compacted[:self.doc_count] = kept
+            compacted.tofile(self._docs_path + ".tmp")
+            self._save_info()
+            self._db.commit()
+            os.replace(self._docs_path + ".tmp", self._docs_path)
+            self._map(capacity)
+            self._db.execute("VACUUM")
+        return reclaimed
+
+    def _merge(self, terms, level=0):
+        """Merge the blocks of every term that reached MERGE_FANOUT blocks at a level, cascading upwards."""
+        full = []
+        for i in range(0, len(terms), 500):
+            batch = terms[i:i + 500]
+            full.extend(term for (term,) in self._db.execute(
+                f"SELECT term FROM postings WHERE level = ? AND term IN ({','.join('?' * len(batch))}) "
+                "GROUP BY term HAVING COUNT(*) >= ?",
+                [level, *batch, MERGE_FANOUT],
+            ))
+        for term in full:
+            blocks = self._db.execute(
+                "SELECT block, count, data FROM postings WHERE term = ? AND level = ? ORDER BY block", (term, level)
+            ).fetchall()
+            decoded = [decode_postings(data, count) for _, count, data in blocks]
+            doc_ids = np.concatenate([ids for ids, _ in decoded])
+            tfs = np.concatenate([tf for _, tf in decoded])
+            self._db.execute("DELETE FROM postings WHERE term = ? AND level = ?", (term, level))
+            self._db.execute(
+                "INSERT INTO postings (term, block, level, count, data) VALUES (?, ?, ?, ?, ?)",
+                (term, blocks[-1][0], level + 1, len(doc_ids), encode_postings(doc_ids, tfs)),
+            )
+        if full:
+            self._merge(full, level + 1)
+
+    def _postings(self, terms):
+        """Decoded postings of each term as {term: [(doc_ids, tfs), ...]}, served from an LRU of blocks."""
+        with self._lock:
+            placeholders = ",".join("?" * len(terms))
+            # Merging reuses the newest block number at the next level, so blocks are keyed with their level
+            blocks = self._db.execute(
+                f"SELECT term, block, level, count FROM postings WHERE term IN ({placeholders})", terms
+            ).fetchall()
+            decoded = {}
+            for term, block, level, count in blocks:
+                key = (term, block, level)
+                value = self._postings_cache.get(key)
+                if value is None:
+                    (data,) = self._db.execute(
+                        "SELECT data FROM postings WHERE term = ? AND block = ?", (term, block)
+                    ).fetchone()
+                    value = decode_postings(data, count)
+                    self._postings_cache.put(key, value, 6 * count)
+                decoded.setdefault(term, []).append(value)
+        return decoded
+
+    def search(self, query, top_k, filename=None):
+        """
+        Rank chunks by BM25 against the query, best first.
+
+        Returns a list of (filename, chunk_id, score); filename restricts the
+        search to one document.
+        """
+        terms = list(dict.fromkeys(tokenize(query, split_compounds=False)))[:MAX_QUERY_TERMS]
+        if not terms or self._db is None:
+            return []
+        with self._lock:
+            file_id = self._file_ids.get(filename) if filename is not None else None
+            if filename is not None and file_id is None:
+                return []
+            docs, doc_count, live_count, total_length = self._docs, self.doc_count, self.live_count, self.total_length
+            postings = self._postings(terms)
+        if not postings or not live_count:
+            return []
+
+        avgdl = total_length / live_count
+        # Scores are accumulated over the matching doc ids only, not the whole id space
+        matched, contributions = [], []
+        for blocks in postings.values():
+            doc_ids = np.concatenate([ids for ids, _ in blocks])
+            tfs = np.concatenate([tf for _, tf in blocks]).astype(np.float32)
+            in_range = doc_ids < doc_count
+            doc_ids, tfs = doc_ids[in_range], tfs[in_range]
+            files = docs["file"][doc_ids]
+            live = files >= 0
+            doc_ids, tfs, files = doc_ids[live], tfs[live], files[live]
+            df = len(doc_ids)
+            if file_id is not None:
+                keep = files == file_id
+                doc_ids, tfs = doc_ids[keep], tfs[keep]
+            if not len(doc_ids):
+                continue
+            idf = np.log(1 + (live_count - df + 0.5) / (df + 0.5))
+            norms = BM25_K1 * (1 - BM25_B + BM25_B * docs["length"][doc_ids].astype(np.float32) / avgdl)
+            matched.append(doc_ids)
+            contributions.append(idf * tfs * (BM25_K1 + 1) / (tfs + norms))
+        if not matched:
+            return []
+
+        candidates, inverse = np.unique(np.concatenate(matched), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions)).astype(np.float32)
+
+        k = min(top_k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for i in top:
+            doc = candidates[i]
+            filename = self._filenames.get(int(docs["file"][doc]))
+            if scores[i] > 0 and filename is not None:
+                results.append((filename, int(docs["chunk"][doc]), float(scores[i])))
+        return results
+
+    def index_documents(self, store, filenames):
+        """Index documents stored before the search index existed, from their stored chunks."""
+        for filename in filenames:
+            if self.has_document(filename):
+                continue
+            try:
+                batch, start_id = [], 0
+                for chunk in store.fetch_chunks(filename):
+                    # A batch holds consecutive chunk_ids
+                    if batch and (len(batch) == 1000 or chunk["chunk_id"] != start_id + len(batch)):
+                        self.add(filename, batch, start_id)
+                        batch = []
+                    if not batch:
+                        start_id = chunk["chunk_id"]
+                    batch.append(chunk["text_chunk"])
+                self.add(filename, batch, start_id)
+            except Exception as e:
+                print(f"Warning: Could not index {filename} for keyword search: {str(e)}")
+
+    def close(self):
+        with self._lock:
+            if self._docs is not None:
+                self._docs.flush()
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+search_index = SearchIndex()
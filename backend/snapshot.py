@@ -0,0 +1,455 @@
+"""
+Snapshot export and import of the vector store: every chunk with its vector.
+
+Restoring a snapshot rebuilds an environment without re-uploading files or
+calling the embedding provider. A snapshot is a directory:
+
+- manifest.json: format version, embedding model, dimensions, segments,
+  the catalog entry of every document and export/import throughput
+- vectors.f32 (or vectors.i8 plus scales.f32 with --quantize int8): one row
+  per chunk in export order, raw and memory-mappable given the manifest's
+  dim; int8 rows store round(v / scale) with a per-row scale = max|v| / 127
+- segments/NNNNNN.npz: compressed column store of SEGMENT_ROWS chunks each
+  (uuid, dictionary-encoded filename, chunk_id, page, content hash, text)
+- aggregates/: the /json-query sidecars of JSON documents
+
+Export writes one segment at a time and records its progress in the
+manifest, so an interrupted export continues where it stopped. Import
+restores segments on parallel workers and records the finished ones in
+DATA_DIR/snapshot_import.json; chunks keep their uuids, so a segment that
+was half written when the import stopped is simply written again. Stop the
+API before importing: it picks up the catalog on its next start and builds
+the keyword index from the restored chunks in the background.
+
+Usage (from backend/):
+    python snapshot.py export snapshots/today
+    python snapshot.py export snapshots/today-int8 --quantize int8
+    python snapshot.py import snapshots/today --workers 8
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import aggregates
+import database
+from catalog import catalog
+from partitions import partition_of
+from config import DATA_DIR
+
+FORMAT_VERSION = 1
+# Chunks per column segment, the unit of resuming and of parallel import
+SEGMENT_ROWS = 10000
+IMPORT_WORKERS = 4
+VECTOR_FILES = {"none": ("vectors.f32", np.float32), "int8": ("vectors.i8", np.int8)}
+SCALES_FILE = "scales.f32"
+MANIFEST_FILE = "manifest.json"
+IMPORT_PROGRESS_PATH = os.path.join(DATA_DIR, "snapshot_import.json")
+MB = 1024 * 1024
+
+
+class SnapshotError(Exception):
+    """The snapshot is incomplete, from another embedding model, or conflicts with the stored documents."""
+
+
+def quantize_int8(vectors):
+    """Symmetric per-row int8 quantization. Returns (codes, scales)."""
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes, scales):
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def write_segment(path, chunks):
+    """Write chunks as a compressed column segment (written to a temporary file, then moved into place)."""
+    filenames, files = np.unique([chunk["filename"] for chunk in chunks], return_inverse=True)
+    texts = [chunk["text_chunk"].encode("utf-8") for chunk in chunks]
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in texts], out=offsets[1:])
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        uuid=np.frombuffer(b"".join(uuid.UUID(chunk["uuid"]).bytes for chunk in chunks), dtype=np.uint8),
+        filenames=filenames,
+        file_ids=files.astype(np.int32),
+        chunk_id=np.array([chunk["chunk_id"] for chunk in chunks], dtype=np.int64),
+        page=np.array([-1 if chunk["page"] is None else chunk["page"] for chunk in chunks], dtype=np.int32),
+        hash=np.frombuffer(b"".join(bytes.fromhex(chunk["hash"]) for chunk in chunks), dtype=np.uint8),
+        text=np.frombuffer(b"".join(texts), dtype=np.uint8),
+        text_offsets=offsets,
+    )
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def read_segment(path):
+    """Read a column segment back into chunk dicts."""
+    with np.load(path) as columns:
+        uuids = columns["uuid"].tobytes()
+        filenames = columns["filenames"].tolist()
+        files = columns["file_ids"].tolist()
+        chunk_ids = columns["chunk_id"].tolist()
+        pages = columns["page"].tolist()
+        hashes = columns["hash"].tobytes()
+        text = columns["text"].tobytes()
+        offsets = columns["text_offsets"].tolist()
+    return [
+        {
+            "uuid": str(uuid.UUID(bytes=uuids[16 * i:16 * i + 16])),
+            "filename": filenames[files[i]],
+            "chunk_id": chunk_ids[i],
+            "text_chunk": text[offsets[i]:offsets[i + 1]].decode("utf-8"),
+            "page": None if pages[i] < 0 else pages[i],
+            "hash": hashes[32 * i:32 * i + 32].hex(),
+        }
+        for i in range(len(files))
+    ]
+
+
+def segment_filenames(path):
+    """Filename of every chunk in a segment, read without decompressing the text column."""
+    with np.load(path) as columns:
+        filenames = columns["filenames"].tolist()
+        return [filenames[code] for code in columns["file_ids"].tolist()]
+
+
+def _load_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def load_manifest(path):
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise SnapshotError(f"{path} is not a snapshot (no {MANIFEST_FILE})")
+    manifest = _load_json(manifest_path)
+    if manifest.get("version") != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format version {manifest.get('version')}")
+    return manifest
+
+
+def open_vectors(path, manifest):
+    """The snapshot's vectors as float32 rows (dequantized on access for int8), or None if it is empty."""
+    if not manifest["rows"]:
+        return None
+    name, dtype = VECTOR_FILES[manifest["quantization"]]
+    codes = np.memmap(os.path.join(path, name), dtype=dtype, mode="r", shape=(manifest["rows"], manifest["dim"]))
+    if manifest["quantization"] == "none":
+        return codes
+    scales = np.memmap(os.path.join(path, SCALES_FILE), dtype=np.float32, mode="r", shape=(manifest["rows"],))
+    return _Int8Vectors(codes, scales)
+
+
+class _Int8Vectors:
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    def __getitem__(self, rows):
+        return dequantize_int8(self.codes[rows], self.scales[rows])
+
+
+def export_snapshot(store, path, quantization="none", segment_rows=SEGMENT_ROWS, restart=False):
+    """
+    Stream every chunk of the store into a snapshot directory; returns the export figures.
+
+    An unfinished export in path is continued unless restart is set.
+    Chunks ingested while the export runs may or may not be included.
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    manifest = _load_json(manifest_path) if os.path.exists(manifest_path) and not restart else None
+    if manifest is not None and manifest["complete"]:
+        raise SnapshotError(f"{path} already holds a complete snapshot")
+    if manifest is not None and (manifest["quantization"], manifest["segment_rows"]) != (quantization, segment_rows):
+        raise SnapshotError(
+            f"{path} holds an unfinished export with --quantize {manifest['quantization']} and "
+            f"--segment-rows {manifest['segment_rows']}; pass the same options or --restart"
+        )
+    if manifest is None:
+        if os.path.isdir(path) and os.listdir(path) and not os.path.exists(manifest_path):
+            raise SnapshotError(f"{path} is not empty and holds no snapshot; choose another directory")
+        shutil.rmtree(path, ignore_errors=True)
+        manifest = {
+            "version": FORMAT_VERSION,
+            "id": uuid.uuid4().hex,
+            "created_at": time.time(),
+            "backend": store.backend,
+            "model": store.embedder.model,
+            "dim": None,
+            "quantization": quantization,
+            "segment_rows": segment_rows,
+            "rows": 0,
+            "segments": [],
+            "cursor": None,
+            "complete": False,
+            "documents": [],
+            "stats": {},
+        }
+    else:
+        print(f"Resuming export after {manifest['rows']} chunks")
+    os.makedirs(os.path.join(path, "segments"), exist_ok=True)
+
+    vector_name, dtype = VECTOR_FILES[quantization]
+    row_bytes = (manifest["dim"] or 0) * np.dtype(dtype).itemsize
+    vector_file = open(os.path.join(path, vector_name), "ab")
+    scales_file = open(os.path.join(path, SCALES_FILE), "ab") if quantization == "int8" else None
+    # Drop whatever an interrupted run wrote after the last recorded segment
+    vector_file.truncate(manifest["rows"] * row_bytes)
+    if scales_file is not None:
+        scales_file.truncate(manifest["rows"] * 4)
+
+    started = time.perf_counter()
+    exported = 0
+    cosine_sum, cosine_min = 0.0, 1.0
+    try:
+        for chunks, vectors, cursor in store.export_chunks(after=manifest["cursor"], batch_size=segment_rows):
+            index = len(manifest["segments"])
+            file = os.path.join("segments", f"{index:06d}.npz")
+            size = write_segment(os.path.join(path, file), chunks)
+            if quantization == "int8":
+                codes, scales = quantize_int8(vectors)
+                vector_file.write(codes.tobytes())
+                scales_file.write(scales.tobytes())
+                _sync(scales_file)
+                # How closely the quantized vectors keep the originals' directions
+                restored = dequantize_int8(codes, scales)
+                cosines = (vectors * restored).sum(axis=1) / np.maximum(
+                    np.linalg.norm(vectors, axis=1) * np.linalg.norm(restored, axis=1), 1e-12
+                )
+                cosine_sum += float(cosines.sum())
+                cosine_min = min(cosine_min, float(cosines.min()))
+            else:
+                vector_file.write(vectors.astype(np.float32).tobytes())
+            _sync(vector_file)
+
+            manifest["dim"] = int(vectors.shape[1])
+            manifest["segments"].append({"file": file, "rows": len(chunks), "start": manifest["rows"], "bytes": size})
+            manifest["rows"] += len(chunks)
+            manifest["cursor"] = cursor
+            _save_json(manifest_path, manifest)
+            exported += len(chunks)
+            elapsed = time.perf_counter() - started
+            print(f"  segment {index}: {manifest['rows']} chunks, {exported / elapsed:.0f} chunks/s")
+    finally:
+        vector_file.close()
+        if scales_file is not None:
+            scales_file.close()
+
+    manifest["documents"] = _export_documents(path, manifest)
+    seconds = time.perf_counter() - started
+    vector_bytes = sum(
+        os.path.getsize(os.path.join(path, name))
+        for name in (vector_name, SCALES_FILE) if os.path.exists(os.path.join(path, name))
+    )
+    column_bytes = sum(segment["bytes"] for segment in manifest["segments"])
+    stats = {
+        "chunks": manifest["rows"],
+        "chunks_exported": exported,
+        "seconds": round(seconds, 3),
+        "chunks_per_second": round(exported / seconds, 1) if seconds else None,
+        "vector_bytes": vector_bytes,
+        "column_bytes": column_bytes,
+        "bytes_per_chunk": round((vector_bytes + column_bytes) / manifest["rows"], 1) if manifest["rows"] else None,
+    }
+    if quantization == "int8" and exported:
+        stats["int8_mean_cosine"] = round(cosine_sum / exported, 6)
+        stats["int8_min_cosine"] = round(cosine_min, 6)
+    manifest["stats"]["export"] = stats
+    manifest["cursor"] = None
+    manifest["complete"] = True
+    _save_json(manifest_path, manifest)
+    return stats
+
+
+def _export_documents(path, manifest):
+    """Catalog entries of the exported documents, and a copy of the JSON documents' aggregation sidecars."""
+    counts = {}
+    for segment in manifest["segments"]:
+        for filename in segment_filenames(os.path.join(path, segment["file"])):
+            counts[filename] = counts.get(filename, 0) + 1
+    catalog.load()
+    catalog.close()
+    documents = []
+    for filename, chunk_count in sorted(counts.items()):
+        entry = dict(catalog.get(filename) or {
+            "filename": filename,
+            "file_type": filename.split(".")[-1].lower(),
+            "byte_size": None,
+            "ingested_at": None,
+        })
+        entry["chunk_count"] = chunk_count
+        sidecar = aggregates.sidecar_path(filename)
+        if os.path.exists(os.path.join(sidecar, "manifest.json")):
+            target = os.path.join(path, "aggregates", os.path.basename(sidecar))
+            shutil.rmtree(target, ignore_errors=True)
+            shutil.copytree(sidecar, target)
+            entry["aggregates"] = os.path.basename(sidecar)
+        documents.append(entry)
+    return documents
+
+
+def import_snapshot(store, path, workers=IMPORT_WORKERS, restart=False, force=False):
+    """
+    Write a snapshot's chunks and vectors into the store; returns the import figures.
+
+    Segments are decoded and written by parallel workers. An interrupted
+    import of the same snapshot continues with the segments it had not
+    finished, unless restart is set. force allows a snapshot made with a
+    different embedding model (its vectors will not match new queries).
+    """
+    manifest = load_manifest(path)
+    if not manifest["complete"]:
+        raise SnapshotError(f"{path} holds an unfinished export; run the export again to complete it")
+    if manifest["model"] != store.embedder.model and not force:
+        raise SnapshotError(
+            f"The snapshot was embedded with {manifest['model']}, the store embeds with {store.embedder.model}"
+        )
+
+    progress = _load_json(IMPORT_PROGRESS_PATH) if os.path.exists(IMPORT_PROGRESS_PATH) and not restart else None
+    if progress is None or progress["snapshot"] != manifest["id"]:
+        conflicts = sorted(_stored_documents(store, [document["filename"] for document in manifest["documents"]]))
+        if conflicts:
+            raise SnapshotError(
+                f"{len(conflicts)} document(s) of the snapshot are already stored (e.g. {conflicts[0]}); delete them first"
+            )
+        progress = {"snapshot": manifest["id"], "path": os.path.abspath(path), "done": []}
+        os.makedirs(os.path.dirname(IMPORT_PROGRESS_PATH) or ".", exist_ok=True)
+        _save_json(IMPORT_PROGRESS_PATH, progress)
+    else:
+        print(f"Resuming import, {len(progress['done'])} of {len(manifest['segments'])} segments already written")
+
+    vectors = open_vectors(path, manifest)
+    row_bytes = (manifest["dim"] or 0) * np.dtype(VECTOR_FILES[manifest["quantization"]][1]).itemsize
+    if manifest["quantization"] == "int8":
+        row_bytes += 4  # the row's scale
+    done = set(progress["done"])
+    pending = [index for index in range(len(manifest["segments"])) if index not in done]
+
+    def restore(index):
+        segment = manifest["segments"][index]
+        chunks = read_segment(os.path.join(path, segment["file"]))
+        rows = vectors[segment["start"]:segment["start"] + segment["rows"]]
+        return store.import_chunks(chunks, np.asarray(rows, dtype=np.float32))
+
+    started = time.perf_counter()
+    imported = written = read_bytes = 0
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot-import")
+    try:
+        futures = {pool.submit(restore, index): index for index in pending}
+        for future in as_completed(futures):
+            index = futures[future]
+            written += future.result()
+            segment = manifest["segments"][index]
+            imported += segment["rows"]
+            read_bytes += segment["bytes"] + segment["rows"] * row_bytes
+            done.add(index)
+            progress["done"] = sorted(done)
+            _save_json(IMPORT_PROGRESS_PATH, progress)
+            elapsed = time.perf_counter() - started
+            print(f"  {len(done)}/{len(manifest['segments'])} segments, {imported / elapsed:.0f} chunks/s")
+    finally:
+        # On failure, stop after the segments being written; the next run resumes from the recorded ones
+        pool.shutdown(cancel_futures=True)
+
+    _import_documents(path, manifest)
+    seconds = time.perf_counter() - started
+    stats = {
+        "chunks": imported,
+        "chunks_written": written,
+        "seconds": round(seconds, 3),
+        "chunks_per_second": round(imported / seconds, 1) if seconds else None,
+        "mb_per_second": round(read_bytes / MB / seconds, 2) if seconds else None,
+        "workers": workers,
+    }
+    os.remove(IMPORT_PROGRESS_PATH)
+    return stats
+
+
+def _stored_documents(store, filenames):
+    """The given documents the store already holds."""
+    if getattr(store, "partitioned", False):
+        # Only documents in partitions that exist can be stored; listing every partition's documents would not scale
+        partitions = store.list_partitions()
+        return [
+            filename for filename in filenames
+            if partition_of(filename, store.partitioning) in partitions and store.document_exists(filename)
+        ]
+    return set(filenames) & set(store.list_documents())
+
+
+def _import_documents(path, manifest):
+    """Restore the catalog entries and aggregation sidecars of the snapshot's documents."""
+    catalog.load()
+    try:
+        for document in manifest["documents"]:
+            catalog.add(
+                document["filename"], document["file_type"], document["chunk_count"],
+                document["byte_size"], document["ingested_at"],
+            )
+            if document.get("aggregates"):
+                built = f"{aggregates.sidecar_path(document['filename'])}.import"
+                shutil.rmtree(built, ignore_errors=True)
+                shutil.copytree(os.path.join(path, "aggregates", document["aggregates"]), built)
+                aggregates.install_sidecar(document["filename"], built)
+    finally:
+        catalog.close()
+
+
+def _print_stats(title, stats):
+    print(f"{title}:")
+    for name, value in stats.items():
+        print(f"  {name:<20} {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Write the stored chunks and vectors to a snapshot directory")
+    export_parser.add_argument("path", help="Snapshot directory")
+    export_parser.add_argument("--quantize", choices=sorted(VECTOR_FILES), default="none", help="Vector encoding")
+    export_parser.add_argument("--segment-rows", type=int, default=SEGMENT_ROWS, help="Chunks per column segment")
+    export_parser.add_argument("--restart", action="store_true", help="Discard an unfinished export instead of continuing it")
+    import_parser = commands.add_parser("import", help="Restore a snapshot into the configured vector store")
+    import_parser.add_argument("path", help="Snapshot directory")
+    import_parser.add_argument("--workers", type=int, default=IMPORT_WORKERS, help="Segments restored at once")
+    import_parser.add_argument("--restart", action="store_true", help="Ignore the progress of an interrupted import")
+    import_parser.add_argument("--force", action="store_true", help="Import vectors of a different embedding model")
+    args = parser.parse_args()
+
+    store = database.get_client()
+    try:
+        if args.command == "export":
+            stats = export_snapshot(store, args.path, args.quantize, args.segment_rows, args.restart)
+            _print_stats(f"Exported to {args.path}", stats)
+        else:
+            stats = import_snapshot(store, args.path, args.workers, args.restart, args.force)
+            _print_stats(f"Imported {args.path}", stats)
+    except SnapshotError as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+    finally:
+        database.close_client()
+
+
+if __name__ == "__main__":
+    main()
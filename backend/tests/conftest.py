@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The configuration is read at import time: point every data path at a throwaway
+# directory and use the offline backends before any backend module is imported
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ.setdefault("VECTOR_BACKEND", "local")
+os.environ.setdefault("EMBEDDING_PROVIDER", "local")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def embedder():
+    from embeddings import get_embedder
+    return get_embedder("local", cache_path="")
+
+
+@pytest.fixture(scope="session")
+def services():
+    """The configured (local) vector store, with the catalog and keyword index loaded as at startup."""
+    import database
+    from catalog import catalog
+    from search_index import search_index
+    store = database.get_client()
+    catalog.load(store)
+    search_index.load()
+    yield store
+    catalog.close()
+    search_index.close()
+    database.close_client()
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import pytest
+
+from admission import AdmissionGate, DeferBudget, Overloaded, gates, yield_to_queries
+
+
+def test_gate_admits_in_arrival_order_and_rejects_beyond_the_queue():
+    async def run():
+        gate = AdmissionGate("test", max_concurrent=1, max_queued=2, queue_timeout=5)
+        order = []
+        await gate.acquire()
+
+        async def waiter(name):
+            await gate.acquire()
+            order.append(name)
+
+        waiters = [asyncio.ensure_future(waiter(name)) for name in ("first", "second")]
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as rejected:
+            await gate.acquire()
+        assert rejected.value.status_code == 429
+        for _ in waiters:
+            gate.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiters)
+        assert (gate.in_flight, gate.admitted, gate.rejected) == (1, 3, 1)
+        return order
+
+    assert asyncio.run(run()) == ["first", "second"]
+
+
+def test_gate_times_out_queued_requests():
+    async def run():
+        gate = AdmissionGate("test", max_concurrent=1, max_queued=1, queue_timeout=0.05)
+        await gate.acquire()
+        with pytest.raises(Overloaded) as timed_out:
+            await gate.acquire()
+        assert timed_out.value.status_code == 503
+        assert timed_out.value.retry_after >= 1
+        # The timed out request left the queue
+        gate.release()
+        await gate.acquire()
+        return gate.stats()
+
+    stats = asyncio.run(run())
+    assert (stats["in_flight"], stats["queued"], stats["timed_out"]) == (1, 0, 1)
+
+
+def test_gate_byte_budget():
+    async def run():
+        gate = AdmissionGate("test", max_concurrent=4, max_queued=4, max_bytes=100, queue_timeout=5)
+        await gate.acquire(60)
+        pending = asyncio.ensure_future(gate.acquire(60))
+        await asyncio.sleep(0.01)
+        assert not pending.done()
+        gate.release(60)
+        await pending
+        # Alone, a request larger than the whole budget still runs
+        gate.release(60)
+        await asyncio.wait_for(gate.acquire(500), 1)
+        return gate.bytes_in_flight
+
+    assert asyncio.run(run()) == 500
+
+
+def test_defer_budget_caps_the_total_wait_of_a_job():
+    async def run():
+        gate = gates["query"]
+        await gate.acquire()
+        try:
+            budget = DeferBudget(0.2)
+            started = time.perf_counter()
+            for _ in range(10):
+                await yield_to_queries(budget)
+            return time.perf_counter() - started, budget.remaining
+        finally:
+            gate.release()
+
+    waited, remaining = asyncio.run(run())
+    assert 0.2 <= waited < 0.5
+    assert remaining <= 0
+
+
+def test_wait_idle_timing_out_as_the_gate_goes_idle():
+    async def run():
+        gate = AdmissionGate("test", max_concurrent=1, max_queued=1)
+        await gate.acquire()
+        waiting = asyncio.ensure_future(gate.wait_idle(0.05))
+        await asyncio.sleep(0)
+        # The last request finishes right as the wait times out, before the waiter resumes
+        (future,) = gate._idle_waiters
+        future.add_done_callback(lambda _: gate.release())
+        await waiting
+        return gate.in_flight
+
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,23 @@
+import aggregates
+from aggregates import ColumnarAggregates, build_from_records, get_aggregates, install_sidecar, save_sidecar
+
+
+def test_sidecar_replaced_while_loading_is_not_cached(monkeypatch):
+    save_sidecar("racing.json", build_from_records([{"n": 1}]))
+    replacement = build_from_records([{"n": 2}])
+    load = ColumnarAggregates.load
+
+    def load_then_replace(path):
+        # An ingestion job installs the new sidecar while the old one is being opened
+        loaded = load(path)
+        built_path = f"{path}.replacement"
+        replacement.save(built_path)
+        install_sidecar("racing.json", built_path)
+        return loaded
+
+    monkeypatch.setattr(ColumnarAggregates, "load", load_then_replace)
+    assert get_aggregates("racing.json", None).aggregate("n", "max") == 1
+    monkeypatch.setattr(ColumnarAggregates, "load", load)
+    assert get_aggregates("racing.json", None).aggregate("n", "max") == 2
+    assert "racing.json" in aggregates._loaded
+    aggregates.delete_sidecar("racing.json")
@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from cache import ENTRY_OVERHEAD, LRUCache, QueryCache, SingleFlight
+
+
+def test_lru_evicts_least_recently_used_within_the_byte_budget():
+    evicted = []
+    cache = LRUCache(3 * (100 + ENTRY_OVERHEAD), on_evict=evicted.append)
+    for key in "abc":
+        cache.put(key, key.upper(), 100)
+    assert cache.get("a") == "A"
+    cache.put("d", "D", 100)
+    assert evicted == ["b"]
+    assert [cache.get(key) for key in "abcd"] == ["A", None, "C", "D"]
+    # Larger than the whole budget: not cached at all
+    cache.put("huge", "H", 10 * (100 + ENTRY_OVERHEAD))
+    assert cache.get("huge") is None and cache.get("a") == "A"
+    cache.pop("a")
+    assert cache.get("a") is None and evicted == ["b"]
+
+
+def test_lru_entries_expire_after_the_ttl():
+    cache = LRUCache(10000, ttl=0.05)
+    cache.put("a", 1, 10)
+    assert cache.get("a") == 1
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_query_cache_embeds_each_normalized_query_once():
+    cache = QueryCache()
+    calls = []
+
+    def embed_many(queries):
+        calls.append(queries)
+        return [np.full(4, len(query), dtype=np.float32) for query in queries]
+
+    vectors = cache.get_embeddings(["What is X?", "what  is x?", "other"], embed_many)
+    assert calls == [["What is X?", "other"]]
+    assert vectors[0] is vectors[1]
+    cache.get_embeddings(["WHAT IS X?"], embed_many)
+    assert len(calls) == 1
+
+
+def test_query_cache_results_are_dropped_with_their_document():
+    cache = QueryCache()
+    results = [{"text": "chunk"}]
+    generation = cache.generation("a.pdf")
+    cache.put_results("a.pdf", "q", 3, results, generation)
+    cache.put_results("b.pdf", "q", 3, results, cache.generation("b.pdf"))
+    assert cache.get_results("a.pdf", " Q ", 3) == results
+
+    cache.invalidate_document("a.pdf")
+    assert cache.get_results("a.pdf", "q", 3) is None
+    assert cache.get_results("b.pdf", "q", 3) == results
+    # Results of a search that started before the invalidation are not cached
+    cache.put_results("a.pdf", "q", 3, results, generation)
+    assert cache.get_results("a.pdf", "q", 3) is None
+
+
+def test_single_flight_shares_one_call():
+    flights = SingleFlight("test", enabled=True)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", fn) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["result"] * 5
+    assert len(calls) == 1
+    assert (flights.executed, flights.coalesced, flights.stats()["in_flight"]) == (1, 4, 0)
+
+
+def test_single_flight_shares_exceptions():
+    flights = SingleFlight("test", enabled=True)
+
+    async def fn():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", fn) for _ in range(3)), return_exceptions=True)
+
+    outcomes = asyncio.run(run())
+    assert [type(outcome) for outcome in outcomes] == [ValueError] * 3
+    assert flights.executed == 1
+
+
+def test_single_flight_survives_a_cancelled_waiter():
+    flights = SingleFlight("test", enabled=True)
+    started = []
+
+    async def fn():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        first = asyncio.ensure_future(flights.do("key", fn))
+        second = asyncio.ensure_future(flights.do("key", fn))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        result = await second
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return result
+
+    assert asyncio.run(run()) == "result"
+    assert started == [1]
+
+
+def test_single_flight_cancels_the_call_once_every_waiter_left():
+    flights = SingleFlight("test", enabled=True)
+    finished = []
+
+    async def fn():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+
+    async def run():
+        waiters = [asyncio.ensure_future(flights.do("key", fn)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0.1)
+        return flights.stats()["in_flight"]
+
+    assert asyncio.run(run()) == 0
+    assert finished == []
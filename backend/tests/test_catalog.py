@@ -0,0 +1,55 @@
+from catalog import DocumentCatalog
+
+
+class FakeStore:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def list_documents(self):
+        return dict(self.documents)
+
+
+def open_catalog(tmp_path, store=None):
+    catalog = DocumentCatalog(str(tmp_path / "catalog.db"))
+    catalog.load(store)
+    return catalog
+
+
+def test_pages_follow_the_cursor(tmp_path):
+    catalog = open_catalog(tmp_path)
+    for i in range(7):
+        catalog.add(f"doc{i}.{'pdf' if i % 2 else 'json'}", "pdf" if i % 2 else "json", i)
+
+    names, after = [], None
+    while True:
+        page, after = catalog.list(after=after, limit=3)
+        names.extend(entry["filename"] for entry in page)
+        if after is None:
+            break
+    assert names == sorted(catalog.filenames()) and len(names) == 7
+
+    page, after = catalog.list(limit=2, file_type="pdf")
+    assert [entry["filename"] for entry in page] == ["doc1.pdf", "doc3.pdf"]
+    page, after = catalog.list(after=after, limit=2, file_type="pdf")
+    assert [entry["filename"] for entry in page] == ["doc5.pdf"] and after is None
+
+    # A cursor naming a removed document still continues after it
+    catalog.remove("doc3.pdf")
+    page, _ = catalog.list(after="doc3.pdf", limit=10)
+    assert [entry["filename"] for entry in page] == ["doc4.json", "doc5.pdf", "doc6.json"]
+    catalog.close()
+
+
+def test_persisted_and_reconciled_with_the_store(tmp_path):
+    catalog = open_catalog(tmp_path)
+    catalog.add("kept.pdf", "pdf", 3, byte_size=100)
+    catalog.add("gone.pdf", "pdf", 2)
+    catalog.close()
+
+    catalog = open_catalog(tmp_path, FakeStore({"kept.pdf": 4, "found.txt": 1}))
+    assert catalog.filenames() == ["found.txt", "kept.pdf"]
+    assert catalog.get("kept.pdf")["chunk_count"] == 4 and catalog.get("kept.pdf")["byte_size"] == 100
+    assert catalog.get("found.txt")["ingested_at"] is None
+    assert catalog.total_chunks() == 5
+    assert [entry["filename"] for entry in catalog.oldest_first()] == ["found.txt", "kept.pdf"]
+    catalog.close()
@@ -0,0 +1,41 @@
+from incremental import ChunkDiff
+
+
+def stored(*texts):
+    return [
+        {"uuid": f"u{i}", "chunk_id": i, "text_chunk": text, "page": None}
+        for i, text in enumerate(texts)
+    ]
+
+
+def test_unchanged_chunks_are_kept_in_place():
+    diff = ChunkDiff(stored("a", "b", "c"))
+    new, moved = diff.match(["a", "b", "c"])
+    assert (new, moved) == ([], [])
+    assert (diff.added, diff.kept, diff.removed()) == (0, 3, [])
+
+
+def test_inserted_chunk_moves_the_ones_after_it():
+    diff = ChunkDiff(stored("a", "b", "c"))
+    new, moved = diff.match(["a", "x"])
+    new_more, moved_more = diff.match(["b", "c"], start_id=2)
+    assert [(chunk_id, text) for _, chunk_id, text, _ in new + new_more] == [(1, "x")]
+    assert moved == [] and moved_more == [("u1", 2, None), ("u2", 3, None)]
+    assert diff.new_uuids() == [new[0][0]]
+    assert (diff.added, diff.kept, diff.removed()) == (1, 3, [])
+
+
+def test_removed_and_repeated_chunks():
+    diff = ChunkDiff(stored("a", "a", "b", "c"))
+    new, moved = diff.match(["a", "c", "a", "a"])
+    # Repeated text reuses each stored copy once, then counts as new
+    assert moved == [("u3", 1, None), ("u1", 2, None)]
+    assert [(chunk_id, text) for _, chunk_id, text, _ in new] == [(3, "a")]
+    assert diff.removed() == ["u2"]
+
+
+def test_page_changes_count_as_moves():
+    diff = ChunkDiff([{"uuid": "u0", "chunk_id": 0, "text_chunk": "a", "page": 1}])
+    new, moved = diff.match(["a"], pages=[2])
+    assert (new, moved) == ([], [("u0", 0, 2)])
+    assert diff.original() == [("u0", 0, 1)]
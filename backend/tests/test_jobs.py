@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+from catalog import catalog
+from jobs import JobManager
+from search_index import search_index
+
+
+def ingest(tmp_path, filename, content, update=False):
+    """Run one ingestion job to completion on a fresh job manager and return it."""
+    path = tmp_path / filename
+    path.write_text(content)
+
+    async def run():
+        manager = JobManager(max_workers=1)
+        try:
+            job = manager.submit(str(path), filename, filename.split(".")[-1], update=update)
+            await job.finished.wait()
+            return job
+        finally:
+            manager.shutdown()
+
+    return asyncio.run(run())
+
+
+def test_failed_json_stream_leaves_nothing_behind(tmp_path, services):
+    # Two full batches are written before the parser reaches the bad line
+    lines = [json.dumps({"id": i, "amount": i * 2}) for i in range(1200)] + ["{not json"]
+    job = ingest(tmp_path, "broken.ndjson", "\n".join(lines))
+
+    assert job.stage == "failed"
+    assert job.error
+    assert not services.document_exists("broken.ndjson")
+    assert not search_index.has_document("broken.ndjson")
+    assert not catalog.exists("broken.ndjson")
+
+
+def test_json_stream_is_ingested(tmp_path, services):
+    lines = [json.dumps({"id": i, "amount": i * 2}) for i in range(1200)]
+    job = ingest(tmp_path, "good.ndjson", "\n".join(lines))
+
+    assert job.stage == "completed"
+    assert job.chunk_count == 1200
+    assert services.list_documents()["good.ndjson"] == 1200
+    assert catalog.get("good.ndjson")["chunk_count"] == 1200
+    assert [chunk["chunk_id"] for chunk in services.fetch_chunks("good.ndjson")] == list(range(1200))
+
+
+def stored_texts(store, filename):
+    return [(chunk["chunk_id"], chunk["text_chunk"]) for chunk in store.fetch_chunks(filename)]
+
+
+def test_failed_update_restores_the_stored_version(tmp_path, services):
+    original = [json.dumps({"id": i, "amount": i}) for i in range(1200)]
+    assert ingest(tmp_path, "ledger.ndjson", "\n".join(original)).stage == "completed"
+    before = stored_texts(services, "ledger.ndjson")
+
+    # Kept records move, new ones are written, then the stream breaks
+    changed = [json.dumps({"id": i, "amount": -i}) for i in range(300)] + original[::-1] + ["{not json"]
+    job = ingest(tmp_path, "ledger.ndjson", "\n".join(changed), update=True)
+
+    assert job.stage == "failed"
+    assert stored_texts(services, "ledger.ndjson") == before
+    assert catalog.get("ledger.ndjson")["chunk_count"] == 1200
+    # The keyword index holds the stored version again, once
+    hits = search_index.search("1199", 10, filename="ledger.ndjson")
+    assert [chunk_id for _, chunk_id, _ in hits] == [1199]
+
+
+def test_update_keeps_unchanged_chunks(tmp_path, services):
+    original = [json.dumps({"id": i}) for i in range(10)]
+    assert ingest(tmp_path, "small.ndjson", "\n".join(original)).stage == "completed"
+    job = ingest(tmp_path, "small.ndjson", "\n".join(original[5:] + [json.dumps({"id": 99})]), update=True)
+
+    assert job.stage == "completed"
+    assert (job.chunks_added, job.chunks_kept, job.chunks_removed) == (1, 5, 5)
+    assert [text for _, text in stored_texts(services, "small.ndjson")] == original[5:] + [json.dumps({"id": 99})]
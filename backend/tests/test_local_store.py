@@ -0,0 +1,123 @@
+import threading
+
+from local_store import LocalVectorStore
+
+CHUNKS = [
+    "alpha apples and apricots",
+    "bravo bananas and blueberries",
+    "charlie cherries and currants",
+    "delta dates and dragonfruit",
+]
+
+
+def top_hit(store, filename, text):
+    return store.search(filename, text, 1)[0]
+
+
+def test_search_finds_each_chunk(tmp_path, embedder):
+    store = LocalVectorStore(str(tmp_path), embedder)
+    store.add_chunks("doc.txt", CHUNKS)
+    for chunk_id, text in enumerate(CHUNKS):
+        hit = top_hit(store, "doc.txt", text)
+        assert (hit["chunk_id"], hit["text_chunk"]) == (chunk_id, text)
+    store.close()
+
+
+def test_update_then_reopen_keeps_rows_and_vectors_aligned(tmp_path, embedder):
+    store = LocalVectorStore(str(tmp_path), embedder)
+    store.add_chunks("doc.txt", CHUNKS)
+    stored = {chunk["text_chunk"]: chunk["uuid"] for chunk in store.fetch_chunks("doc.txt")}
+    # An update that swaps the second and third paragraph renumbers the kept chunks in place
+    store.update_chunks("doc.txt", [(stored[CHUNKS[1]], 2, None), (stored[CHUNKS[2]], 1, None)])
+    store.close()
+
+    store = LocalVectorStore(str(tmp_path), embedder)
+    for text in CHUNKS:
+        hit = top_hit(store, "doc.txt", text)
+        assert hit["text_chunk"] == text
+        assert hit["distance"] < 1e-5
+    assert [chunk["text_chunk"] for chunk in store.fetch_chunks("doc.txt")] == [CHUNKS[0], CHUNKS[2], CHUNKS[1], CHUNKS[3]]
+    store.close()
+
+
+def test_delete_chunks_and_document(tmp_path, embedder):
+    store = LocalVectorStore(str(tmp_path), embedder)
+    store.add_chunks("a.txt", CHUNKS)
+    store.add_chunks("b.txt", CHUNKS[:2])
+    uuids = [chunk["uuid"] for chunk in store.fetch_chunks("a.txt")]
+    assert store.delete_chunks("a.txt", uuids[:2]) == 2
+    assert store.list_documents() == {"a.txt": 2, "b.txt": 2}
+    assert top_hit(store, "a.txt", CHUNKS[3])["text_chunk"] == CHUNKS[3]
+
+    store.delete_document("a.txt")
+    assert store.list_documents() == {"b.txt": 2}
+    assert not store.document_exists("a.txt")
+    assert store.search("a.txt", CHUNKS[3], 3) == []
+    assert {hit["filename"] for hit in store.search(None, CHUNKS[0], 5)} == {"b.txt"}
+    store.close()
+
+
+def test_search_while_ingesting(tmp_path, embedder):
+    store = LocalVectorStore(str(tmp_path), embedder)
+    store.add_chunks("seed.txt", CHUNKS)
+    errors = []
+    done = threading.Event()
+
+    def write():
+        try:
+            # Enough rows to grow (and remap) the matrix several times
+            for i in range(40):
+                store.add_chunks(f"doc{i}.txt", [f"{text} {i} {j}" for j in range(50) for text in CHUNKS[:1]])
+                if i % 3 == 0:
+                    store.delete_document(f"doc{i // 2}.txt")
+                if i % 10 == 9:
+                    store.compact()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                assert store.search("seed.txt", CHUNKS[1], 1)[0]["text_chunk"] == CHUNKS[1]
+                store.search(None, CHUNKS[0], 5)
+                store.get_chunks([("seed.txt", 0), ("doc1.txt", 3)])
+                list(store.fetch_chunks("seed.txt"))
+                store.list_documents()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.close()
+    assert errors == []
+
+
+def test_compact_reclaims_deleted_rows(tmp_path, embedder):
+    store = LocalVectorStore(str(tmp_path), embedder)
+    store.add_chunks("old.txt", [f"old entry {i}" for i in range(1500)])
+    store.add_chunks("doc.txt", CHUNKS)
+    store.add_chunks("other.txt", [f"other entry {i}" for i in range(1000)])
+    size = (tmp_path / "vectors.f32").stat().st_size
+    store.delete_document("old.txt")
+    store.delete_chunks("other.txt", [chunk["uuid"] for chunk in store.fetch_chunks("other.txt")][:500])
+
+    assert store.compact() == 2000
+    assert store.compact() == 0
+    assert (tmp_path / "vectors.f32").stat().st_size < size
+    assert store.list_documents() == {"doc.txt": 4, "other.txt": 500}
+    for text in CHUNKS:
+        assert top_hit(store, "doc.txt", text)["distance"] < 1e-5
+    assert top_hit(store, None, "other entry 999")["text_chunk"] == "other entry 999"
+    store.add_chunks("new.txt", ["echo eggplants and elderberries"])
+    store.close()
+
+    store = LocalVectorStore(str(tmp_path), embedder)
+    assert store.list_documents() == {"doc.txt": 4, "other.txt": 500, "new.txt": 1}
+    for text in CHUNKS + ["echo eggplants and elderberries", "other entry 700"]:
+        assert top_hit(store, None, text)["text_chunk"] == text
+    store.close()
@@ -0,0 +1,79 @@
+import numpy as np
+
+import search_index as search_index_module
+from search_index import SearchIndex, decode_postings, tokenize
+
+CHUNKS = [
+    "invoice AB-1234 was paid in march",
+    "the march report covers invoices and payments",
+    "shipping delays in april",
+]
+
+
+def open_index(path):
+    index = SearchIndex(str(path))
+    index.load()
+    return index
+
+
+def postings_count(index):
+    return index._db.execute("SELECT SUM(count) FROM postings").fetchone()[0] or 0
+
+
+def test_add_and_search(tmp_path):
+    index = open_index(tmp_path)
+    index.add("a.txt", CHUNKS)
+    index.add("b.txt", ["nothing relevant here"], start_id=5)
+    assert index.search("ab-1234", 5)[0][:2] == ("a.txt", 0)
+    assert {hit[:2] for hit in index.search("march", 5)} == {("a.txt", 0), ("a.txt", 1)}
+    assert index.search("relevant", 5, filename="b.txt")[0][:2] == ("b.txt", 5)
+    assert index.search("relevant", 5, filename="a.txt") == []
+    assert index.search("relevant", 5, filename="missing.txt") == []
+    index.close()
+
+
+def test_removed_documents_leave_the_statistics(tmp_path):
+    index = open_index(tmp_path)
+    index.add("a.txt", CHUNKS)
+    before = index.search("april shipping", 5)
+    index.add("noise.txt", [f"april note {i} with many more words in it" for i in range(50)])
+    index.remove_document("noise.txt")
+    assert not index.has_document("noise.txt")
+    assert index.live_count == len(CHUNKS)
+    # Scores are the same as if the removed document had never been indexed
+    assert np.allclose([hit[2] for hit in index.search("april shipping", 5)], [hit[2] for hit in before])
+    index.close()
+
+    index = open_index(tmp_path)
+    assert index.live_count == len(CHUNKS)
+    assert np.allclose([hit[2] for hit in index.search("april shipping", 5)], [hit[2] for hit in before])
+    index.close()
+
+
+def test_compaction_reclaims_removed_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_index_module, "COMPACT_MIN_DELETED", 10)
+    index = open_index(tmp_path)
+    index.add("keep.txt", CHUNKS)
+    expected = index.search("march", 5)
+    for i in range(5):
+        index.add(f"old{i}.txt", [f"march entry {i} {j}" for j in range(10)])
+    index.remove_document("old0.txt")
+    assert index.doc_count == 53 and index.live_count == 43
+
+    for i in range(1, 5):
+        index.remove_document(f"old{i}.txt")
+    # Compacted on a threshold: the tombstones and their postings are gone
+    assert index.doc_count == index.live_count == len(CHUNKS)
+    assert postings_count(index) == sum(len(set(tokenize(chunk))) for chunk in CHUNKS)
+    for count, data in index._db.execute("SELECT count, data FROM postings"):
+        assert np.all(decode_postings(data, count)[0] < len(CHUNKS))
+    assert index.search("march", 5) == expected
+
+    index.add("new.txt", ["march again"])
+    index.close()
+
+    index = open_index(tmp_path)
+    assert index.doc_count == len(CHUNKS) + 1
+    assert [hit[:2] for hit in index.search("again", 5)] == [("new.txt", 0)]
+    assert index.search("ab-1234", 5)[0][:2] == ("keep.txt", 0)
+    index.close()
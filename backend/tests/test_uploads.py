@@ -0,0 +1,124 @@
+import asyncio
+import io
+import json
+import os
+import zipfile
+
+import pytest
+from fastapi import UploadFile
+
+import bulk_upload
+from bulk_upload import ArchiveError, iter_archive
+from jobs import JobManager
+from routes import documents
+
+
+def upload_concurrently(manager, filename, data, count):
+    async def run():
+        try:
+            responses = await asyncio.gather(*(
+                documents.upload_document(UploadFile(io.BytesIO(data), filename=filename), update=False)
+                for _ in range(count)
+            ))
+            for job in list(manager._jobs.values()):
+                await job.finished.wait()
+            return responses
+        finally:
+            manager.shutdown()
+
+    return asyncio.run(run())
+
+
+def test_concurrent_uploads_of_a_new_name_ingest_once(services, monkeypatch):
+    manager = JobManager(max_workers=1)
+    monkeypatch.setattr(documents, "job_manager", manager)
+    data = "\n".join(json.dumps({"id": i}) for i in range(50)).encode()
+
+    responses = upload_concurrently(manager, "twice.ndjson", data, 2)
+
+    accepted = [response for response in responses if isinstance(response, dict)]
+    rejected = [response for response in responses if not isinstance(response, dict)]
+    assert len(accepted) == 1
+    assert [response.status_code for response in rejected] == [409]
+    assert services.list_documents()["twice.ndjson"] == 50
+    assert not manager.is_pending("twice.ndjson")
+
+
+def write_zip(path, members):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return str(path)
+
+
+def test_archive_limits(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_upload, "UPLOAD_TMP_DIR", str(tmp_path / "uploads"))
+    path = write_zip(tmp_path / "many.zip", {f"{i}.json": "{}" for i in range(3)})
+    with pytest.raises(ArchiveError, match="more than 2 files"):
+        list(iter_archive(path, max_members=2))
+
+    # A highly compressible member: tiny on the wire, large once extracted
+    path = write_zip(tmp_path / "bomb.zip", {"ok.json": "{}", "bomb.json": " " * 100000})
+    members = iter_archive(path, max_bytes=50000)
+    name, temp_path = next(members)
+    assert name == "ok.json" and os.path.exists(temp_path)
+    with pytest.raises(ArchiveError) as error:
+        next(members)
+    assert error.value.status_code == 413
+    assert os.listdir(tmp_path / "uploads") == [os.path.basename(temp_path)]
+
+
+def test_corrupt_archive_is_rejected_and_the_upload_goes_on(services, tmp_path, monkeypatch):
+    manager = JobManager(max_workers=1)
+    monkeypatch.setattr(documents, "job_manager", manager)
+    corrupt = tmp_path / "corrupt.tar.gz"
+    corrupt.write_bytes(b"\x1f\x8b" + os.urandom(200))
+    good = write_zip(tmp_path / "good.zip", {"bulk-a.json": json.dumps([{"id": 1}, {"id": 2}])})
+
+    async def parts(request):
+        for path in (str(corrupt), good):
+            yield os.path.basename(path), path
+
+    monkeypatch.setattr(documents, "iter_multipart_files", parts)
+
+    async def run():
+        try:
+            return [json.loads(line) async for line in documents._bulk_events(None, False)]
+        finally:
+            manager.shutdown()
+
+    events = asyncio.run(run())
+    assert events[0]["filename"] == "corrupt.tar.gz"
+    assert (events[0]["status"], events[0]["status_code"]) == ("rejected", 400)
+    assert [(event["filename"], event["status"]) for event in events[1:]] == [
+        ("bulk-a.json", "queued"), ("bulk-a.json", "completed")
+    ]
+    assert services.list_documents()["bulk-a.json"] == 2
+
+
+def test_archive_members_keep_their_relative_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_upload, "UPLOAD_TMP_DIR", str(tmp_path / "uploads"))
+    path = write_zip(tmp_path / "nested.zip", {"a/report.json": "{}", "b/report.json": "[]", "./c//notes.json": "{}"})
+    assert sorted(name for name, _ in iter_archive(path)) == ["a/report.json", "b/report.json", "c/notes.json"]
+
+    for unsafe in ("../escape.json", "/etc/escape.json", "a/../../escape.json", "C:\\escape.json"):
+        path = write_zip(tmp_path / "unsafe.zip", {"ok.json": "{}", unsafe: "{}"})
+        with pytest.raises(ArchiveError, match="unsafe path"):
+            list(iter_archive(path))
+    assert bulk_upload.document_name("a\\b\\report.json") == "a/b/report.json"
+    assert documents.check_upload("../report.json", "json", False)[0] == 400
+
+
+def test_failed_submit_removes_the_saved_upload(tmp_path, monkeypatch):
+    manager = JobManager(max_workers=1)
+    monkeypatch.setattr(documents, "job_manager", manager)
+    monkeypatch.setattr(bulk_upload, "UPLOAD_TMP_DIR", str(tmp_path / "uploads"))
+
+    def submit(*args, **kwargs):
+        raise RuntimeError("job queue closed")
+
+    monkeypatch.setattr(manager, "submit", submit)
+    responses = upload_concurrently(manager, "lost.json", b"{}", 1)
+    assert responses[0].status_code == 500
+    assert os.listdir(tmp_path / "uploads") == []
+    assert not manager.is_pending("lost.json")
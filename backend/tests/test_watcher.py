@@ -0,0 +1,74 @@
+import watcher_service
+from watcher_manifest import WatchManifest
+
+
+class FakeUploader:
+    """Records uploads instead of posting them; outcome is returned for every upload."""
+
+    def __init__(self, outcome="uploaded"):
+        self.outcome = outcome
+        self.uploads = []
+
+    def submit(self, task, *args):
+        task(*args)
+
+    def upload(self, file_path, filename, update=False):
+        self.uploads.append((filename, update))
+        return self.outcome
+
+
+def watcher(tmp_path, monkeypatch, outcome="uploaded"):
+    watched = tmp_path / "watched"
+    monkeypatch.setattr(watcher_service, "WATCH_DIRECTORY", str(watched))
+    monkeypatch.setattr(watcher_service, "WATCH_RECURSIVE", True)
+    monkeypatch.setattr(watcher_service, "DELETE_AFTER_UPLOAD", False)
+    monkeypatch.setattr(watcher_service, "DEBOUNCE_SECONDS", 0)
+    monkeypatch.setattr(watcher_service, "FULL_SCAN_EVERY", 1)
+    manifest = WatchManifest(str(tmp_path / "manifest.db"))
+    handler = watcher_service.DocumentHandler(FakeUploader(outcome), manifest)
+    return watched, handler
+
+
+def scan(handler):
+    # The first flush records the stat, the second finds it unchanged
+    handler.scan_directory()
+    handler.flush_pending()
+    handler.flush_pending()
+
+
+def test_subdirectories_are_uploaded_under_their_relative_path(tmp_path, monkeypatch):
+    watched, handler = watcher(tmp_path, monkeypatch)
+    for directory in ("a", "b"):
+        (watched / directory).mkdir()
+        (watched / directory / "report.json").write_text(f'{{"from": "{directory}"}}')
+    scan(handler)
+    assert sorted(handler.uploader.uploads) == [("a/report.json", True), ("b/report.json", True)]
+    handler.manifest.close()
+
+
+def test_rejected_files_are_not_uploaded_again_until_changed(tmp_path, monkeypatch):
+    watched, handler = watcher(tmp_path, monkeypatch, outcome="rejected")
+    (watched / "broken.json").write_text("{")
+    scan(handler)
+    scan(handler)
+    assert handler.uploader.uploads == [("broken.json", True)]
+    assert handler.manifest.is_rejected(str(watched / "broken.json"))
+
+    (watched / "broken.json").write_text("{}")
+    scan(handler)
+    assert len(handler.uploader.uploads) == 2
+    handler.manifest.close()
+
+
+def test_full_scan_prunes_missing_files(tmp_path, monkeypatch):
+    watched, handler = watcher(tmp_path, monkeypatch)
+    (watched / "kept.json").write_text("{}")
+    (watched / "gone.json").write_text("[]")
+    scan(handler)
+    assert len(handler.manifest) == 2
+
+    (watched / "gone.json").unlink()
+    scan(handler)
+    assert len(handler.manifest) == 1
+    assert handler.manifest.get_hash(str(watched / "kept.json")) is not None
+    handler.manifest.close()
@@ -1,38 +1,257 @@
+import hashlib
 import json
-import pymupdf  # PyMuPDF
-import docx
-import tiktoken
 import re
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from aggregates import ColumnBuilder
+from config import JSON_BATCH_SIZE
+
+SUPPORTED_FILE_TYPES = ["pdf", "docx", "json", "ndjson", "jsonl", "txt"]
+JSON_FILE_TYPES = ["json", "ndjson", "jsonl"]
+
+# Split point after a sentence-ending punctuation mark followed by whitespace and a capital letter
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])(?=\s+[A-Z])')
+
+# Target size (characters) of the text pieces fed to the streaming chunker
+PAGE_BLOCK_SIZE = 64 * 1024
+
+# Smallest page range handed to one worker when extracting a PDF in parallel
+PDF_PAGES_PER_TASK = 25
+
+# Characters read at a time when streaming a JSON array
+JSON_READ_SIZE = 1024 * 1024
+
+_encoding = None
+
+# PyMuPDF, python-docx and tiktoken are slow to import; each is imported on first use
+def get_encoding():
+    """Return the shared cl100k_base tokenizer, loading it on first use."""
+    global _encoding
+    if _encoding is None:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")  # OpenAI's tokenizer
+    return _encoding
+
+def warm_up():
+    """Import the format libraries and load the tokenizer ahead of the first document."""
+    import pymupdf  # noqa: F401
+    import docx  # noqa: F401
+    get_encoding()
+
+class TimedIterator:
+    """Wrap an iterator, accumulating the time spent producing its items in seconds."""
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+def chunk_hash(chunk):
+    """Content hash identifying a chunk's text, used to skip re-embedding unchanged chunks."""
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
 
 # Helper Function: Extract text from files
-def extract_text(file_path, file_type):
+def extract_text(file_path, file_type, workers=1):
     """
     Extract text content from various file formats.
     
     Args:
         file_path: Path to the file
         file_type: Type of file ('pdf', 'docx', 'json', 'txt')
+        workers: Number of processes to spread PDF pages over
         
     Returns:
         str: Extracted text content
     """
-    text = ""
-    if file_type == "pdf":
-        doc = pymupdf.open(file_path)
-        for page in doc:
-            text += page.get_text("text") + "\n"
-    elif file_type == "docx":
-        doc = docx.Document(file_path)
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-    elif file_type == "json":
+    if file_type == "json":
         with open(file_path, "r", encoding="utf-8") as f:
             json_data = json.load(f)
-            text = json.dumps(json_data, indent=2)  # Convert JSON to string
+            return json.dumps(json_data, indent=2)  # Convert JSON to string
+    return "".join(extract_pages(file_path, file_type, workers))
+
+# Helper Function: Extract pages, in parallel for PDFs
+def extract_pages(file_path, file_type, workers=1, executor=None):
+    """
+    Extract the text of a file as a list of pages, in document order.
+    
+    PDF page ranges are split across worker processes, each opening the file
+    itself; other formats are read sequentially (see iter_pages).
+    
+    Args:
+        file_path: Path to the file
+        file_type: Type of file ('pdf', 'docx', 'txt')
+        workers: Number of processes to spread PDF pages over
+        executor: Optional process pool to use instead of a temporary one
+        
+    Returns:
+        list: Page texts (PDF) or text blocks (DOCX, TXT)
+    """
+    if file_type != "pdf" or (workers <= 1 and executor is None):
+        return list(iter_pages(file_path, file_type))
+
+    ranges = pdf_page_ranges(pdf_page_count(file_path), workers)
+    if executor is not None:
+        futures = [executor.submit(extract_pdf_range, file_path, start, stop) for start, stop in ranges]
+        return [page for future in futures for page in future.result()]
+    with ProcessPoolExecutor(max_workers=len(ranges) or 1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(extract_pdf_range, file_path, start, stop) for start, stop in ranges]
+        return [page for future in futures for page in future.result()]
+
+def pdf_page_count(file_path):
+    import pymupdf  # PyMuPDF
+    with pymupdf.open(file_path) as doc:
+        return doc.page_count
+
+def pdf_page_ranges(page_count, workers):
+    """Split [0, page_count) into at most `workers` contiguous ranges of at least PDF_PAGES_PER_TASK pages."""
+    if page_count == 0:
+        return []
+    tasks = max(1, min(workers, -(-page_count // PDF_PAGES_PER_TASK)))
+    size = -(-page_count // tasks)
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+# Helper Function: Extract a range of PDF pages (runs inside worker processes)
+def extract_pdf_range(file_path, start, stop):
+    """
+    Extract the text of PDF pages [start, stop).
+    
+    Args:
+        file_path: Path to the PDF
+        start: First page index (0-based)
+        stop: Page index to stop before
+        
+    Returns:
+        list: One string per page
+    """
+    import pymupdf  # PyMuPDF
+    with pymupdf.open(file_path) as doc:
+        return [doc[i].get_text("text") + "\n" for i in range(start, stop)]
+
+# Helper Function: Extract text incrementally
+def iter_pages(file_path, file_type):
+    """
+    Yield the text of a PDF, DOCX or TXT file piece by piece.
+    
+    PDFs yield one piece per page; DOCX paragraphs and TXT lines are grouped
+    into pieces of roughly PAGE_BLOCK_SIZE characters.
+    
+    Args:
+        file_path: Path to the file
+        file_type: Type of file ('pdf', 'docx', 'txt')
+        
+    Yields:
+        str: Consecutive pieces of the extracted text
+    """
+    if file_type == "pdf":
+        import pymupdf  # PyMuPDF
+        with pymupdf.open(file_path) as doc:
+            for page in doc:
+                yield page.get_text("text") + "\n"
+    elif file_type == "docx":
+        import docx
+        yield from _join_blocks(para.text + "\n" for para in docx.Document(file_path).paragraphs)
     elif file_type == "txt":
         with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-    return text
+            yield from _join_blocks(f)
+    else:
+        raise ValueError(f"Unsupported file type for page extraction: {file_type}")
+
+def _join_blocks(lines):
+    """Group lines into pieces of roughly PAGE_BLOCK_SIZE characters."""
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= PAGE_BLOCK_SIZE:
+            yield "".join(block)
+            block, size = [], 0
+    if block:
+        yield "".join(block)
+
+# Helper Function: Chunk a stream of text
+def iter_chunks(pages, chunk_size=300, overlap=50, with_pages=False):
+    """
+    Chunks a stream of text into overlapping token windows in a single pass.
+    
+    Each window holds chunk_size tokens and starts chunk_size - overlap tokens
+    after the previous one. A window that is not the last is shortened to the
+    last sentence boundary inside its overlap region, so the trimmed tail is
+    still covered by the next window. Sentence boundaries are found once per
+    piece of input by splitting on them before tokenizing, and every chunk is
+    decoded exactly once.
+    
+    Args:
+        pages: Iterable of text pieces (e.g. pages from iter_pages)
+        chunk_size: Maximum token size for each chunk
+        overlap: Number of tokens to overlap between chunks
+        with_pages: Yield (page_number, chunk) pairs, where page_number is the
+            1-based index of the piece the chunk starts in
+        
+    Yields:
+        str: Text chunks in document order (or (int, str) pairs with with_pages)
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    encoding = get_encoding()
+    stride = chunk_size - overlap
+
+    tokens = []      # buffered tokens; tokens[0] is at absolute position `offset`
+    offset = 0
+    total = 0        # absolute number of tokens seen so far
+    boundaries = []  # absolute token positions where a sentence ends
+    page_starts = [] # absolute token positions where each page begins
+    page_numbers = []
+    start = 0        # absolute start of the next window
+
+    def window(end, is_last):
+        if not is_last:
+            # Last sentence boundary in [start + stride, end)
+            i = bisect_left(boundaries, end) - 1
+            if i >= 0 and boundaries[i] >= start + stride:
+                end = boundaries[i]
+        chunk = encoding.decode(tokens[start - offset:end - offset])
+        if with_pages:
+            return page_numbers[bisect_right(page_starts, start) - 1], chunk
+        return chunk
+
+    for page_number, page in enumerate(pages, 1):
+        page_starts.append(total)
+        page_numbers.append(page_number)
+        pieces = SENTENCE_BOUNDARY.split(page)
+        for i, piece_tokens in enumerate(encoding.encode_ordinary_batch(pieces)):
+            tokens.extend(piece_tokens)
+            total += len(piece_tokens)
+            if i < len(pieces) - 1:
+                boundaries.append(total)
+
+        # Emit every window that is known not to be the last one
+        while start + chunk_size < total:
+            yield window(start + chunk_size, is_last=False)
+            start += stride
+
+        # Drop consumed tokens and boundaries
+        if start - offset > chunk_size:
+            del tokens[:start - offset]
+            offset = start
+            del boundaries[:bisect_left(boundaries, start)]
+            first_page = bisect_right(page_starts, start) - 1
+            del page_starts[:first_page], page_numbers[:first_page]
+
+    while start < total:
+        end = min(start + chunk_size, total)
+        yield window(end, is_last=end == total)
+        start += stride
 
 # Helper Function: Chunk text
 def chunk_text(text, filetype, chunk_size=300, overlap=50):
@@ -57,28 +276,192 @@ def chunk_text(text, filetype, chunk_size=300, overlap=50):
             print("Error: Invalid JSON format")
             return []
     
-    # Tokenize text
-    encoding = tiktoken.get_encoding("cl100k_base")  # OpenAI's tokenizer
-    tokens = encoding.encode(text)  # Convert text to tokens
+    return list(iter_chunks([text], chunk_size, overlap))
+
+# Helper Function: Stream records from a JSON array
+def iter_json_records(file_path):
+    """
+    Yield the elements of a top-level JSON array one at a time.
     
-    chunks = []
-    start = 0
-    while start < len(tokens):
-        end = min(start + chunk_size, len(tokens))  # Define chunk range
+    The file is read in blocks of JSON_READ_SIZE characters and each element is
+    decoded as soon as it is complete, so memory use depends on the largest
+    record rather than the file size. A file whose top-level value is not an
+    array is yielded as a single record.
+    
+    Args:
+        file_path: Path to the JSON file
+        
+    Yields:
+        Decoded JSON values, in file order
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, "r", encoding="utf-8") as f:
+        buffer = f.read(JSON_READ_SIZE).lstrip("\ufeff")
+        eof = not buffer
+        pos = _skip_whitespace(buffer, 0)
+        if buffer[pos:pos + 1] != "[":
+            f.seek(0)
+            yield json.loads(f.read().lstrip("\ufeff"))
+            return
+        pos += 1
+        expect_comma = False
+
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos == len(buffer):
+                if eof:
+                    raise json.JSONDecodeError("Unterminated JSON array", buffer, pos)
+                more = f.read(JSON_READ_SIZE)
+                eof = not more
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+
+            char = buffer[pos]
+            if char == "]":
+                return
+            if expect_comma:
+                if char != ",":
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+                pos += 1
+                expect_comma = False
+                continue
+
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                # A number or literal ending at the buffer edge may continue in the next block
+                complete = end < len(buffer) or eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                more = f.read(JSON_READ_SIZE)
+                eof = not more
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield record
+            pos = end
+            expect_comma = True
+
+def _skip_whitespace(buffer, pos):
+    while pos < len(buffer) and buffer[pos] in " \t\n\r":
+        pos += 1
+    return pos
+
+# Helper Function: Stream records from newline-delimited JSON
+def iter_ndjson_records(file_path):
+    """
+    Yield one decoded JSON value per non-empty line of an NDJSON/JSONL file.
+    
+    Args:
+        file_path: Path to the NDJSON file
         
-        # Convert tokens back to text
-        chunk_text = encoding.decode(tokens[start:end])
+    Yields:
+        Decoded JSON values, in file order
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON on line {line_number}: {e}") from e
+
+def iter_records(file_path, file_type):
+    """Stream the records of a JSON array ('json') or NDJSON/JSONL file."""
+    return iter_json_records(file_path) if file_type == "json" else iter_ndjson_records(file_path)
+
+# Helper Function: Stream JSON chunks to the ingestion job (runs inside ingestion worker processes)
+def stream_json_chunks(file_path, file_type, queue, cancelled, sidecar_path=None, batch_size=JSON_BATCH_SIZE):
+    """
+    Stream a JSON, NDJSON or JSONL file as batches of one-record-per-chunk strings.
+    
+    Batches are put on a bounded queue consumed by the ingestion job, which
+    keeps memory constant regardless of file size. A None sentinel marks the
+    end of the stream, also on error. Numeric and string fields are collected
+    into a columnar sidecar along the way.
+    
+    Args:
+        file_path: Path to the file
+        file_type: Type of file ('json', 'ndjson', 'jsonl')
+        queue: Queue receiving lists of chunk strings
+        cancelled: Event set by the consumer to stop reading early
+        sidecar_path: Directory to write the columnar aggregates sidecar to
+        batch_size: Number of records per batch
         
-        # Adjust chunk to respect sentence boundaries
-        if end < len(tokens):  # Avoid adjusting on last chunk
-            match = re.search(r'(?<=\.)\s+[A-Z]', chunk_text[::-1])  # Look for a period followed by a capital letter
-            if match:
-                end -= match.start()  # Adjust endpoint to align with sentence
-
-        # Add chunk to list
-        chunks.append(encoding.decode(tokens[start:end]))
+    Returns:
+        tuple: (number of records streamed, {"extraction": seconds, "chunking": seconds}),
+        not counting time spent waiting for the consumer
+    """
+    started = time.perf_counter()
+    waited = 0.0
+    builder = ColumnBuilder()
+    records = TimedIterator(iter_records(file_path, file_type))
+    batch = []
+
+    def timings():
+        return {"extraction": records.seconds, "chunking": time.perf_counter() - started - waited - records.seconds}
+
+    try:
+        for record in records:
+            builder.add(record)
+            batch.append(json.dumps(record, ensure_ascii=False))
+            if len(batch) >= batch_size:
+                if cancelled.is_set():
+                    return builder.count, timings()
+                put_started = time.perf_counter()
+                queue.put(batch)
+                waited += time.perf_counter() - put_started
+                batch = []
+        if batch:
+            queue.put(batch)
+        if sidecar_path is not None:
+            builder.build().save(sidecar_path)
+        return builder.count, timings()
+    finally:
+        queue.put(None)
+
+# Helper Function: Extract and chunk in one call (runs inside ingestion worker processes)
+def extract_and_chunk(file_path, file_type, sidecar_path=None):
+    """
+    Extract text from a file and split it into chunks.
+    
+    Args:
+        file_path: Path to the file
+        file_type: Type of file ('pdf', 'docx', 'json', 'ndjson', 'jsonl', 'txt')
+        sidecar_path: For JSON files, directory to write the columnar aggregates sidecar to
         
-        # Move start position with overlap
-        start += chunk_size - overlap  
+    Returns:
+        tuple: (list of text chunks, {"extraction": seconds, "chunking": seconds})
+    """
+    started = time.perf_counter()
+    if file_type in JSON_FILE_TYPES:
+        builder = ColumnBuilder()
+        chunks = []
+        pieces = TimedIterator(iter_records(file_path, file_type))
+        for record in pieces:
+            builder.add(record)
+            chunks.append(json.dumps(record, ensure_ascii=False))
+        if sidecar_path is not None:
+            builder.build().save(sidecar_path)
+    else:
+        # Extraction and chunking are interleaved; time spent producing pages is extraction
+        pieces = TimedIterator(iter_pages(file_path, file_type))
+        chunks = list(iter_chunks(pieces))
+    return chunks, {"extraction": pieces.seconds, "chunking": time.perf_counter() - started - pieces.seconds}
 
-    return chunks
\ No newline at end of file
+# Helper Function: Chunk extracted pages (runs inside ingestion worker processes)
+def chunk_pages(pages):
+    """
+    Chunk a list of pages, keeping the page number each chunk starts on.
+    
+    Args:
+        pages: Page texts in document order (e.g. from extract_pages)
+        
+    Returns:
+        tuple: (list of chunks, list of 1-based page numbers)
+    """
+    pairs = list(iter_chunks(pages, with_pages=True))
+    return [chunk for _, chunk in pairs], [page for page, _ in pairs]
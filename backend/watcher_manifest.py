@@ -0,0 +1,93 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+HASH_READ_SIZE = 1024 * 1024
+
+
+def file_hash(file_path):
+    """SHA-256 of a file's content, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(HASH_READ_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class WatchManifest:
+    """
+    Durable record of the files the watcher has uploaded, keyed by path.
+
+    Each entry keeps the size, modification time and content hash the file
+    had when it was uploaded, or when the API rejected it (so a rejected file
+    is only tried again once it changes). The whole table is held in memory,
+    so deciding whether a scanned file changed is a dictionary lookup against
+    its stat; only files whose stat changed are hashed.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "hash TEXT NOT NULL, uploaded_at REAL NOT NULL)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(files)")]
+        if "rejected" not in columns:
+            self._db.execute("ALTER TABLE files ADD COLUMN rejected INTEGER NOT NULL DEFAULT 0")
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._files = {
+            path: (size, mtime_ns, content_hash, bool(rejected))
+            for path, size, mtime_ns, content_hash, rejected in self._db.execute(
+                "SELECT path, size, mtime_ns, hash, rejected FROM files"
+            )
+        }
+
+    def __len__(self):
+        return len(self._files)
+
+    def unchanged(self, path, size, mtime_ns):
+        """True if the file was uploaded with exactly this size and modification time."""
+        entry = self._files.get(path)
+        return entry is not None and entry[0] == size and entry[1] == mtime_ns
+
+    def get_hash(self, path):
+        entry = self._files.get(path)
+        return entry[2] if entry is not None else None
+
+    def is_rejected(self, path):
+        """True if the file's recorded content was rejected by the API."""
+        entry = self._files.get(path)
+        return entry is not None and entry[3]
+
+    def record(self, path, size, mtime_ns, content_hash, rejected=False):
+        """Remember that a file was uploaded (or found identical to what was uploaded), or rejected by the API."""
+        with self._lock:
+            self._files[path] = (size, mtime_ns, content_hash, rejected)
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, hash, uploaded_at, rejected) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, content_hash, time.time(), int(rejected)),
+            )
+            self._db.commit()
+
+    def prune(self, existing):
+        """Forget every file whose path is not in existing. Returns the number of entries removed."""
+        with self._lock:
+            missing = [path for path in self._files if path not in existing]
+            for path in missing:
+                del self._files[path]
+            self._db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in missing])
+            self._db.commit()
+        return len(missing)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
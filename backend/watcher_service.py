@@ -1,9 +1,16 @@
 import os
 import time
+import uuid
+import random
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from watcher_manifest import WatchManifest, file_hash
+import metrics
 
 # Configure logging
 logging.basicConfig(
@@ -15,97 +22,460 @@ logging.basicConfig(
 # Configuration
 WATCH_DIRECTORY = os.getenv("WATCH_DIRECTORY")
 API_ENDPOINT = os.getenv("API_ENDPOINT", "http://localhost:8000/upload")
-SUPPORTED_FORMATS = ["pdf", "docx", "json", "txt"]
+SUPPORTED_FORMATS = ["pdf", "docx", "json", "ndjson", "jsonl", "txt"]
 POLLING_INTERVAL = int(os.getenv("POLLING_INTERVAL", "5"))  # seconds
+WATCH_RECURSIVE = os.getenv("WATCH_RECURSIVE", "false").lower() == "true"  # also watch subdirectories
+WATCH_MANIFEST_PATH = os.getenv("WATCH_MANIFEST_PATH", os.path.join(os.getenv("DATA_DIR", "data"), "watcher_manifest.db"))
+DELETE_AFTER_UPLOAD = os.getenv("DELETE_AFTER_UPLOAD", "true").lower() == "true"
+FULL_SCAN_EVERY = int(os.getenv("FULL_SCAN_EVERY", "12"))  # scans between full scans that also re-stat unchanged directories
+
+# Upload pipeline
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))  # concurrent uploads
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "100"))  # files queued before new files wait
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "5"))  # retries on 409/429/5xx and connection errors
+RETRY_BACKOFF = float(os.getenv("RETRY_BACKOFF", "1.0"))  # seconds; doubled after every attempt
+DEBOUNCE_SECONDS = float(os.getenv("DEBOUNCE_SECONDS", "2"))  # quiet time after the last event for a file
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "30"))  # seconds between throughput log lines
+WATCHER_METRICS_PORT = int(os.getenv("WATCHER_METRICS_PORT", "0"))  # serve Prometheus /metrics on this port (0: off)
+# Uploads are queued as ingestion jobs; a file counts as uploaded once its job completed
+JOBS_ENDPOINT = os.getenv("JOBS_ENDPOINT", API_ENDPOINT.rsplit("/", 1)[0] + "/jobs")
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))  # seconds between job status checks
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "3600"))  # seconds to wait for an ingestion job to finish
+
+UPLOAD_READ_SIZE = 1024 * 1024  # bytes read at a time when streaming a file
+
+
+UPLOAD_ATTEMPTS = metrics.Counter(
+    "rag_watcher_upload_attempts_total",
+    "Upload attempts by outcome (accepted, rejected, ingest_failed, retried, gave_up).", ("outcome",)
+)
+QUEUED_FILES = metrics.Gauge("rag_watcher_queued_files", "Files waiting for an upload worker.")
+
+
+def document_name(file_path):
+    """
+    Name a watched file is uploaded under: its path relative to WATCH_DIRECTORY.
+
+    Files in subdirectories (with WATCH_RECURSIVE) keep their directories,
+    e.g. "reports/2024/summary.pdf", so files with the same basename in
+    different directories are different documents.
+    """
+    return os.path.relpath(file_path, WATCH_DIRECTORY).replace(os.sep, "/")
+
+
+class MultipartFileStream:
+    """
+    multipart/form-data body for a single file, read from disk as it is sent.
+
+    The length is known up front, so requests sends a Content-Length header
+    and the file is never held in memory.
+    """
+
+    def __init__(self, file_path, filename=None, field="file"):
+        self.file_path = file_path
+        self.boundary = uuid.uuid4().hex
+        filename = (filename or os.path.basename(file_path)).replace('"', '%22')
+        self._head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode("utf-8")
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self._size = os.path.getsize(file_path)
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        with open(self.file_path, "rb") as f:
+            while True:
+                block = f.read(UPLOAD_READ_SIZE)
+                if not block:
+                    break
+                yield block
+        yield self._tail
+
+
+class Uploader:
+    """
+    Uploads files to the API from a bounded pool of workers.
+
+    Workers share one keep-alive connection pool. At most UPLOAD_QUEUE_SIZE
+    files wait for a worker; submit() blocks beyond that, which slows event
+    handling and scanning down to the upload rate instead of queueing without
+    bound. Rate limiting (429), a document still being processed (409),
+    server errors and connection failures are retried with exponential
+    backoff. An accepted upload is followed until its ingestion job ends; a
+    failed job is retried like a server error.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS, queue_size=UPLOAD_QUEUE_SIZE):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="uploader")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.uploaded = 0
+        self.rejected = 0
+        self.failed = 0
+        self.bytes_uploaded = 0
+        self._last_stats = (time.monotonic(), 0, 0)
+
+    def submit(self, task, *args):
+        """Run task(*args) on an upload worker, waiting while the queue is full."""
+        self._slots.acquire()
+        with self._lock:
+            self.queued += 1
+        QUEUED_FILES.inc()
+        self._executor.submit(self._run, task, *args)
+
+    def _run(self, task, *args):
+        with self._lock:
+            self.queued -= 1
+            self.in_flight += 1
+        QUEUED_FILES.dec()
+        try:
+            with metrics.IN_FLIGHT.track(operation="watcher_uploads"):
+                task(*args)
+        except Exception as e:
+            logging.error(f"Upload task failed: {str(e)}")
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def upload(self, file_path, filename, update=False):
+        """
+        Upload one file as document filename, retrying transient failures.
+
+        Returns "uploaded" once the API ingested it, "rejected" if the API
+        refused the file itself (4xx) or "failed".
+        """
+        outcome = self._upload(file_path, filename, update)
+        with self._lock:
+            if outcome == "uploaded":
+                self.uploaded += 1
+            elif outcome == "rejected":
+                self.rejected += 1
+            else:
+                self.failed += 1
+        return outcome
+
+    def _upload(self, file_path, filename, update):
+        for attempt in range(UPLOAD_RETRIES + 1):
+            retry_after = None
+            try:
+                body = MultipartFileStream(file_path, filename)
+                with metrics.stage("watcher", "upload"):
+                    response = self.session.post(
+                        API_ENDPOINT,
+                        params={"update": "true"} if update else None,
+                        data=body,
+                        headers={"Content-Type": body.content_type}
+                    )
+                if response.status_code == 200:
+                    with self._lock:
+                        self.bytes_uploaded += len(body)
+                    metrics.BYTES.inc(len(body), operation="watcher_uploaded")
+                    UPLOAD_ATTEMPTS.inc(outcome="accepted")
+                    stage, error = self._wait_for_job(response.json()["job_id"])
+                    if stage == "completed":
+                        logging.info(f"Successfully processed: {filename}")
+                        return "uploaded"
+                    UPLOAD_ATTEMPTS.inc(outcome="ingest_failed")
+                    error = f"ingestion {stage}: {error}"
+                elif response.status_code not in (409, 429) and response.status_code < 500:
+                    UPLOAD_ATTEMPTS.inc(outcome="rejected")
+                    logging.error(f"Error processing {filename}: {response.text}")
+                    return "rejected"
+                else:
+                    error = f"HTTP {response.status_code}"
+                    retry_after = response.headers.get("Retry-After")
+            except FileNotFoundError:
+                logging.error(f"File disappeared before upload: {file_path}")
+                return "failed"
+            except requests.RequestException as e:
+                error = str(e)
+
+            if attempt == UPLOAD_RETRIES:
+                UPLOAD_ATTEMPTS.inc(outcome="gave_up")
+                logging.error(f"Giving up on {filename} after {attempt + 1} attempts: {error}")
+                return "failed"
+            UPLOAD_ATTEMPTS.inc(outcome="retried")
+            delay = RETRY_BACKOFF * 2 ** attempt * (1 + random.random() / 2)
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            logging.warning(f"Upload of {filename} failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+        return "failed"
+
+    def _wait_for_job(self, job_id):
+        """Poll the ingestion job until it ends. Returns (stage, error); stage is completed, failed, lost or timed_out."""
+        deadline = time.monotonic() + JOB_TIMEOUT
+        with metrics.stage("watcher", "ingest"):
+            while time.monotonic() < deadline:
+                time.sleep(JOB_POLL_INTERVAL)
+                try:
+                    response = self.session.get(f"{JOBS_ENDPOINT}/{job_id}")
+                except requests.RequestException as e:
+                    logging.warning(f"Could not check ingestion job {job_id}: {str(e)}")
+                    continue
+                if response.status_code == 404:
+                    return "lost", "the API no longer knows the job (restarted?)"
+                if response.status_code == 200:
+                    job = response.json()
+                    if job["stage"] in ("completed", "failed"):
+                        return job["stage"], job.get("error")
+        return "timed_out", f"still running after {JOB_TIMEOUT:.0f}s"
+
+    def log_stats(self):
+        """Log queue depth and the upload rate since the previous call."""
+        now = time.monotonic()
+        with self._lock:
+            since, uploaded, bytes_uploaded = self._last_stats
+            elapsed = max(now - since, 1e-9)
+            logging.info(
+                f"Uploader: {self.queued} queued, {self.in_flight} in flight, "
+                f"{self.uploaded} uploaded, {self.rejected} rejected, {self.failed} failed; "
+                f"{(self.uploaded - uploaded) / elapsed:.2f} files/s, "
+                f"{(self.bytes_uploaded - bytes_uploaded) / elapsed / 1024 / 1024:.2f} MB/s"
+            )
+            self._last_stats = (now, self.uploaded, self.bytes_uploaded)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
 
 class DocumentHandler(FileSystemEventHandler):
-    """Handler for document file events."""
-    
-    def __init__(self):
-        self.processed_files = set()
+    """
+    Handler for document file events.
+
+    Events only mark a file as pending. A file is uploaded once no event has
+    arrived for DEBOUNCE_SECONDS and its size and modification time have not
+    changed since the previous check, so a file that is still being written
+    is uploaded once, when it is complete.
+
+    Uploaded files are recorded in a persistent manifest (path, size, mtime,
+    content hash), so nothing is uploaded twice across restarts. A file whose
+    content changed after it was uploaded is re-uploaded as an update. Files
+    the API rejects are recorded too and only retried once they change; full
+    scans drop the entries of files that no longer exist.
+    """
+
+    def __init__(self, uploader, manifest):
+        self.uploader = uploader
+        self.manifest = manifest
+        self._pending = {}  # path -> (last event time, (size, mtime) at last check)
+        self._in_flight = set()
+        self._dirs = {}  # directory -> (mtime_ns, subdirectories) as of the last scan
+        self._scans = 0
+        self._lock = threading.Lock()
         # Create the watch directory if it doesn't exist
         os.makedirs(WATCH_DIRECTORY, exist_ok=True)
-        
+
     def on_created(self, event):
         """Called when a file or directory is created."""
         if event.is_directory:
             return
-        self._process_file(event.src_path)
-    
+        self._mark_pending(event.src_path)
+
     def on_modified(self, event):
         """Called when a file or directory is modified."""
         if event.is_directory:
             return
-        self._process_file(event.src_path)
-    
-    def _process_file(self, file_path):
-        """Process a new or modified file."""
+        self._mark_pending(event.src_path)
+
+    def on_moved(self, event):
+        """Called when a file or directory is moved or renamed (e.g. an atomic save)."""
+        if event.is_directory:
+            return
+        self._mark_pending(event.dest_path)
+
+    @staticmethod
+    def _supported(file_path):
+        return file_path.split('.')[-1].lower() in SUPPORTED_FORMATS
+
+    def _mark_pending(self, file_path, stat=None):
         # Skip files that are not in supported formats
-        file_extension = file_path.split('.')[-1].lower()
-        if file_extension not in SUPPORTED_FORMATS:
+        if not self._supported(file_path):
             logging.info(f"Skipping unsupported file format: {file_path}")
             return
-        
-        # Skip if file was already processed (to avoid duplicate processing)
-        if file_path in self.processed_files:
+        if stat is None:
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                return
+        # Skip files uploaded with exactly this size and mtime (to avoid duplicate processing)
+        if self.manifest.unchanged(file_path, stat.st_size, stat.st_mtime_ns):
             return
-        
-        logging.info(f"New document detected: {file_path}")
-        
-        # Upload the file to our API
+        with self._lock:
+            if file_path in self._in_flight:
+                return
+            previous = self._pending.get(file_path)
+            self._pending[file_path] = (time.monotonic(), previous[1] if previous else None)
+
+    def flush_pending(self):
+        """Queue every pending file that has been quiet for DEBOUNCE_SECONDS and has stopped changing."""
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for file_path, (last_event, last_stat) in list(self._pending.items()):
+                if now - last_event < DEBOUNCE_SECONDS:
+                    continue
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    del self._pending[file_path]
+                    continue
+                current = (stat.st_size, stat.st_mtime_ns)
+                if current != last_stat:
+                    # Still being written (or not checked yet): look again on the next pass
+                    self._pending[file_path] = (last_event, current)
+                    continue
+                del self._pending[file_path]
+                self._in_flight.add(file_path)
+                ready.append(file_path)
+        for file_path in ready:
+            self.uploader.submit(self._process_file, file_path)
+
+    def _process_file(self, file_path):
+        """Upload a settled file unless its content is already uploaded (runs on an upload worker)."""
         try:
-            with open(file_path, 'rb') as file:
-                filename = os.path.basename(file_path)
-                files = {'file': (filename, file)}
-                response = requests.post(API_ENDPOINT, files=files)
-                
-                if response.status_code == 200:
-                    logging.info(f"Successfully processed: {filename}")
-                    self.processed_files.add(file_path)
-                    
-                    # Delete the file after successful upload
-                    try:
-                        os.remove(file_path)
-                        logging.info(f"Deleted file after successful upload: {filename}")
-                    except Exception as e:
-                        logging.error(f"Error deleting file {filename}: {str(e)}")
-                else:
-                    logging.error(f"Error processing {filename}: {response.text}")
-        except Exception as e:
-            logging.error(f"Error uploading {file_path}: {str(e)}")
-    
+            stat = os.stat(file_path)
+            with metrics.stage("watcher", "hash"):
+                content_hash = file_hash(file_path)
+            previous_hash = self.manifest.get_hash(file_path)
+            if content_hash == previous_hash:
+                # Touched but not changed: remember the new mtime and move on
+                self.manifest.record(
+                    file_path, stat.st_size, stat.st_mtime_ns, content_hash, rejected=self.manifest.is_rejected(file_path)
+                )
+                return
+
+            logging.info(f"{'Modified' if previous_hash else 'New'} document detected: {file_path}")
+            filename = document_name(file_path)
+            # Always sent as an update: the name is the file's own path, and a file
+            # dropped again after its manifest entry was pruned replaces its document
+            outcome = self.uploader.upload(file_path, filename, update=True)
+            if outcome == "failed":
+                return
+            self.manifest.record(file_path, stat.st_size, stat.st_mtime_ns, content_hash, rejected=outcome == "rejected")
+
+            if DELETE_AFTER_UPLOAD and outcome == "uploaded":
+                # Delete the file once it is ingested
+                try:
+                    os.remove(file_path)
+                    logging.info(f"Deleted file after successful upload: {filename}")
+                except Exception as e:
+                    logging.error(f"Error deleting file {filename}: {str(e)}")
+        except FileNotFoundError:
+            logging.error(f"File disappeared before upload: {file_path}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(file_path)
+
     def scan_directory(self):
-        """Scan the directory for existing files that haven't been processed yet."""
-        for filename in os.listdir(WATCH_DIRECTORY):
-            file_path = os.path.join(WATCH_DIRECTORY, filename)
-            if os.path.isfile(file_path) and file_path not in self.processed_files:
-                self._process_file(file_path)
+        """
+        Scan the watched tree for files that haven't been uploaded yet.
+
+        Uses os.scandir, whose entries carry their stat, and compares it with
+        the manifest. Directories whose mtime is unchanged since the previous
+        scan (no files added, removed or renamed) are not listed again; every
+        FULL_SCAN_EVERY scans the whole tree is re-listed to catch in-place
+        modifications that produced no event, and manifest entries of files
+        that no longer exist are dropped.
+        """
+        full = self._scans % FULL_SCAN_EVERY == 0
+        self._scans += 1
+        seen = {}
+        files = set()
+        stack = [WATCH_DIRECTORY]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+                cached = self._dirs.get(directory)
+                if not full and cached is not None and cached[0] == mtime_ns:
+                    seen[directory] = cached
+                    stack.extend(cached[1])
+                    continue
+                subdirs = []
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if WATCH_RECURSIVE:
+                                subdirs.append(entry.path)
+                        elif entry.is_file() and self._supported(entry.name):
+                            files.add(entry.path)
+                            self._mark_pending(entry.path, entry.stat())
+            except FileNotFoundError:
+                continue
+            seen[directory] = (mtime_ns, subdirs)
+            stack.extend(subdirs)
+        self._dirs = seen
+
+        # Not pruned if the watch directory itself could not be listed (e.g. an unmounted volume)
+        if full and WATCH_DIRECTORY in seen:
+            with self._lock:
+                files.update(self._in_flight)
+                files.update(self._pending)
+            pruned = self.manifest.prune(files)
+            if pruned:
+                logging.info(f"Dropped {pruned} files that no longer exist from the manifest")
 
 def main():
     """Run the document watcher service."""
     logging.info(f"Starting document watcher service on directory: {WATCH_DIRECTORY}")
-    
-    # Set up event handler and observer
-    event_handler = DocumentHandler()
+
+    if WATCHER_METRICS_PORT:
+        metrics.start_http_server(WATCHER_METRICS_PORT)
+        logging.info(f"Serving metrics on port {WATCHER_METRICS_PORT}")
+
+    # Set up uploader, manifest, event handler and observer
+    uploader = Uploader()
+    manifest = WatchManifest(WATCH_MANIFEST_PATH)
+    logging.info(f"Manifest {WATCH_MANIFEST_PATH} holds {len(manifest)} uploaded files")
+    event_handler = DocumentHandler(uploader, manifest)
     observer = Observer()
-    observer.schedule(event_handler, WATCH_DIRECTORY, recursive=False)
+    observer.schedule(event_handler, WATCH_DIRECTORY, recursive=WATCH_RECURSIVE)
     observer.start()
-    
+
     try:
         # Initial scan for existing files
         event_handler.scan_directory()
-        
+        last_scan = last_stats = time.monotonic()
+
         # Keep the service running
         while True:
+            time.sleep(min(0.5, DEBOUNCE_SECONDS))
+            event_handler.flush_pending()
+            now = time.monotonic()
             # Periodically scan directory for new files
-            time.sleep(POLLING_INTERVAL)
-            event_handler.scan_directory()
-            
+            if now - last_scan >= POLLING_INTERVAL:
+                with metrics.stage("watcher", "scan"):
+                    event_handler.scan_directory()
+                last_scan = now
+            if now - last_stats >= STATS_INTERVAL:
+                uploader.log_stats()
+                last_stats = now
+
     except KeyboardInterrupt:
         observer.stop()
-    
+
     observer.join()
+    uploader.shutdown()
+    manifest.close()
     logging.info("Document watcher service stopped")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,572 @@
+import asyncio
+import heapq
+import numpy as np
+import weaviate
+from weaviate.classes.init import AdditionalConfig, Auth
+from weaviate.config import ConnectionConfig
+from weaviate.classes.config import Configure
+from weaviate.classes.query import Filter, MetadataQuery, Sort
+from weaviate.classes.aggregate import GroupByAggregate
+from weaviate.classes.data import DataObject
+from weaviate.classes.tenants import Tenant, TenantActivityStatus
+import metrics
+from partitions import PARTITIONING_MODES, activity, partition_of
+from text_processing import chunk_hash
+from config import (
+    WEAVIATE_URL, WEAVIATE_API_KEY, COHERE_API_KEY, EMBEDDING_MODEL, STORE_POOL_SIZE, PARTITIONING,
+    PARTITION_OFFLOAD_STATUS,
+)
+
+# Objects fetched per request when iterating over the whole collection
+EXPORT_PAGE_SIZE = 1000
+# Tenants changed per request when deactivating idle partitions
+TENANT_UPDATE_BATCH = 100
+OFFLOAD_STATUSES = {"inactive": TenantActivityStatus.INACTIVE, "offloaded": TenantActivityStatus.OFFLOADED}
+
+def create_weaviate_client():
+    """Create and configure a Weaviate client connection."""
+    headers = {"X-Cohere-Api-Key": COHERE_API_KEY}
+
+    client = weaviate.connect_to_weaviate_cloud(
+        cluster_url=WEAVIATE_URL,
+        auth_credentials=Auth.api_key(WEAVIATE_API_KEY),
+        headers=headers
+    )
+
+    return client
+
+async def create_async_weaviate_client():
+    """Create and connect an async Weaviate client; must run in the event loop that will use it."""
+    client = weaviate.use_async_with_weaviate_cloud(
+        cluster_url=WEAVIATE_URL,
+        auth_credentials=Auth.api_key(WEAVIATE_API_KEY),
+        headers={"X-Cohere-Api-Key": COHERE_API_KEY},
+        additional_config=AdditionalConfig(
+            connection=ConnectionConfig(session_pool_connections=STORE_POOL_SIZE, session_pool_maxsize=STORE_POOL_SIZE)
+        ),
+    )
+    await client.connect()
+    return client
+
+def setup_collection(client, partitioning=PARTITIONING):
+    """
+    Set up the Documents collection in Weaviate if it doesn't exist.
+
+    With partitioning ("document" or "group") the collection is multi-tenant:
+    each partition is a tenant with its own index, created on first write and
+    reactivated on first use after being offloaded. An existing collection
+    cannot switch layouts in place; export a snapshot, drop the collection
+    and import the snapshot with the new setting.
+    """
+    if client.collections.exists("Documents"):
+        multi_tenant = client.collections.get("Documents").config.get().multi_tenancy_config.enabled
+        if multi_tenant != (partitioning != "none"):
+            raise RuntimeError(
+                f"The Documents collection {'is' if multi_tenant else 'is not'} partitioned but PARTITIONING is "
+                f"'{partitioning}'; migrate it with snapshot.py export/import"
+            )
+        return
+    try:
+        client.collections.create(
+            "Documents",
+            vectorizer_config=[
+                Configure.NamedVectors.text2vec_cohere(
+                    name="content_vector",
+                    source_properties=["text_chunk"],
+                    model=EMBEDDING_MODEL
+                )
+            ],
+            multi_tenancy_config=Configure.multi_tenancy(
+                enabled=True, auto_tenant_creation=True, auto_tenant_activation=True
+            ) if partitioning != "none" else None
+        )
+        print("Collection created successfully")
+    except Exception as e:
+        # Another replica may have created it since the check
+        if not client.collections.exists("Documents"):
+            raise
+        print(f"Collection created concurrently: {str(e)}")
+
+class WeaviateStore:
+    """
+    Document chunk store backed by the Weaviate Documents collection.
+
+    Ingestion runs on worker threads with the sync client; request handlers
+    use the *_async methods, which go through an async client connected by
+    connect_async() in the serving event loop, so searches never block it.
+
+    With partitioning, every call for a document goes straight to its
+    tenant (see partitions.partition_of); in "document" mode the tenant holds
+    nothing else, so searches need no filename filter and deleting the
+    document drops the tenant. Corpus-wide searches query every tenant.
+    """
+
+    backend = "weaviate"
+
+    def __init__(self, client, embedder, partitioning=PARTITIONING):
+        if partitioning not in PARTITIONING_MODES:
+            raise ValueError(f"PARTITIONING must be one of {', '.join(PARTITIONING_MODES)}, not '{partitioning}'")
+        if PARTITION_OFFLOAD_STATUS not in OFFLOAD_STATUSES:
+            raise ValueError(f"PARTITION_OFFLOAD_STATUS must be one of {', '.join(OFFLOAD_STATUSES)}")
+        self.client = client
+        self.collection = client.collections.get("Documents")
+        self.embedder = embedder
+        self.partitioning = partitioning
+        self.partitioned = partitioning != "none"
+        self.async_client = None
+        self.async_collection = None
+        self._known_partitions = set()
+
+    async def connect_async(self):
+        """Open the async client used by the *_async methods (once per worker process)."""
+        if self.async_client is None:
+            self.async_client = await create_async_weaviate_client()
+            self.async_collection = self.async_client.collections.get("Documents")
+
+    async def _get_async_collection(self, filename=None):
+        if self.async_collection is None:
+            await self.connect_async()
+        return self._for_document(self.async_collection, filename)
+
+    def _for_document(self, collection, filename):
+        """The sync or async collection, narrowed to the tenant holding the document when partitioned."""
+        partition = partition_of(filename, self.partitioning) if filename is not None else None
+        if partition is None:
+            return collection
+        activity.touch(partition)
+        return collection.with_tenant(partition)
+
+    def _document_filter(self, filename):
+        # A document's own tenant holds nothing else
+        if filename is None or self.partitioning == "document":
+            return None
+        return Filter.by_property("filename").equal(filename)
+
+    def _partition_exists(self, partition):
+        if partition not in self._known_partitions and self.collection.tenants.exists(partition):
+            self._known_partitions.add(partition)
+        return partition in self._known_partitions
+
+    def _ensure_partition(self, partition):
+        # Weaviate creates tenants on first write too; creating them here also works on servers without that
+        if not self._partition_exists(partition):
+            try:
+                self.collection.tenants.create([Tenant(name=partition)])
+            except Exception:
+                if not self.collection.tenants.exists(partition):
+                    raise
+            self._known_partitions.add(partition)
+
+    def list_partitions(self):
+        """Names of the collection's partitions (tenants); empty when not partitioned."""
+        if not self.partitioned:
+            return set()
+        partitions = set(self.collection.tenants.get())
+        self._known_partitions = set(partitions)
+        return partitions
+
+    def offload_idle_partitions(self, idle_seconds):
+        """Deactivate active partitions this process has not used for idle_seconds. Returns how many."""
+        if not self.partitioned:
+            return 0
+        active = [
+            name for name, tenant in self.collection.tenants.get().items()
+            if tenant.activity_status == TenantActivityStatus.ACTIVE
+        ]
+        idle = activity.idle(active, idle_seconds)
+        status = OFFLOAD_STATUSES[PARTITION_OFFLOAD_STATUS]
+        for i in range(0, len(idle), TENANT_UPDATE_BATCH):
+            self.collection.tenants.update([Tenant(name=name, activity_status=status) for name in idle[i:i + TENANT_UPDATE_BATCH]])
+        return len(idle)
+
+    @staticmethod
+    def _to_dict(obj, distance=None):
+        return {
+            "uuid": str(obj.uuid),
+            "filename": obj.properties["filename"],
+            "chunk_id": obj.properties["chunk_id"],
+            "text_chunk": obj.properties["text_chunk"],
+            "page": obj.properties.get("page"),
+            "distance": distance,
+        }
+
+    def document_exists(self, filename):
+        """Check whether any chunk of the document is stored."""
+        if self.partitioned and not self._partition_exists(partition_of(filename, self.partitioning)):
+            return False
+        response = self._for_document(self.collection, filename).query.fetch_objects(
+            filters=Filter.by_property("filename").equal(filename),
+            limit=1
+        )
+        return len(response.objects) > 0
+
+    async def document_exists_async(self, filename):
+        if self.partitioned and not await asyncio.to_thread(self._partition_exists, partition_of(filename, self.partitioning)):
+            return False
+        collection = await self._get_async_collection(filename)
+        response = await collection.query.fetch_objects(
+            filters=Filter.by_property("filename").equal(filename),
+            limit=1
+        )
+        return len(response.objects) > 0
+
+    def _stored_vectors(self, hashes, filename):
+        """
+        Vectors of already stored chunks with the given content hashes, as {hash: vector}.
+
+        When partitioned, only the document's own partition is searched.
+        """
+        if self.partitioned and not self._partition_exists(partition_of(filename, self.partitioning)):
+            return {}
+        collection = self._for_document(self.collection, filename)
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            response = collection.query.fetch_objects(
+                filters=Filter.by_property("content_hash").contains_any(batch),
+                include_vector=True,
+                limit=len(batch) * 2
+            )
+            for obj in response.objects:
+                vector = obj.vector.get("content_vector") if isinstance(obj.vector, dict) else None
+                if vector is not None:
+                    found.setdefault(obj.properties["content_hash"], vector)
+        return found
+
+    def _safe_stored_vectors(self, hashes, filename):
+        try:
+            return self._stored_vectors(hashes, filename)
+        except Exception as e:
+            print(f"Warning: Could not look up stored vectors: {str(e)}")
+            return {}
+
+    def add_chunks(self, filename, chunks, start_id=0, pages=None, chunk_ids=None, uuids=None):
+        """
+        Store the chunks of a document, numbered from start_id.
+        
+        pages optionally gives the page number of each chunk, chunk_ids
+        explicit (not necessarily consecutive) chunk ids and uuids the uuid of
+        each chunk (generated by default). Chunks are embedded
+        client-side and written with their vectors: text found in the embedding
+        cache or already stored reuses that vector instead of being embedded again.
+        """
+        if not chunks:
+            return 0
+        hashes = [chunk_hash(chunk) for chunk in chunks]
+        vectors = self.embedder.embed_documents(
+            chunks, hashes=hashes, lookup=lambda missing: self._safe_stored_vectors(missing, filename)
+        )
+        chunk_ids = chunk_ids if chunk_ids is not None else range(start_id, start_id + len(chunks))
+        if self.partitioned:
+            self._ensure_partition(partition_of(filename, self.partitioning))
+        collection = self._for_document(self.collection, filename)
+        with metrics.stage("ingest", "store_write"), collection.batch.dynamic() as batch:
+            for i, (chunk, chunk_id, content_hash) in enumerate(zip(chunks, chunk_ids, hashes)):
+                properties = {"filename": filename, "text_chunk": chunk, "chunk_id": chunk_id, "content_hash": content_hash}
+                if pages is not None:
+                    properties["page"] = pages[i]
+                batch.add_object(
+                    properties=properties, vector={"content_vector": vectors[i].tolist()},
+                    uuid=uuids[i] if uuids is not None else None
+                )
+        return len(chunks)
+
+    def import_chunks(self, chunks, vectors):
+        """
+        Store chunks with precomputed vectors (e.g. from a snapshot) under their own uuids.
+
+        Nothing is embedded. Weaviate batch writes overwrite objects with the
+        same uuid, so importing the same batch twice (when resuming) is
+        harmless. Returns the number of chunks written.
+        """
+        # One write per partition; unpartitioned, everything goes to the collection itself
+        objects = {}
+        for chunk, vector in zip(chunks, vectors):
+            properties = {
+                "filename": chunk["filename"],
+                "text_chunk": chunk["text_chunk"],
+                "chunk_id": chunk["chunk_id"],
+                "content_hash": chunk["hash"],
+            }
+            if chunk["page"] is not None:
+                properties["page"] = chunk["page"]
+            objects.setdefault(chunk["filename"] if self.partitioned else None, []).append(
+                DataObject(properties=properties, uuid=chunk["uuid"], vector={"content_vector": vector.tolist()})
+            )
+        by_partition = {}
+        for filename, partition_objects in objects.items():
+            partition = partition_of(filename, self.partitioning) if filename is not None else None
+            by_partition.setdefault(partition, (filename, []))[1].extend(partition_objects)
+        with metrics.stage("ingest", "store_write"):
+            for partition, (filename, partition_objects) in by_partition.items():
+                if partition is not None:
+                    self._ensure_partition(partition)
+                result = self._for_document(self.collection, filename).data.insert_many(partition_objects)
+                if result.has_errors:
+                    error = next(iter(result.errors.values()))
+                    raise RuntimeError(
+                        f"{len(result.errors)} of {len(partition_objects)} chunks failed to import: {error.message}"
+                    )
+        return len(chunks)
+
+    def export_chunks(self, after=None, batch_size=1000):
+        """
+        Yield every stored chunk with its vector, as (chunks, vectors, cursor) batches in uuid order
+        (partition by partition when partitioned).
+
+        Chunks carry uuid, filename, chunk_id, text_chunk, page and hash;
+        passing a batch's cursor as after continues with the next batch.
+        """
+        chunks, vectors = [], []
+        for obj, cursor in self._iterate_objects(after, min(batch_size, EXPORT_PAGE_SIZE)):
+            chunk = self._to_dict(obj)
+            del chunk["distance"]
+            chunk["hash"] = obj.properties.get("content_hash") or chunk_hash(chunk["text_chunk"])
+            chunks.append(chunk)
+            vectors.append(obj.vector["content_vector"])
+            if len(chunks) == batch_size:
+                yield chunks, np.asarray(vectors, dtype=np.float32), cursor
+                chunks, vectors = [], []
+        if chunks:
+            yield chunks, np.asarray(vectors, dtype=np.float32), cursor
+
+    def _iterate_objects(self, after, page_size):
+        """Yield (object, cursor) for every object; a partitioned cursor is "partition:uuid"."""
+        options = {
+            "include_vector": True,
+            "return_properties": ["filename", "chunk_id", "text_chunk", "page", "content_hash"],
+            "cache_size": page_size,
+        }
+        if not self.partitioned:
+            for obj in self.collection.iterator(after=after, **options):
+                yield obj, str(obj.uuid)
+            return
+        start, after_uuid = after.split(":", 1) if after else (None, None)
+        for partition in sorted(self.list_partitions()):
+            if start is not None and partition < start:
+                continue
+            collection = self.collection.with_tenant(partition)
+            for obj in collection.iterator(after=after_uuid if partition == start else None, **options):
+                yield obj, f"{partition}:{obj.uuid}"
+
+    def update_chunks(self, filename, updates):
+        """Renumber stored chunks of a document without re-vectorizing them; updates are (uuid, chunk_id, page) tuples."""
+        collection = self._for_document(self.collection, filename)
+        for uid, chunk_id, page in updates:
+            properties = {"chunk_id": chunk_id}
+            if page is not None:
+                properties["page"] = page
+            collection.data.update(uuid=uid, properties=properties)
+
+    def delete_chunks(self, filename, uuids):
+        """Delete chunks of a document by uuid. Returns the number of chunks deleted."""
+        uuids = list(uuids)
+        collection = self._for_document(self.collection, filename)
+        deleted = 0
+        for i in range(0, len(uuids), 500):
+            result = collection.data.delete_many(
+                where=Filter.by_property("filename").equal(filename) & Filter.by_id().contains_any(uuids[i:i + 500])
+            )
+            deleted += result.successful
+        return deleted
+
+    def delete_document(self, filename):
+        """
+        Delete every chunk of a document.
+
+        In "document" partitioning this drops the document's tenant; otherwise
+        the chunks are deleted by filename, in rounds of at most the server's
+        query limit.
+        """
+        partition = partition_of(filename, self.partitioning)
+        if self.partitioning == "document":
+            if self._partition_exists(partition):
+                self.collection.tenants.remove([partition])
+            self._known_partitions.discard(partition)
+            activity.forget(partition)
+            return
+        if partition is not None and not self._partition_exists(partition):
+            return
+        collection = self._for_document(self.collection, filename)
+        while collection.data.delete_many(where=Filter.by_property("filename").equal(filename)).successful:
+            pass
+
+    def compact(self):
+        """Nothing to reclaim client-side: Weaviate frees deleted objects itself. Returns 0."""
+        return 0
+
+    def list_documents(self, limit=100000):
+        """
+        Return {filename: chunk_count} for every stored document.
+
+        When partitioned this aggregates each partition in turn, which also
+        reactivates offloaded ones. The aggregate cannot page, so a collection
+        with limit or more documents is counted by walking its objects with
+        the cursor instead, keeping the listing complete.
+        """
+        collections = (
+            [self.collection.with_tenant(partition) for partition in sorted(self.list_partitions())]
+            if self.partitioned else [self.collection]
+        )
+        documents = {}
+        for collection in collections:
+            response = collection.aggregate.over_all(
+                group_by=GroupByAggregate(prop="filename", limit=limit),
+                total_count=True
+            )
+            if len(response.groups) < limit:
+                documents.update({group.grouped_by.value: group.total_count for group in response.groups})
+                continue
+            counts = {}
+            for obj in collection.iterator(return_properties=["filename"], cache_size=EXPORT_PAGE_SIZE):
+                filename = obj.properties["filename"]
+                counts[filename] = counts.get(filename, 0) + 1
+            documents.update(counts)
+        return documents
+
+    def embed_query(self, query):
+        """Embed a query client-side with the collection's Cohere model."""
+        return self.embedder.embed_query(query)
+
+    def embed_queries(self, queries):
+        """Embed several queries with one Cohere call."""
+        return self.embedder.embed_queries(queries)
+
+    async def embed_query_async(self, query):
+        return await self.embedder.embed_query_async(query)
+
+    async def embed_queries_async(self, queries):
+        return await self.embedder.embed_queries_async(queries)
+
+    def search(self, filename, query, top_k, vector=None):
+        """
+        Return the top_k chunks of a document closest to the query, nearest first.
+        
+        With a precomputed query vector (from embed_query) the search skips server-side vectorization.
+        With filename=None the whole collection is searched (when partitioned, every partition in turn).
+        """
+        if filename is None and self.partitioned:
+            # Embed once instead of once per partition
+            vector = self.embed_query(query) if vector is None else vector
+            hits = []
+            for partition in self.list_partitions():
+                collection = self.collection.with_tenant(partition)
+                hits.extend(self._search_hits(self._search_call(collection, None, query, top_k, vector)))
+            return self._nearest(hits, top_k)
+        collection = self._for_document(self.collection, filename)
+        return self._search_hits(self._search_call(collection, self._document_filter(filename), query, top_k, vector))
+
+    async def search_async(self, filename, query, top_k, vector=None):
+        """search() on the async client; a corpus-wide search queries the partitions concurrently."""
+        if filename is None and self.partitioned:
+            vector = await self.embed_query_async(query) if vector is None else vector
+            collection = await self._get_async_collection()
+            partitions = await collection.tenants.get()
+            limit = asyncio.Semaphore(STORE_POOL_SIZE)
+
+            async def search_partition(partition):
+                async with limit:
+                    response = await self._search_call(collection.with_tenant(partition), None, query, top_k, vector)
+                return self._search_hits(response)
+
+            results = await asyncio.gather(*(search_partition(partition) for partition in partitions))
+            return self._nearest([hit for hits in results for hit in hits], top_k)
+        collection = await self._get_async_collection(filename)
+        return self._search_hits(await self._search_call(collection, self._document_filter(filename), query, top_k, vector))
+
+    @staticmethod
+    def _nearest(hits, top_k):
+        return heapq.nsmallest(top_k, hits, key=lambda hit: hit["distance"])
+
+    @staticmethod
+    def _search_call(collection, filters, query, top_k, vector):
+        # The sync and async collections share the query API; this returns the response or its coroutine
+        if vector is not None:
+            return collection.query.near_vector(
+                near_vector=[float(x) for x in vector],
+                target_vector="content_vector",
+                filters=filters,
+                limit=top_k,
+                return_metadata=MetadataQuery(distance=True)
+            )
+        return collection.query.near_text(
+            query=query,
+            filters=filters,
+            limit=top_k,
+            return_metadata=MetadataQuery(distance=True)
+        )
+
+    def _search_hits(self, response):
+        return [self._to_dict(obj, obj.metadata.distance) for obj in response.objects]
+
+    @staticmethod
+    def _chunk_ids_by_file(refs):
+        by_file = {}
+        for filename, chunk_id in refs:
+            by_file.setdefault(filename, []).append(int(chunk_id))
+        return by_file
+
+    @staticmethod
+    def _chunks_filter(filename, chunk_ids):
+        return Filter.by_property("filename").equal(filename) & Filter.by_property("chunk_id").contains_any(chunk_ids)
+
+    def _add_chunks(self, chunks, response):
+        for obj in response.objects:
+            chunk = self._to_dict(obj)
+            chunks[(chunk["filename"], chunk["chunk_id"])] = chunk
+
+    def get_chunks(self, refs):
+        """Return {(filename, chunk_id): chunk} for the given (filename, chunk_id) pairs."""
+        chunks = {}
+        for filename, chunk_ids in self._chunk_ids_by_file(refs).items():
+            response = self._for_document(self.collection, filename).query.fetch_objects(
+                filters=self._chunks_filter(filename, chunk_ids), limit=len(chunk_ids)
+            )
+            self._add_chunks(chunks, response)
+        return chunks
+
+    async def get_chunks_async(self, refs):
+        """get_chunks() on the async client, fetching the documents concurrently."""
+        collection = await self._get_async_collection()
+        by_file = self._chunk_ids_by_file(refs)
+        responses = await asyncio.gather(*(
+            self._for_document(collection, filename).query.fetch_objects(
+                filters=self._chunks_filter(filename, chunk_ids), limit=len(chunk_ids)
+            )
+            for filename, chunk_ids in by_file.items()
+        ))
+        chunks = {}
+        for response in responses:
+            self._add_chunks(chunks, response)
+        return chunks
+
+    def fetch_chunks(self, filename, after=None, page_size=1000):
+        """Yield the chunks of a document in chunk_id order (those after chunk_id `after`), one page at a time."""
+        if self.partitioned and not self._partition_exists(partition_of(filename, self.partitioning)):
+            return
+        collection = self._for_document(self.collection, filename)
+        last_chunk_id = -1 if after is None else after
+        while True:
+            response = collection.query.fetch_objects(
+                filters=Filter.by_property("filename").equal(filename)
+                & Filter.by_property("chunk_id").greater_than(last_chunk_id),
+                sort=Sort.by_property("chunk_id"),
+                limit=page_size
+            )
+            for obj in response.objects:
+                yield self._to_dict(obj)
+            if len(response.objects) < page_size:
+                return
+            last_chunk_id = response.objects[-1].properties["chunk_id"]
+
+    async def aclose(self):
+        """Close the async clients (before close(), from the event loop)."""
+        if self.async_client is not None:
+            await self.async_client.close()
+            self.async_client = self.async_collection = None
+        await self.embedder.aclose()
+
+    def close(self):
+        self.client.close()
+        self.embedder.close()